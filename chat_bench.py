@@ -0,0 +1,536 @@
+#!/usr/bin/env python3
+"""
+Load generator and latency benchmark for chat_server.
+
+Spawns many simulated clients on localhost that speak the chat_utils
+protocol: each logs in, joins a group of --group-size peers with
+`connect`, then sends `exchange` messages at --rate per second, mixed
+with `search`, `poem` and `list` requests (--mix).  Clients are spread
+over --procs processes, each driving its sockets from one selector loop.
+
+Every exchange carries its send time (CLOCK_MONOTONIC, which is shared
+by all processes on the host), so receivers measure end-to-end delivery
+latency.  Query latency is measured from request to response.  Server
+CPU time and RSS are sampled from /proc for the server process and its
+children (cluster workers included).
+
+    python chat_bench.py --spawn-server --clients 2000 --duration 30
+    python chat_bench.py --server-pid 1234 --json out.json
+    python chat_bench.py --spawn-server --baseline last.json
+
+A plain-text summary goes to stdout; --json writes the machine-readable
+results, and --baseline compares against an earlier --json file and
+exits non-zero when throughput or p99 latency regress beyond --tolerance.
+
+Note: the server uses select(), which cannot watch descriptors past
+FD_SETSIZE (1024).  Use --server-args "-w N" for more clients than that.
+"""
+import os
+import sys
+import json
+import time
+import errno
+import random
+import shutil
+import socket
+import argparse
+import selectors
+import tempfile
+import subprocess
+import multiprocessing as mp
+
+from chat_utils import SERVER, SIZE_SPEC
+
+KINDS = ("exchange", "search", "poem", "list")
+SEARCH_TERMS = ("love", "thy", "beauty", "time", "bench", "hello", "zzz")
+
+
+# ----------------------------------------------------------------------
+# wire helpers: non-blocking framing (messages here are pure ASCII, so the
+# length prefix, counted in characters, is also the byte count)
+
+def frame(obj):
+    msg = json.dumps(obj)
+    return (('0' * SIZE_SPEC + str(len(msg)))[-SIZE_SPEC:] + msg).encode()
+
+
+class Conn:
+    def __init__(self, cid, name):
+        self.cid = cid
+        self.name = name
+        self.sock = None
+        self.inbuf = b""
+        self.outbuf = b""
+        self.state = "connecting"
+        self.pending = {k: [] for k in KINDS[1:]}   # FIFO of send times
+        self.next_send = 0.0
+
+    def frames(self):
+        while len(self.inbuf) >= SIZE_SPEC:
+            size = int(self.inbuf[:SIZE_SPEC])
+            if len(self.inbuf) < SIZE_SPEC + size:
+                return
+            raw = self.inbuf[SIZE_SPEC:SIZE_SPEC + size]
+            self.inbuf = self.inbuf[SIZE_SPEC + size:]
+            try:
+                yield json.loads(raw)
+            except ValueError:
+                continue
+
+
+# ----------------------------------------------------------------------
+# one load-generating process
+
+class Driver:
+    def __init__(self, proc, n, opts, server):
+        self.proc = proc
+        self.opts = opts
+        self.server = server
+        self.sel = selectors.DefaultSelector()
+        self.conns = [Conn(i, f"bench{proc}_{i}") for i in range(n)]
+        self.lat = {k: [] for k in KINDS}
+        self.sent = {k: 0 for k in KINDS}
+        self.errors = 0
+        self.rng = random.Random(opts.seed + proc)
+        kinds, weights = zip(*opts.mix.items())
+        self.kinds, self.weights = kinds, weights
+
+    def send(self, c, obj):
+        c.outbuf += frame(obj)
+        self.flush(c)
+
+    def flush(self, c):
+        try:
+            while c.outbuf:
+                n = c.sock.send(c.outbuf)
+                c.outbuf = c.outbuf[n:]
+        except BlockingIOError:
+            pass
+        except OSError:
+            self.drop(c)
+            return
+        events = selectors.EVENT_READ
+        if c.outbuf:
+            events |= selectors.EVENT_WRITE
+        self.sel.modify(c.sock, events, c)
+
+    def drop(self, c):
+        if c.state != "closed":
+            self.errors += 1
+            c.state = "closed"
+            try:
+                self.sel.unregister(c.sock)
+            except (KeyError, ValueError):
+                pass
+            c.sock.close()
+
+    def open_all(self):
+        """Connect and log in every client, ramping at --ramp per second."""
+        gap = self.opts.procs / self.opts.ramp
+        for c in self.conns:
+            c.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            c.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            c.sock.setblocking(False)
+            err = c.sock.connect_ex(self.server)
+            if err not in (0, errno.EINPROGRESS):
+                self.drop(c)
+                continue
+            self.sel.register(c.sock, selectors.EVENT_READ, c)
+            c.state = "login"
+            self.send(c, {"action": "login", "name": c.name})
+            self.poll(gap)
+        self.wait_for(lambda: all(c.state != "login" for c in self.conns))
+
+    def group_up(self):
+        """Every non-leader connects to its group's leader."""
+        g = self.opts.group_size
+        for i, c in enumerate(self.conns):
+            if c.state != "idle":
+                continue
+            leader = self.conns[i - i % g]
+            if leader is c:
+                if i + 1 >= len(self.conns) or g < 2:
+                    c.state = "chatting"     # nobody to talk to
+                continue
+            c.state = "connect"
+            self.send(c, {"action": "connect", "target": leader.name})
+            # connect one at a time per group so joins are not racing
+            self.wait_for(lambda: c.state != "connect")
+        for c in self.conns:
+            if c.state == "idle":
+                c.state = "chatting"
+
+    def wait_for(self, cond, limit=60.0):
+        end = time.monotonic() + limit
+        while not cond() and time.monotonic() < end:
+            self.poll(0.05)
+
+    def poll(self, timeout):
+        for key, events in self.sel.select(timeout):
+            c = key.data
+            if events & selectors.EVENT_WRITE:
+                self.flush(c)
+            if events & selectors.EVENT_READ:
+                self.read(c)
+
+    def read(self, c):
+        try:
+            data = c.sock.recv(65536)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b""
+        if not data:
+            self.drop(c)
+            return
+        c.inbuf += data
+        now = time.monotonic_ns()
+        for msg in c.frames():
+            act = msg.get("action")
+            if act == "login":
+                c.state = "idle" if msg.get("status") == "ok" else "closed"
+            elif act == "connect":
+                if msg.get("status") in ("success", "request"):
+                    if c.state == "connect":
+                        c.state = "chatting"
+                    elif msg.get("status") == "request" and c.state == "idle":
+                        c.state = "chatting"
+                elif c.state == "connect":
+                    self.errors += 1
+                    c.state = "chatting"
+            elif act == "exchange":
+                try:
+                    sent = int(msg.get("message", "").split("|")[0])
+                except ValueError:
+                    continue
+                self.lat["exchange"].append(now - sent)
+            elif "chunk" in msg:
+                continue                 # timed to the closing "done" frame
+            elif act in c.pending and c.pending[act]:
+                self.lat[act].append(now - c.pending[act].pop(0))
+                if msg.get("status") in ("busy", "timeout"):
+                    self.errors += 1
+
+    def run_load(self):
+        interval = 1.0 / self.opts.rate if self.opts.rate > 0 else None
+        start = time.monotonic()
+        end = start + self.opts.duration
+        live = [c for c in self.conns if c.state == "chatting"]
+        for c in live:
+            c.next_send = start + self.rng.random() * (interval or 1)
+        while interval and time.monotonic() < end:
+            now = time.monotonic()
+            nxt = end
+            for c in live:
+                if c.state == "closed":
+                    continue
+                if c.next_send <= now:
+                    self.fire(c)
+                    c.next_send += interval
+                    if c.next_send < now:            # fell behind; skip ahead
+                        c.next_send = now + interval
+                nxt = min(nxt, c.next_send)
+            self.poll(max(nxt - time.monotonic(), 0))
+        # let in-flight messages land
+        drain = time.monotonic() + self.opts.drain
+        while time.monotonic() < drain:
+            self.poll(0.05)
+        return time.monotonic() - start
+
+    def fire(self, c):
+        kind = self.rng.choices(self.kinds, self.weights)[0]
+        self.sent[kind] += 1
+        if kind == "exchange":
+            self.send(c, {"action": "exchange", "from": c.name,
+                          "message": f"{time.monotonic_ns()}|{c.name}"})
+            return
+        c.pending[kind].append(time.monotonic_ns())
+        if kind == "search":
+            self.send(c, {"action": "search",
+                          "target": self.rng.choice(SEARCH_TERMS)})
+        elif kind == "poem":
+            self.send(c, {"action": "poem",
+                          "target": str(self.rng.randint(1, 154))})
+        else:
+            self.send(c, {"action": "list"})
+
+    def close_all(self):
+        for c in self.conns:
+            if c.state != "closed":
+                c.state = "closed"
+                try:
+                    self.sel.unregister(c.sock)
+                except (KeyError, ValueError):
+                    pass
+                c.sock.close()
+
+
+def _drive(proc, n, opts, server, barrier, out):
+    d = Driver(proc, n, opts, server)
+    d.open_all()
+    barrier.wait()
+    d.group_up()
+    barrier.wait()
+    elapsed = d.run_load()
+    d.close_all()
+    out.put({
+        "lat": d.lat,
+        "sent": d.sent,
+        "errors": d.errors,
+        "clients": sum(1 for c in d.conns if c.sock is not None),
+        "elapsed": elapsed,
+    })
+
+
+# ----------------------------------------------------------------------
+# server-side resource sampling
+
+def _proc_tree(root):
+    """root and all its descendants, from /proc."""
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    tree, todo = [], [root]
+    while todo:
+        pid = todo.pop()
+        tree.append(pid)
+        todo.extend(children.get(pid, []))
+    return tree
+
+
+def server_usage(pid):
+    """(cpu seconds, rss bytes) summed over the server's process tree."""
+    tick = os.sysconf("SC_CLK_TCK")
+    cpu, rss = 0.0, 0
+    for p in _proc_tree(pid):
+        try:
+            with open(f"/proc/{p}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            cpu += (int(fields[11]) + int(fields[12])) / tick
+            with open(f"/proc/{p}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        rss += int(line.split()[1]) * 1024
+        except (OSError, IndexError, ValueError):
+            continue
+    return cpu, rss
+
+
+# ----------------------------------------------------------------------
+# reporting
+
+def percentile(sorted_vals, q):
+    if not sorted_vals:
+        return None
+    k = min(int(q * len(sorted_vals)), len(sorted_vals) - 1)
+    return sorted_vals[k]
+
+
+def summarize(parts, opts, elapsed, cpu, rss_peak):
+    lat = {k: [] for k in KINDS}
+    sent = {k: 0 for k in KINDS}
+    errors = clients = 0
+    for p in parts:
+        for k in KINDS:
+            lat[k].extend(p["lat"][k])
+            sent[k] += p["sent"][k]
+        errors += p["errors"]
+        clients += p["clients"]
+
+    latency = {}
+    for k in KINDS:
+        vals = sorted(lat[k])
+        latency[k] = {
+            "count": len(vals),
+            "p50_ms": _ms(percentile(vals, 0.50)),
+            "p99_ms": _ms(percentile(vals, 0.99)),
+            "p999_ms": _ms(percentile(vals, 0.999)),
+            "max_ms": _ms(vals[-1] if vals else None),
+        }
+    total_sent = sum(sent.values())
+    return {
+        "config": {k: v for k, v in vars(opts).items()
+                   if k not in ("json", "baseline")},
+        "clients": clients,
+        "elapsed_s": round(elapsed, 3),
+        "sent": sent,
+        "delivered": latency["exchange"]["count"],
+        "requests_per_s": round(total_sent / elapsed, 1) if elapsed else 0,
+        "deliveries_per_s": round(latency["exchange"]["count"] / elapsed, 1)
+                            if elapsed else 0,
+        "latency": latency,
+        "errors": errors,
+        "server_cpu_s": round(cpu, 3),
+        "server_cpu_util": round(cpu / elapsed, 3) if elapsed else 0,
+        "server_rss_peak_bytes": rss_peak,
+    }
+
+
+def _ms(ns):
+    return None if ns is None else round(ns / 1e6, 3)
+
+
+def print_report(res):
+    print(f"clients            {res['clients']}")
+    print(f"elapsed            {res['elapsed_s']} s")
+    print(f"requests/s         {res['requests_per_s']}")
+    print(f"deliveries/s       {res['deliveries_per_s']}")
+    print(f"errors             {res['errors']}")
+    print(f"server cpu         {res['server_cpu_s']} s "
+          f"({res['server_cpu_util'] * 100:.0f}% of one core)")
+    print(f"server rss peak    {res['server_rss_peak_bytes'] / 2**20:.1f} MB")
+    print(f"{'latency (ms)':<12} {'count':>8} {'p50':>9} {'p99':>9} "
+          f"{'p99.9':>9} {'max':>9}")
+    for k, v in res["latency"].items():
+        cells = [_fmt(v[c]) for c in ("p50_ms", "p99_ms", "p999_ms", "max_ms")]
+        print(f"{k:<12} {v['count']:>8} " + " ".join(f"{c:>9}" for c in cells))
+
+
+def _fmt(x):
+    return "-" if x is None else f"{x:.2f}"
+
+
+def compare(res, base, tolerance):
+    """Print deltas against a baseline; return False on regression."""
+    ok = True
+    rows = [("deliveries_per_s", res["deliveries_per_s"],
+             base.get("deliveries_per_s"), False)]
+    for k in KINDS:
+        rows.append((f"{k} p99_ms", res["latency"][k]["p99_ms"],
+                     base.get("latency", {}).get(k, {}).get("p99_ms"), True))
+    print(f"\n{'vs baseline':<20} {'now':>10} {'base':>10} {'change':>8}")
+    for label, now, was, lower_is_better in rows:
+        if now is None or not was:
+            continue
+        change = (now - was) / was
+        worse = change > tolerance if lower_is_better else -change > tolerance
+        ok = ok and not worse
+        flag = "  REGRESSION" if worse else ""
+        print(f"{label:<20} {now:>10} {was:>10} {change * 100:>+7.1f}%{flag}")
+    return ok
+
+
+# ----------------------------------------------------------------------
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        kind, _, weight = part.partition("=")
+        if kind.strip() not in KINDS:
+            raise argparse.ArgumentTypeError(f"unknown action {kind!r}")
+        mix[kind.strip()] = float(weight)
+    mix.setdefault("exchange", max(0.0, 1.0 - sum(mix.values())))
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description='chat server load benchmark')
+    parser.add_argument('--clients', type=int, default=200)
+    parser.add_argument('--procs', type=int, default=max(os.cpu_count() // 2, 1),
+                        help='load-generating processes')
+    parser.add_argument('--group-size', type=int, default=4)
+    parser.add_argument('--rate', type=float, default=2.0,
+                        help='requests per second per client')
+    parser.add_argument('--mix', type=parse_mix,
+                        default=parse_mix("search=0.05,poem=0.03,list=0.02"),
+                        help='action weights, rest is exchange')
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--drain', type=float, default=1.0,
+                        help='seconds to wait for in-flight messages')
+    parser.add_argument('--ramp', type=float, default=500.0,
+                        help='new connections per second')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--host', type=str, default=SERVER[0])
+    parser.add_argument('--port', type=int, default=SERVER[1])
+    parser.add_argument('--spawn-server', action='store_true',
+                        help='start chat_server.py for the run')
+    parser.add_argument('--server-args', type=str, default='',
+                        help='extra arguments for the spawned server')
+    parser.add_argument('--server-pid', type=int, default=None,
+                        help='pid of an already running server to sample')
+    parser.add_argument('--json', type=str, default=None,
+                        help='write results here')
+    parser.add_argument('--baseline', type=str, default=None,
+                        help='earlier --json results to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.10,
+                        help='allowed regression vs baseline (fraction)')
+    opts = parser.parse_args()
+
+    server = (opts.host, opts.port)
+    proc = tmpdir = None
+    pid = opts.server_pid
+    if opts.spawn_server:
+        here = os.path.dirname(os.path.abspath(__file__))
+        tmpdir = tempfile.mkdtemp(prefix="icds-bench-")
+        cmd = [sys.executable, os.path.join(here, "chat_server.py"),
+               "--index-dir", tmpdir] + opts.server_args.split()
+        proc = subprocess.Popen(cmd, cwd=here, stdout=subprocess.DEVNULL)
+        pid = proc.pid
+        _wait_listening(server)
+
+    try:
+        n = opts.clients
+        per = [n // opts.procs + (1 if i < n % opts.procs else 0)
+               for i in range(opts.procs)]
+        per = [k for k in per if k]
+        barrier = mp.Barrier(len(per))
+        out = mp.Queue()
+        workers = [mp.Process(target=_drive, args=(i, k, opts, server, barrier, out))
+                   for i, k in enumerate(per)]
+        for w in workers:
+            w.start()
+
+        cpu0 = server_usage(pid)[0] if pid else 0.0
+        rss_peak = 0
+        parts = []
+        while len(parts) < len(workers):
+            if pid:
+                rss_peak = max(rss_peak, server_usage(pid)[1])
+            try:
+                parts.append(out.get(timeout=0.5))
+            except Exception:
+                if not any(w.is_alive() for w in workers) and out.empty():
+                    break
+        cpu1 = server_usage(pid)[0] if pid else 0.0
+        for w in workers:
+            w.join()
+    finally:
+        if proc:
+            proc.terminate()
+            proc.wait()
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+    elapsed = max((p["elapsed"] for p in parts), default=0.0)
+    res = summarize(parts, opts, elapsed, cpu1 - cpu0, rss_peak)
+    print_report(res)
+    if opts.json:
+        with open(opts.json, "w") as f:
+            json.dump(res, f, indent=2)
+
+    if opts.baseline:
+        with open(opts.baseline) as f:
+            base = json.load(f)
+        if not compare(res, base, opts.tolerance):
+            sys.exit(1)
+
+
+def _wait_listening(addr, limit=30.0):
+    end = time.monotonic() + limit
+    while time.monotonic() < end:
+        try:
+            socket.create_connection(addr, timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"server did not come up on {addr}")
+
+
+if __name__ == "__main__":
+    main()
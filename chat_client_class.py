@@ -50,7 +50,9 @@ class Client:
         #peer_code = M_UNDEF    for json data, peer_code is redundant
         if len(self.console_input) > 0:
             my_msg = self.console_input.pop(0)
-        if self.socket in read:
+        if self.sm.backlog:
+            peer_msg = self.sm.backlog.pop(0)
+        elif self.socket in read:
             peer_msg = self.recv()
         return my_msg, peer_msg
 
@@ -71,6 +73,8 @@ class Client:
                 self.sm.set_state(S_LOGGEDIN)
                 self.sm.set_myname(self.name)
                 self.print_instructions()
+                # fetch whatever was said while we were away
+                self.send(json.dumps({"action":"sync"}))
                 return (True)
             elif response["status"] == 'duplicate':
                 self.system_msg += 'Duplicate username, try again'
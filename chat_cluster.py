@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+"""
+Multi-process mode for the chat server.
+
+The parent process runs the presence Registry, which owns the one true
+Group.  Each worker is an ordinary chat_server.Server whose listening
+socket shares the chat port with its siblings through SO_REUSEPORT, so
+the kernel spreads incoming connections across cores.
+
+Everything travels over Unix datagram sockets in a private run directory:
+
+    registry.sock   group mutations sent by workers to the registry
+    w<i>.sock       worker i's inbox: replicated group ops from the
+                    registry, plus frames routed by other workers
+
+The registry stamps every accepted mutation and broadcasts it to all
+workers, which replay it on a local Group replica.  Every replica sees
+the same operations in the same order, so list_me/find_group/is_member
+answer exactly as they do in the single-process server, without a round
+trip.  Frames for users attached to another worker are sent straight to
+that worker's inbox and never pass through the registry.
+
+A group mutation is a blocking round trip: the worker's event loop waits
+in Router.call() until the registry broadcasts the op back, normally a
+few tens of microseconds over the Unix socket but up to RPC_TIMEOUT if
+the registry is stuck.  Ops from other workers that arrive meanwhile are
+replayed in order; routed frames are held until the loop gets back to
+the inbox, so no handler is re-entered from inside a mutation.
+
+The registry reaps its workers as it goes.  If one exits, its users are
+detached (as for a dropped connection) and that is broadcast to the
+others, so their names do not stay taken and their peers see them away.
+"""
+import os
+import json
+import logging
+import select
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+
+import chat_group as grp
+import chat_log
+
+log = logging.getLogger("chat.cluster")
+
+DGRAM_BUF = 4 * 1024 * 1024      # socket buffer size for the inboxes
+MAX_DGRAM = 1 << 20              # largest datagram we expect to read
+RPC_TIMEOUT = 5.0                # seconds to wait for the registry
+REAP_INTERVAL = 1.0              # how often the registry checks on workers
+
+
+def _inbox(rundir, wid):
+    return os.path.join(rundir, f"w{wid}.sock")
+
+
+def _dgram_socket(path):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, DGRAM_BUF)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, DGRAM_BUF)
+    sock.bind(path)
+    return sock
+
+
+class Registry:
+    """Authoritative presence registry, run by the parent process."""
+
+    def __init__(self, rundir, n_workers):
+        self.rundir = rundir
+        self.n_workers = n_workers
+        self.group = grp.Group()
+        self.seq = 0
+        self.sock = _dgram_socket(os.path.join(rundir, "registry.sock"))
+        self.where = {}          # username → worker they are attached to
+        self.pids = {}           # pid → worker id, set by serve()
+        self.dead = set()        # worker ids that have exited
+
+    def apply(self, req):
+        """Apply one mutation to the master Group; return its status."""
+        op = req.get("op")
+        name = req.get("name")
+        if op == "join":
+            if not name or self.group.is_member(name):
+                return "duplicate"
+            self.group.join(name)
+            self.where[name] = req.get("worker")
+        elif op == "leave":
+            if not self.group.is_member(name):
+                return "no-user"
+            self.group.leave(name)
+            self.where.pop(name, None)
+        elif op == "connect":
+            peer = req.get("peer")
+            if not (self.group.is_member(name) and self.group.is_member(peer)):
+                return "no-user"
+            self.group.connect(name, peer)
+        elif op == "disconnect":
+            self.group.disconnect(name)
+        elif op == "detach":
+            if not self.group.is_member(name):
+                return "no-user"
+            self.group.detach(name)
+            self.where.pop(name, None)
+        elif op == "rejoin":
+            if not self.group.is_member(name) or not self.group.rejoin(name):
+                return "no-group"
+        else:
+            return "bad-op"
+        return "ok"
+
+    def broadcast(self, req):
+        """Stamp an accepted op and send it to every live worker."""
+        self.seq += 1
+        req["seq"] = self.seq
+        out = json.dumps(req).encode()
+        for wid in range(self.n_workers):
+            if wid in self.dead:
+                continue
+            try:
+                self.sock.sendto(out, _inbox(self.rundir, wid))
+            except OSError as e:
+                log.error("Registry: worker %s unreachable: %s", wid, e)
+
+    def reap(self):
+        """Detach the users of workers that have exited."""
+        for pid, wid in list(self.pids.items()):
+            try:
+                done, status = os.waitpid(pid, os.WNOHANG)
+            except ChildProcessError:
+                done, status = pid, None
+            if not done:
+                continue
+            del self.pids[pid]
+            self.dead.add(wid)
+            gone = [name for name, w in self.where.items() if w == wid]
+            log.error("Worker %s (pid %s) exited with status %s; detaching %d users",
+                      wid, pid, status, len(gone))
+            for name in gone:
+                req = {"op": "detach", "name": name, "worker": wid}
+                req["status"] = self.apply(req)
+                if req["status"] == "ok":
+                    self.broadcast(req)
+
+    def run(self):
+        self.sock.settimeout(REAP_INTERVAL)
+        while True:
+            self.reap()
+            try:
+                data, addr = self.sock.recvfrom(MAX_DGRAM)
+                req = json.loads(data)
+            except (OSError, ValueError):
+                continue
+
+            req["status"] = self.apply(req)
+            if req["status"] == "ok":
+                # every replica (the requester included) replays the op
+                self.broadcast(req)
+            else:
+                # rejected ops only go back to whoever asked
+                try:
+                    self.sock.sendto(json.dumps(req).encode(), addr)
+                except OSError:
+                    pass
+
+
+class ClusterGroup(grp.Group):
+    """
+    Local replica of the registry's Group.
+
+    Reads are served from the replica; mutations are sent to the registry
+    and only take effect here once the registry broadcasts them back.
+    """
+
+    def __init__(self, router):
+        super().__init__()
+        self.router = router
+        self.where = {}          # username → worker id
+
+    def join(self, name):
+        return self.router.call("join", name=name) == "ok"
+
+    def leave(self, name):
+        self.router.call("leave", name=name)
+
+    def connect(self, me, peer):
+        self.router.call("connect", name=me, peer=peer)
+
+    def disconnect(self, me):
+        self.router.call("disconnect", name=me)
+
+    def detach(self, me):
+        self.router.call("detach", name=me)
+
+    def rejoin(self, me):
+        return self.router.call("rejoin", name=me) == "ok"
+
+    def replay(self, ev):
+        """Apply an op broadcast by the registry, in registry order."""
+        op, name = ev["op"], ev["name"]
+        if op == "join":
+            grp.Group.join(self, name)
+            self.where[name] = ev["worker"]
+        elif op == "leave":
+            grp.Group.disconnect(self, name)
+            self.members.pop(name, None)
+            self.where.pop(name, None)
+        elif op == "connect":
+            grp.Group.connect(self, name, ev["peer"])
+        elif op == "disconnect":
+            grp.Group.disconnect(self, name)
+        elif op == "detach":
+            grp.Group.detach(self, name)
+            self.where.pop(name, None)
+        elif op == "rejoin":
+            grp.Group.rejoin(self, name)
+
+
+class Router:
+    """A worker's link to the registry and to its sibling workers."""
+
+    def __init__(self, wid, rundir, sock):
+        self.wid = wid
+        self.rundir = rundir
+        self.registry = os.path.join(rundir, "registry.sock")
+        self.sock = sock
+        self.sock.setblocking(False)
+        self.group = ClusterGroup(self)
+        self.server = None       # set by chat_server.Server
+        self.req_id = 0
+        self.routed = []         # frames that came in during a call()
+
+    def call(self, op, **args):
+        """
+        Send a mutation to the registry and wait for it to come back.
+        This blocks the event loop for the round trip; see the module
+        docstring.
+        """
+        self.req_id += 1
+        req = dict(args, op=op, id=self.req_id, worker=self.wid)
+        self.sock.sendto(json.dumps(req).encode(), self.registry)
+        while True:
+            ready, _, _ = select.select([self.sock], [], [], RPC_TIMEOUT)
+            if not ready:
+                raise TimeoutError(f"registry did not answer {op}")
+            ev = self._recv()
+            if ev is None:
+                continue
+            if "op" not in ev:
+                self.routed.append(ev)       # delivered from handle()
+                continue
+            self.dispatch(ev)
+            if ev.get("worker") == self.wid and ev.get("id") == self.req_id:
+                return ev.get("status")
+
+    def _recv(self):
+        try:
+            return json.loads(self.sock.recv(MAX_DGRAM))
+        except BlockingIOError:
+            return None
+        except ValueError:
+            return None
+
+    def handle(self):
+        """Drain the inbox; called from the server's select loop."""
+        routed, self.routed = self.routed, []
+        for ev in routed:
+            self.dispatch(ev)
+        while True:
+            try:
+                data = self.sock.recv(MAX_DGRAM)
+            except BlockingIOError:
+                return
+            try:
+                self.dispatch(json.loads(data))
+            except ValueError:
+                continue
+
+    def dispatch(self, ev):
+        if "op" in ev:
+            if ev.get("status") == "ok":
+                self.group.replay(ev)
+            return
+        # a frame routed from another worker for our local users
+        self.server.deliver_local(ev.get("to", []), ev.get("frame", ""))
+        if "room" in ev:
+            # a chat line: our shard of the room's log gets it too
+            self.server.post_room(*ev["room"])
+
+    def forward(self, names, frame, room=None):
+        """
+        Route a frame to users attached to other workers.
+        room: (group key, line) to add to their room logs
+        """
+        by_worker = {}
+        for name in names:
+            wid = self.group.where.get(name)
+            if wid is not None and wid != self.wid:
+                by_worker.setdefault(wid, []).append(name)
+        for wid, to in by_worker.items():
+            ev = {"to": to, "frame": frame}
+            if room is not None:
+                ev["room"] = room
+            out = json.dumps(ev).encode()
+            try:
+                self.sock.sendto(out, _inbox(self.rundir, wid))
+            except OSError as e:
+                log.error("Route to worker %s failed: %s", wid, e)
+        return sum(len(to) for to in by_worker.values())
+
+
+def _worker(wid, rundir, sock, server_args, log_level, log_json):
+    import chat_server
+    # the parent's log writer thread did not survive the fork
+    chat_log.setup(log_level, log_json)
+    router = Router(wid, rundir, sock)
+    server_args = dict(server_args)
+    if server_args.get("admin_port"):
+        server_args["admin_port"] += wid     # one metrics port per worker
+    # a reconnect may land on any worker, so dropped sessions are not held
+    server_args = dict(server_args, resume_grace=0)
+    server = chat_server.Server(reuse_port=True, router=router, **server_args)
+    log.info("Worker %s (pid %s) ready", wid, os.getpid())
+    server.run()
+
+
+def serve(n_workers, log_level="INFO", log_json=False, **server_args):
+    """
+    Fork n_workers servers sharing the chat port; run the registry here.
+    server_args are passed on to every worker's chat_server.Server.
+    """
+    rundir = tempfile.mkdtemp(prefix="icds-")
+    registry = Registry(rundir, n_workers)
+    # bind every inbox before forking, so no broadcast can be missed
+    inboxes = [_dgram_socket(_inbox(rundir, wid)) for wid in range(n_workers)]
+
+    pids = []
+    for wid in range(n_workers):
+        pid = os.fork()
+        if pid == 0:
+            registry.sock.close()
+            for other, s in enumerate(inboxes):
+                if other != wid:
+                    s.close()
+            try:
+                _worker(wid, rundir, inboxes[wid], server_args, log_level, log_json)
+            except KeyboardInterrupt:
+                pass
+            finally:
+                chat_log.shutdown()
+                os._exit(0)
+        pids.append(pid)
+        registry.pids[pid] = wid
+
+    for s in inboxes:
+        s.close()
+    # a plain `kill` should take the workers down with us
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+    try:
+        registry.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+                os.waitpid(pid, 0)
+            except OSError:
+                pass
+        shutil.rmtree(rundir, ignore_errors=True)
@@ -4,9 +4,13 @@ Created on Sun Apr  5 09:58:31 2015
 
 @author: zhengzhang
 """
+import logging
+
 S_ALONE = 0
 S_TALKING = 1
 
+log = logging.getLogger("chat.group")
+
 #==============================================================================
 # Group class:
 # member fields:
@@ -19,6 +23,8 @@ S_TALKING = 1
 #    - list_all: who is in the system, and the chat groups
 #    - connect: connect to a peer in a chat group, and become part of the group
 #    - disconnect: leave the chat group but stay in the system
+#    - detach: dropped offline mid-chat; stay "away" from the chat group
+#    - rejoin: back from away, into the same group if it still exists
 #==============================================================================
 
 class Group:
@@ -27,10 +33,11 @@ class Group:
         self.members = {}
         self.chat_grps = {}
         self.grp_ever = 0
+        self.away = {}           # name → key of the group they dropped out of
 
     def join(self, name):
         self.members[name] = S_ALONE
-        return
+        return True
 
     def is_member(self, name):
         return name in self.members.keys()
@@ -55,12 +62,12 @@ class Group:
         #if peer is in a group, join it
         peer_in_group, group_key = self.find_group(peer)
         if peer_in_group == True:
-            print(peer, "is talking already, connect!")
+            log.debug("%s is talking already, connect!", peer)
             self.chat_grps[group_key].append(me)
             self.members[me] = S_TALKING
         else:
             # otherwise, create a new group
-            print(peer, "is idle as well")
+            log.debug("%s is idle as well", peer)
             self.grp_ever += 1
             group_key = self.grp_ever
             self.chat_grps[group_key] = []
@@ -68,7 +75,8 @@ class Group:
             self.chat_grps[group_key].append(peer)
             self.members[me] = S_TALKING
             self.members[peer] = S_TALKING
-        print(self.list_me(me))
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("group of %s: %s", me, self.list_me(me))
         return
 
     def disconnect(self, me):
@@ -78,12 +86,45 @@ class Group:
             self.chat_grps[group_key].remove(me)
             self.members[me] = S_ALONE
             # peer may be the only one left as well...
-            if len(self.chat_grps[group_key]) == 1:
+            # (unless someone away is coming back to them)
+            if len(self.chat_grps[group_key]) == 1 and \
+                    not self.list_away(self.chat_grps[group_key][0]):
                 peer = self.chat_grps[group_key].pop()
                 self.members[peer] = S_ALONE
+            if len(self.chat_grps[group_key]) == 0:
                 del self.chat_grps[group_key]
+                for name in [n for n, k in self.away.items() if k == group_key]:
+                    del self.away[name]
         return
 
+    def detach(self, me):
+        # went offline without saying bye: keep a place in the group
+        in_group, group_key = self.find_group(me)
+        if in_group == True and len(self.chat_grps[group_key]) > 1:
+            self.chat_grps[group_key].remove(me)
+            self.away[me] = group_key
+        else:
+            # Group's own disconnect: cluster replicas replay this locally
+            Group.disconnect(self, me)
+        del self.members[me]
+        return
+
+    def rejoin(self, me):
+        # back online: return to the group if anyone is still in it
+        group_key = self.away.pop(me, None)
+        if group_key in self.chat_grps and self.chat_grps[group_key]:
+            self.chat_grps[group_key].append(me)
+            self.members[me] = S_TALKING
+            return True
+        return False
+
+    def list_away(self, me):
+        # who dropped out of my group and has not come back yet
+        in_group, group_key = self.find_group(me)
+        if in_group == False:
+            return []
+        return [name for name, k in self.away.items() if k == group_key]
+
     def list_all(self):
         # a simple minded implementation
         full_list = "Users: ------------" + "\n"
@@ -0,0 +1,142 @@
+"""
+Logging for the chat server: queue-backed, rate-limited, text or JSON.
+
+Server code logs through ordinary `logging` loggers under "chat".  The
+only work done on the calling thread is a level check, the rate-limit
+check and a non-blocking put on a bounded queue; formatting and the
+actual write happen on a QueueListener thread, so a slow stdout pipe or
+disk never stalls the event loop.  If the queue is full, records are
+dropped and counted rather than waiting.
+
+Repetitive events are rate limited per (logger, message template): each
+template may log RATE_BURST records per RATE_WINDOW seconds; the next
+record that gets through says how many were suppressed in between.
+
+    chat_log.setup("INFO")                 # "... INFO chat.server: jason logged in"
+    chat_log.setup("DEBUG", json_output=True)
+"""
+import sys
+import json
+import time
+import queue
+import logging
+import logging.handlers
+
+QUEUE_SIZE = 10000
+RATE_BURST = 20          # records per template ...
+RATE_WINDOW = 1.0        # ... per this many seconds
+
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {
+    "message", "asctime", "suppressed"}
+
+_listener = None
+
+
+class RateLimitFilter(logging.Filter):
+    def __init__(self, burst=RATE_BURST, window=RATE_WINDOW):
+        super().__init__()
+        self.burst = burst
+        self.window = window
+        self.buckets = {}                # (logger, template) → [start, n, dropped]
+
+    def filter(self, record):
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        b = self.buckets.get(key)
+        if b is None or now - b[0] >= self.window:
+            dropped = b[2] if b else 0
+            self.buckets[key] = [now, 1, 0]
+            if dropped:
+                record.suppressed = dropped
+            return True
+        if b[1] < self.burst:
+            b[1] += 1
+            return True
+        b[2] += 1
+        return False
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that never blocks and leaves formatting to the listener."""
+
+    def __init__(self, q):
+        super().__init__(q)
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    def format(self, record):
+        line = super().format(record)
+        if getattr(record, "suppressed", 0):
+            line += f" [{record.suppressed} similar suppressed]"
+        return line
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for k, v in record.__dict__.items():
+            if k not in _RECORD_ATTRS:
+                entry[k] = v             # anything passed with extra=
+        if getattr(record, "suppressed", 0):
+            entry["suppressed"] = record.suppressed
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def setup(level="INFO", json_output=False, stream=None):
+    """
+    Route the "chat" loggers through a background writer.  Safe to call
+    again, e.g. in a freshly forked worker, whose inherited listener
+    thread did not survive the fork.
+    """
+    global _listener
+    if _listener is not None:
+        try:
+            _listener.stop()
+        except Exception:
+            pass
+
+    out = logging.StreamHandler(stream or sys.stdout)
+    out.setFormatter(JsonFormatter() if json_output else TextFormatter())
+
+    q = queue.Queue(QUEUE_SIZE)
+    handler = DroppingQueueHandler(q)
+    handler.addFilter(RateLimitFilter())
+
+    log = logging.getLogger("chat")
+    for h in list(log.handlers):
+        log.removeHandler(h)
+    log.addHandler(handler)
+    log.setLevel(level.upper() if isinstance(level, str) else level)
+    log.propagate = False
+
+    _listener = logging.handlers.QueueListener(q, out)
+    _listener.start()
+    return handler
+
+
+def shutdown():
+    """Flush whatever is still queued."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
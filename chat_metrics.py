@@ -0,0 +1,138 @@
+"""
+Counters, gauges and histograms for the chat server, rendered in the
+Prometheus text exposition format.
+
+Everything is plain attribute arithmetic on the event-loop thread: a
+counter bump is one addition, a histogram observation is one bisect over
+a dozen bucket bounds.  Gauges that are expensive or owned by someone
+else (cache sizes, socket queues) are callbacks, evaluated only when the
+metrics are scraped.
+
+The server exposes them on a local admin port; connect and read:
+
+    nc 127.0.0.1 1113
+"""
+import bisect
+
+ADMIN_PORT = 1113
+
+# seconds; from a fast dict lookup up to a stalled loop
+TIME_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+# recipients per broadcast
+SIZE_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+
+class Counter:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, n=1):
+        self.value += n
+
+    def samples(self, name, labels):
+        yield name, labels, self.value
+
+
+class Gauge:
+    __slots__ = ("value", "fn")
+
+    def __init__(self, fn=None):
+        self.value = 0
+        self.fn = fn                     # called at scrape time, if given
+
+    def set(self, v):
+        self.value = v
+
+    def samples(self, name, labels):
+        yield name, labels, self.fn() if self.fn else self.value
+
+
+class Histogram:
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, v):
+        self.counts[bisect.bisect_left(self.bounds, v)] += 1
+        self.sum += v
+        self.count += 1
+
+    def samples(self, name, labels):
+        total = 0
+        for bound, n in zip(self.bounds, self.counts):
+            total += n
+            yield name + "_bucket", labels + (("le", repr(bound)),), total
+        yield name + "_bucket", labels + (("le", "+Inf"),), self.count
+        yield name + "_sum", labels, self.sum
+        yield name + "_count", labels, self.count
+
+
+class _Family:
+    """One metric name; one child per distinct label set."""
+
+    def __init__(self, kind, help, make):
+        self.kind = kind
+        self.help = help
+        self.make = make
+        self.children = {}
+
+    def labels(self, **labels):
+        key = tuple(sorted(labels.items()))
+        child = self.children.get(key)
+        if child is None:
+            child = self.children[key] = self.make()
+        return child
+
+
+class Metrics:
+    def __init__(self):
+        self.families = {}
+
+    def _family(self, name, kind, help, make):
+        fam = self.families.get(name)
+        if fam is None:
+            fam = self.families[name] = _Family(kind, help, make)
+        return fam
+
+    def counter(self, name, help, **labels):
+        return self._family(name, "counter", help, Counter).labels(**labels)
+
+    def gauge(self, name, help, fn=None, **labels):
+        return self._family(name, "gauge", help,
+                            lambda: Gauge(fn)).labels(**labels)
+
+    def histogram(self, name, help, bounds=TIME_BUCKETS, **labels):
+        return self._family(name, "histogram", help,
+                            lambda: Histogram(bounds)).labels(**labels)
+
+    def render(self):
+        """All metrics in the Prometheus text format."""
+        out = []
+        for name, fam in self.families.items():
+            out.append(f"# HELP {name} {fam.help}")
+            out.append(f"# TYPE {name} {fam.kind}")
+            for key, child in fam.children.items():
+                try:
+                    for sname, labels, value in child.samples(name, key):
+                        out.append(f"{sname}{_labels(labels)} {value}")
+                except Exception as e:   # a broken callback must not kill the dump
+                    out.append(f"# {name}{_labels(key)} unavailable: {e}")
+        return "\n".join(out) + "\n"
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    inner = ",".join(f'{k}="{_escape(v)}"' for k, v in labels)
+    return "{" + inner + "}"
+
+
+def _escape(v):
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
@@ -0,0 +1,100 @@
+"""
+Slow-request log and on-demand sampling profiler for the chat server.
+
+SlowLog appends one JSON object per line for every handle_msg, login or
+logout call that takes longer than a threshold, with the time split into
+recv / parse / handler / send, e.g.
+
+    {"ts": "2025-05-05 15:33:02", "kind": "exchange", "user": "jason",
+     "bytes": 31, "total_ms": 212.4, "recv_ms": 0.1, "parse_ms": 0.0,
+     "handler_ms": 0.3, "send_ms": 212.0}
+
+Actions answered by the query pool (search, poem, history, sync,
+suggest) are logged when the answer is ready instead, with the time
+from the request to then as query_ms (and "bytes": null).
+
+StackSampler is started by SIGUSR1 or the admin command `profile [secs]`.
+It wakes up every few milliseconds, grabs the event-loop thread's current
+stack with sys._current_frames(), and when time is up writes the counts in
+the "folded" format (one `frame;frame;frame count` per line) that
+flamegraph.pl and speedscope read.
+"""
+import os
+import sys
+import json
+import time
+import logging
+import threading
+from collections import Counter
+
+SLOW_MS = 50.0               # default threshold when the slow log is on
+PROFILE_SECONDS = 10.0
+PROFILE_INTERVAL = 0.005     # seconds between samples
+
+log = logging.getLogger("chat.profile")
+
+
+class SlowLog:
+    def __init__(self, path, threshold_ms=SLOW_MS):
+        self.path = path
+        self.threshold = threshold_ms / 1000.0
+        self.f = open(path, "a", buffering=1)
+
+    def record(self, kind, user, nbytes, **timings):
+        """Log one call if its timings (seconds) add up past the threshold."""
+        total = sum(timings.values())
+        if total < self.threshold:
+            return
+        entry = {
+            "ts": time.strftime('%Y-%m-%d %H:%M:%S', time.localtime()),
+            "kind": kind,
+            "user": user,
+            "bytes": nbytes,
+            "total_ms": round(total * 1000, 3),
+        }
+        for k, v in timings.items():
+            entry[f"{k}_ms"] = round(v * 1000, 3)
+        self.f.write(json.dumps(entry) + "\n")
+
+
+class StackSampler(threading.Thread):
+    def __init__(self, target_thread, seconds=PROFILE_SECONDS,
+                 interval=PROFILE_INTERVAL, out_dir="."):
+        super().__init__(name="stack-sampler", daemon=True)
+        self.target = target_thread.ident
+        self.seconds = seconds
+        self.interval = interval
+        self.out_dir = out_dir
+        self.stacks = Counter()
+        self.samples = 0
+        self.path = os.path.join(
+            out_dir, f"profile-{os.getpid()}-{int(time.time())}.folded")
+
+    def run(self):
+        end = time.monotonic() + self.seconds
+        while time.monotonic() < end:
+            frame = sys._current_frames().get(self.target)
+            if frame is None:
+                break
+            self.stacks[_fold(frame)] += 1
+            self.samples += 1
+            time.sleep(self.interval)
+        self.dump()
+
+    def dump(self):
+        with open(self.path, "w") as f:
+            for stack, n in self.stacks.most_common():
+                f.write(f"{stack} {n}\n")
+        log.info("Profile: %d samples written to %s", self.samples, self.path)
+        for stack, n in self.stacks.most_common(5):
+            leaf = stack.rsplit(";", 1)[-1]
+            log.info("  %5.1f%%  %s", 100.0 * n / max(self.samples, 1), leaf)
+
+
+def _fold(frame):
+    parts = []
+    while frame is not None:
+        code = frame.f_code
+        parts.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(parts))
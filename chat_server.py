@@ -1,112 +1,878 @@
 #!/usr/bin/env python3
+import os
 import time
 import socket
 import select
 import json
-import pickle as pkl
+import sys
+import secrets
+import logging
+import signal
+import struct
+import threading
+try:
+    import fcntl
+    import termios
+except ImportError:      # Windows: no socket queue depths
+    fcntl = termios = None
 
-from chat_utils import SERVER, mysend, myrecv
+from chat_utils import SERVER, SIZE_SPEC, myrecv, chunk_text, chunk_list
 import indexer
+import room_index
 import chat_group as grp
+import chat_log
+from chat_metrics import Metrics, ADMIN_PORT, SIZE_BUCKETS
+from chat_profile import SlowLog, StackSampler, PROFILE_SECONDS
+from index_store import IndexStore, INDEX_BUDGET
+from query_pool import QueryPool, QUERY_TIMEOUT, SWITCH_INTERVAL
+from result_cache import ResultCache, search_key, poem_key
+from term_dict import SUGGEST_LIMIT, SUGGEST_MAX
+from room_index import RoomLog, ROOM_KEEP
+from mail_store import MailStore
+from flow_control import (TokenBucket, Outbox, encode, POLICIES, USER_RATE,
+                          USER_BURST, ROOM_RATE, ROOM_BURST, HIGH_WATER,
+                          LOW_WATER, OUTBOX_LIMIT, STALL_TIMEOUT)
+
+log = logging.getLogger("chat.server")
+
+# what a query action returns when there is nothing to send
+EMPTY_RESULTS = {"poem": [], "search": "", "sync": [], "history": [], "suggest": []}
+
+ACTIONS = ("connect", "exchange", "disconnect", "list", "poem", "time", "search",
+           "sync", "history", "logout", "suggest")
+
+HISTORY_MAX = 200        # most lines a client may ask for in one page
+ROOM_SWEEP = 3600.0      # seconds between looks for expired room logs
+
+
+class Stream:
+    """
+    A reply too large for one frame, sent as chunk frames.  The chunks
+    come from a generator that is advanced on the query pool, one chunk
+    at a time, whenever the client's outbox has room for more.
+    """
+
+    def __init__(self, chunks, ahead):
+        self.chunks = chunks             # generator of the remaining chunks
+        self.ahead = ahead               # chunks computed but not yet sent
+        self.done = False                # generator exhausted
+        self.pulling = False             # a pull is queued on the pool
+
+    def pull(self):
+        # runs on the query pool
+        try:
+            chunk = next(self.chunks, None)
+        except Exception as e:
+            log.error("Streamed reply failed: %s", e)
+            chunk = None
+        if chunk is None:
+            self.done = True
+        else:
+            self.ahead.append(chunk)
+        return self
+
+
+def hit_chars(hit):
+    # about how long one [line_number, line, spans(, room)] search hit is in JSON
+    return len(hit[1]) + 12 + 10 * len(hit[2]) + sum(len(room) + 4 for room in hit[3:])
+
+
+def clip_hit(hit, size):
+    # a hit too long for a chunk on its own: keep the start of the line
+    # and the spans within it, about size // 2 characters of each
+    line = hit[1][:size // 2]
+    spans = [sp for sp in hit[2] if sp[1] <= len(line)][:size // 20]
+    return [hit[0], line, spans] + hit[3:]
+
+
+ADMIN_WAIT = 0.01        # how long an admin connection gets to send a command
+STREAM_RETRY = 0.05      # seconds before retrying a chunk the pool refused
+RESUME_GRACE = 30.0      # seconds a dropped session may be resumed
+RESUME_FRAMES = 500      # frames kept for a dropped session meanwhile
 
 
 class Server:
-    def __init__(self):
+    def __init__(self, reuse_port=False, router=None, index_dir=".",
+                 index_budget=INDEX_BUDGET, admin_port=ADMIN_PORT,
+                 slow_ms=0, slow_log="slow.log", profile_dir=".",
+                 user_rate=USER_RATE, room_rate=ROOM_RATE, user_burst=USER_BURST,
+                 room_burst=ROOM_BURST, slow_policy="drop",
+                 resume_grace=RESUME_GRACE, substring_index=False):
         self.new_clients = []                # sockets before login
         self.logged_name2sock = {}           # username → socket
         self.logged_sock2name = {}           # socket → username
         self.all_sockets = []
-        self.group = grp.Group()             # group management
+
+        # session tokens: a client that drops can `resume` within the grace
+        # period and carry on where it was, without logging in again
+        self.resume_grace = resume_grace
+        self.sessions = {}                   # token → username
+        self.tokens = {}                     # username → token
+        self.held = {}                       # username → (deadline, [(ctime, frame)])
+
+        # flow control, see flow_control.py
+        self.outboxes = {}                   # socket → Outbox
+        self.sending = set()                 # sockets with output queued
+        self.closing = set()                 # to be logged out this round
+        self.user_rate = user_rate
+        self.room_rate = room_rate
+        self.user_burst = user_burst
+        self.room_burst = room_burst
+        self.user_buckets = {}               # username → TokenBucket
+        self.room_buckets = {}               # group key → TokenBucket
+        self.throttled = {}                  # socket → monotonic time to resume
+        self.paused = {}                     # socket → peers whose outbox is full
+        self.congested = set()               # full outboxes fed by this frame
+        self.streams = {}                    # socket → [Stream, ...] being sent
+        self.stream_retry = False            # a pull was refused; try again soon
+        if slow_policy not in POLICIES:
+            raise ValueError(f"slow_policy must be one of {POLICIES}")
+        self.slow_policy = slow_policy
+
+        # group management; in cluster mode a replica fed by the registry
+        self.router = router                 # chat_cluster.Router or None
+        if router:
+            router.server = self
+            self.group = router.group
+        else:
+            self.group = grp.Group()
 
         # start listening socket
         self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        # the server closes connections itself (logout, resume takeover),
+        # which leaves TIME_WAIT entries that would block a quick restart
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuse_port:
+            self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         self.server.bind(SERVER)
         self.server.listen(5)
         self.all_sockets.append(self.server)
+        if router:
+            self.all_sockets.append(router.sock)
+
+        # per‑user chat indices: LRU cache over the .idx files,
+        # loaded/saved in the background
+        self.indices = IndexStore(index_dir, index_budget, substring_index)
 
-        # per‑user chat indices
-        self.indices = {}
+        # shared chat-room logs, kept in the same store, see room_index;
+        # named after this process so a restart or a sibling worker never
+        # reuses one
+        self.run_id = f"{int(time.time()):x}{os.getpid():x}"
+        self.rooms = {}                      # group key → (room name, users told of it)
+        # lines posted to each room kept here, whether or not its log is
+        # resident, for the result cache's keys
+        self.room_posts = {}                 # room name → count
+        self.indices.expire("room-", ROOM_KEEP)
+        self.room_sweep = time.monotonic()
 
         # sonnet database
         self.sonnet = indexer.PIndex("AllSonnets.txt")
+        self.sonnet_terms = self.sonnet.term_dict()
+
+        # search/poem run here, off the event loop
+        self.queries = QueryPool()
+        self.all_sockets.append(self.queries.wake_r)
+
+        # messages kept for users who dropped out mid-chat
+        self.mail = MailStore(index_dir, idle=self.queries.idle)
+
+        # ready-to-send frames for repeated queries
+        self.results = ResultCache()
+
+        # metrics, dumped to whoever connects to the admin port
+        self.admin = None
+        if admin_port:
+            self.admin = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.admin.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.admin.bind(("127.0.0.1", admin_port))
+            self.admin.listen(5)
+            self.all_sockets.append(self.admin)
+        self.init_metrics()
+
+        # opt-in slow-request log; send() only times itself when it is on
+        self.slowlog = SlowLog(slow_log, slow_ms) if slow_ms else None
+        self.send_time = 0.0
+        # when the request being handled came in, and whether it went to
+        # the query pool, to be timed when its answer is sent
+        self.request_start = 0.0
+        self.deferred = False
+
+        # `kill -USR1 <pid>` profiles the event loop
+        self.profile_dir = profile_dir
+        self.sampler = None
+        self.loop_thread = threading.current_thread()
+        if (self.loop_thread is threading.main_thread()
+                and hasattr(signal, "SIGUSR1")):         # not on Windows
+            signal.signal(signal.SIGUSR1,
+                          lambda *args: self.start_profile(PROFILE_SECONDS))
+
+    def init_metrics(self):
+        m = self.metrics = Metrics()
+        self.m_connections = m.counter("chat_connections_total", "TCP connections accepted")
+        self.m_login_ok = m.counter("chat_logins_total", "Login attempts", status="ok")
+        self.m_login_dup = m.counter("chat_logins_total", "Login attempts", status="duplicate")
+        self.m_frames_in = m.counter("chat_frames_in_total", "Frames received from clients")
+        self.m_frames_out = m.counter("chat_frames_out_total", "Frames sent to clients")
+        self.m_bytes_in = m.counter("chat_bytes_in_total", "Bytes received from clients")
+        self.m_bytes_out = m.counter("chat_bytes_out_total", "Bytes sent to clients")
+        self.m_fanout = m.histogram("chat_fanout_size", "Recipients per broadcast",
+                                    bounds=SIZE_BUCKETS)
+        self.m_loop = m.histogram("chat_loop_seconds",
+                                  "Select loop iteration, excluding the wait")
+        self.m_actions = {}              # action → latency histogram
+
+        m.gauge("chat_users_online", "Users logged in on this process",
+                fn=lambda: len(self.logged_name2sock))
+        m.gauge("chat_clients_pending", "Connections not yet logged in",
+                fn=lambda: len(self.new_clients))
+        m.gauge("chat_send_queue_bytes", "Unsent bytes in client socket buffers",
+                fn=lambda: self.send_queue_depth()[0])
+        m.gauge("chat_send_queue_max_bytes", "Largest single client send backlog",
+                fn=lambda: self.send_queue_depth()[1])
+        m.gauge("chat_queries_pending", "Search/poem queries awaiting a reply",
+                fn=lambda: len(self.queries.pending))
+        for key in ("entries", "resident_bytes", "budget_bytes", "hits",
+                    "misses", "evictions", "spills"):
+            m.gauge(f"chat_index_cache_{key}", f"User index cache: {key}",
+                    fn=lambda key=key: self.indices.stats()[key])
+        m.gauge("chat_sonnet_index_bytes", "Sonnet index size estimate",
+                fn=lambda: self.sonnet.nbytes)
+        for key in ("entries", "hits", "misses"):
+            m.gauge(f"chat_result_cache_{key}", f"Query result cache: {key}",
+                    fn=lambda key=key: self.results.stats()[key])
+        for key in ("posted", "refused", "queued"):
+            m.gauge(f"chat_mail_{key}", f"Offline messages: {key}",
+                    fn=lambda key=key: self.mail.stats()[key])
+        self.m_streams = m.counter("chat_streams_total",
+                                   "Replies sent in chunks")
+        m.gauge("chat_streams_active", "Chunked replies in progress",
+                fn=lambda: sum(len(q) for q in self.streams.values()))
+        self.m_resume_ok = m.counter("chat_resumes_total", "Session resume attempts",
+                                     status="ok")
+        self.m_resume_bad = m.counter("chat_resumes_total", "Session resume attempts",
+                                      status="expired")
+        m.gauge("chat_sessions_held", "Dropped sessions awaiting resume",
+                fn=lambda: len(self.held))
+        m.gauge("chat_users_away", "Users who dropped out of a chat",
+                fn=lambda: len(self.group.away))
+
+        self.m_throttle_user = m.counter("chat_throttled_total",
+                                         "Reads deferred by a rate limit", scope="user")
+        self.m_throttle_room = m.counter("chat_throttled_total",
+                                         "Reads deferred by a rate limit", scope="room")
+        self.m_paused = m.counter("chat_backpressure_pauses_total",
+                                  "Senders paused for a full peer outbox")
+        self.m_slow = m.counter("chat_slow_consumers_total",
+                                "Slow-consumer policy applications",
+                                policy=self.slow_policy)
+        m.gauge("chat_outbox_bytes", "Bytes queued in server-side outboxes",
+                fn=lambda: sum(ob.size for ob in self.outboxes.values()))
+        m.gauge("chat_outbox_spilled_bytes", "Outbox bytes spilled to disk",
+                fn=lambda: sum(ob.spilled for ob in self.outboxes.values()))
+        self.m_dropped = m.counter("chat_outbox_dropped_frames_total",
+                                   "Frames dropped for slow consumers")
+        m.gauge("chat_senders_paused", "Clients not being read from",
+                fn=lambda: len(self.paused) + len(self.throttled))
+
+    def send_queue_depth(self):
+        """(total, largest) bytes still queued in client socket buffers."""
+        total = largest = 0
+        if fcntl is None:
+            return total, largest
+        buf = b"\0" * 4
+        for sock in self.logged_name2sock.values():
+            try:
+                n = struct.unpack("i", fcntl.ioctl(sock, termios.TIOCOUTQ, buf))[0]
+            except OSError:
+                continue
+            total += n
+            largest = max(largest, n)
+        return total, largest
+
+    def serve_admin(self):
+        """
+        Answer one admin connection and hang up.  By default that is a
+        metrics dump; `profile [secs]` starts the stack sampler instead.
+        """
+        conn, _ = self.admin.accept()
+        try:
+            conn.settimeout(1.0)
+            cmd = []
+            if select.select([conn], [], [], ADMIN_WAIT)[0]:
+                cmd = conn.recv(256).decode(errors="ignore").split()
+            if cmd and cmd[0] == "profile":
+                try:
+                    secs = float(cmd[1]) if len(cmd) > 1 else PROFILE_SECONDS
+                except ValueError:
+                    secs = PROFILE_SECONDS
+                reply = self.start_profile(secs) + "\n"
+            else:
+                reply = self.metrics.render()
+            conn.sendall(reply.encode())
+        except OSError:
+            pass
+        finally:
+            conn.close()
+
+    def start_profile(self, seconds):
+        """Sample the event loop's stack for a while; see chat_profile."""
+        if self.sampler and self.sampler.is_alive():
+            return f"already profiling into {self.sampler.path}"
+        self.sampler = StackSampler(self.loop_thread, seconds,
+                                    out_dir=self.profile_dir)
+        self.sampler.start()
+        return f"profiling for {seconds:g}s into {self.sampler.path}"
+
+    def send(self, sock, frame):
+        """Queue a frame for a client and write what the socket takes now."""
+        ob = self.outboxes.get(sock)
+        if ob is None or sock in self.closing:
+            return
+        if self.slowlog:
+            start = time.perf_counter()
+        ob.push(encode(frame))
+        if sock not in self.sending:
+            if not ob.flush():
+                self.closing.add(sock)
+            elif len(ob):
+                self.sending.add(sock)
+        if self.slowlog:
+            self.send_time += time.perf_counter() - start
+        self.m_frames_out.inc()
+        self.m_bytes_out.inc(len(frame) + SIZE_SPEC)
+
+        if ob.size > HIGH_WATER:
+            self.congested.add(sock)
+            if ob.stalled is None:
+                ob.stalled = time.monotonic()
+            if ob.size > OUTBOX_LIMIT:
+                self.slow_consumer(sock, ob)
+
+    def flush(self, sock):
+        """The socket is writable: send more of its outbox."""
+        ob = self.outboxes.get(sock)
+        if ob is None:
+            self.sending.discard(sock)
+            return
+        if not ob.flush():
+            self.closing.add(sock)
+        if not len(ob):
+            self.sending.discard(sock)
+        if ob.size < LOW_WATER:
+            ob.stalled = None
+
+    def slow_consumer(self, sock, ob):
+        """A client is not reading its frames; apply the configured policy."""
+        self.m_slow.inc()
+        name = self.logged_sock2name.get(sock)
+        log.warning("Slow consumer %s: %d bytes queued, policy %s",
+                    name, len(ob), self.slow_policy)
+        if self.slow_policy == "disconnect":
+            self.closing.add(sock)
+        elif self.slow_policy == "disk":
+            ob.to_disk()
+        else:
+            self.m_dropped.inc(ob.drop())
+
+    def throttle(self, sock, name, action):
+        """Charge a frame to the user's (and room's) bucket; pause if in debt."""
+        now = time.monotonic()
+        wait = self.user_buckets[name].take(now=now)
+        if wait:
+            self.m_throttle_user.inc()
+        if action == "exchange":
+            found, key = self.group.find_group(name)
+            if found:
+                bucket = self.room_buckets.get(key)
+                if bucket is None:
+                    bucket = self.room_buckets[key] = TokenBucket(
+                        self.room_rate, self.room_burst)
+                room_wait = bucket.take(now=now)
+                if room_wait:
+                    self.m_throttle_room.inc()
+                    wait = max(wait, room_wait)
+        if wait:
+            self.throttled[sock] = now + wait
+
+    def release(self, now):
+        """Resume reading from clients whose pause is over."""
+        for sock, until in list(self.throttled.items()):
+            if until <= now:
+                del self.throttled[sock]
+        for name, (deadline, frames) in list(self.held.items()):
+            if deadline <= now:
+                self.end_session(name)
+        for sock, peers in list(self.paused.items()):
+            peers = {p for p in peers
+                     if p in self.outboxes and self.outboxes[p].size >= LOW_WATER}
+            if peers:
+                self.paused[sock] = peers
+            else:
+                del self.paused[sock]
+        for sock in list(self.sending):
+            ob = self.outboxes[sock]
+            if ob.stalled is not None and now - ob.stalled > STALL_TIMEOUT:
+                self.slow_consumer(sock, ob)
+
+    def next_timeout(self):
+        """How long select() may sleep before some deadline is due."""
+        timeout = self.queries.next_timeout()
+        now = time.monotonic()
+        deadlines = list(self.throttled.values())
+        deadlines += [deadline for deadline, _ in self.held.values()]
+        deadlines += [self.outboxes[s].stalled + STALL_TIMEOUT
+                      for s in self.sending if self.outboxes[s].stalled is not None]
+        if self.paused:
+            deadlines.append(now + STALL_TIMEOUT / 10)    # watch the peers drain
+        if self.stream_retry:
+            deadlines.append(now + STREAM_RETRY)
+        if self.router and self.router.routed:
+            deadlines.append(now)                # held during a group op
+        if deadlines:
+            due = max(min(deadlines) - now, 0)
+            timeout = due if timeout is None else min(timeout, due)
+        return timeout
+
+    def recv(self, sock):
+        raw = myrecv(sock)
+        if raw:
+            self.m_frames_in.inc()
+            self.m_bytes_in.inc(len(raw) + SIZE_SPEC)
+        return raw
 
     def new_client(self, sock):
         """Add a brand‑new socket before login."""
-        print("New connection")
+        log.debug("New connection")
+        self.m_connections.inc()
         sock.setblocking(0)
+        self.outboxes[sock] = Outbox(sock)
         self.new_clients.append(sock)
         self.all_sockets.append(sock)
 
     def login(self, sock):
         """Handle login action from a new client."""
-        raw = myrecv(sock)
+        t0 = time.perf_counter()
+        raw = self.recv(sock)
         if not raw:
             self.logout(sock)
             return
 
+        t1 = time.perf_counter()
         try:
             msg = json.loads(raw)
         except:
             self.logout(sock)
             return
+        t2 = time.perf_counter()
+        self.send_time = 0.0
+        self._login(sock, msg)
+        if self.slowlog:
+            t3 = time.perf_counter()
+            self.slowlog.record("login", msg.get("name"), len(raw),
+                                recv=t1 - t0, parse=t2 - t1,
+                                handler=t3 - t2 - self.send_time,
+                                send=self.send_time)
 
+    def _login(self, sock, msg):
+        if msg.get("action") == "resume":
+            self.resume(sock, msg.get("session"))
+            return
         if msg.get("action") != "login":
             self.logout(sock)
             return
 
         name = msg.get("name")
-        if not name or self.group.is_member(name):
+        if name in self.held:
+            # logging in afresh instead of resuming: drop the old session
+            self.end_session(name)
+        if not name or self.group.is_member(name) or not self.group.join(name):
             # duplicate
-            mysend(sock, json.dumps({"action":"login", "status":"duplicate"}))
-            print(f"Duplicate login attempt for {name}")
+            self.send(sock, json.dumps({"action":"login", "status":"duplicate"}))
+            self.m_login_dup.inc()
+            log.warning("Duplicate login attempt for %s", name)
             return
 
         # accept login
+        self.attach(sock, name)
+        self.user_buckets[name] = TokenBucket(self.user_rate, self.user_burst)
+        token = secrets.token_urlsafe(16)
+        self.sessions[token] = name
+        self.tokens[name] = token
+
+        # load or create index, without waiting for it
+        self.indices.open(name)
+
+        self.send(sock, json.dumps({"action":"login", "status":"ok",
+                                    "session":token}))
+        self.m_login_ok.inc()
+        log.info("%s logged in", name)
+
+        # dropped out of a chat last time: put them back in it
+        if self.group.rejoin(name):
+            peers = self.group.list_me(name)[1:]
+            self.send(sock, json.dumps({
+                "action":"connect",
+                "status":"request",
+                "from": peers[0] if peers else "",
+                "msg": f"Back in the chat with {', '.join(peers)}."
+            }))
+            self.deliver(peers, json.dumps({
+                "action":"connect",
+                "status":"request",
+                "from": name,
+                "msg": f"{name} is back."
+            }))
+
+    def attach(self, sock, name):
+        """Bind an authenticated socket to a user."""
         self.new_clients.remove(sock)
         self.logged_name2sock[name] = sock
         self.logged_sock2name[sock] = name
 
-        # load or create index
-        try:
-            self.indices[name] = pkl.load(open(f"{name}.idx", "rb"))
-        except Exception:
-            self.indices[name] = indexer.Index(name)
-
-        self.group.join(name)
-        mysend(sock, json.dumps({"action":"login", "status":"ok"}))
-        print(f"{name} logged in")
+    def resume(self, sock, token):
+        """Reattach a dropped session; no group or index work needed."""
+        name = self.sessions.get(token)
+        if name is None:
+            # unknown or expired; the client may log in on this socket
+            self.m_resume_bad.inc()
+            self.send(sock, json.dumps({"action":"resume", "status":"expired"}))
+            return
+        old = self.logged_name2sock.get(name)
+        if old is not None:
+            # the old connection is not known to be dead yet: replace it
+            self.close_socket(old)
+        deadline, frames = self.held.pop(name, (0, []))
+        self.attach(sock, name)
+        self.m_resume_ok.inc()
+        log.info("%s resumed session", name)
+        self.send(sock, json.dumps({"action":"resume", "status":"ok", "name":name}))
+        for ctime, frame in frames:
+            self.send(sock, frame)
 
-    def logout(self, sock):
-        """Clean up after a client disconnects."""
+    def logout(self, sock, explicit=False):
+        """Clean up after a client disconnects, or says it is leaving."""
+        start = time.perf_counter()
         name = self.logged_sock2name.get(sock)
-        if name:
-            print(f"{name} logging out")
-            # save index
-            try:
-                pkl.dump(self.indices[name], open(f"{name}.idx", "wb"))
-            except:
-                pass
-            # remove mappings
-            self.indices.pop(name, None)
-            self.logged_name2sock.pop(name, None)
-            self.logged_sock2name.pop(sock, None)
-            # remove from group
+        self._logout(sock, name, explicit)
+        if self.slowlog and name:
+            self.slowlog.record("logout", name, 0,
+                                handler=time.perf_counter() - start)
+
+    def _logout(self, sock, name, explicit=False):
+        self.close_socket(sock)
+        if not name:
+            return
+        if self.resume_grace and not explicit and name in self.tokens:
+            # hold everything for a while in case they resume
+            log.info("%s dropped; session held for %gs", name, self.resume_grace)
+            self.held[name] = (time.monotonic() + self.resume_grace, [])
+        else:
+            self.end_session(name, explicit)
+
+    def end_session(self, name, explicit=False):
+        """Log a user out for good: save, free, and leave the group."""
+        log.info("%s logging out", name)
+        deadline, frames = self.held.pop(name, (0, []))
+        self.keep_mail(name, frames)
+        # save index (queued, written in the background)
+        self.indices.close(name)
+        self.user_buckets.pop(name, None)
+        self.sessions.pop(self.tokens.pop(name, None), None)
+        if explicit:
             self.group.leave(name)
+        else:
+            # mid-chat, the group keeps their place
+            self.group.detach(name)
+        self.room_buckets = {k: b for k, b in self.room_buckets.items()
+                             if k in self.group.chat_grps}
+        self.prune_rooms()
+
+    def post_room(self, key, line):
+        """
+        Store a room's line once in this process's log of the room, and
+        note who here may see it.
+        """
+        room, told = self.rooms.get(key, (None, None))
+        if room is None:
+            room, told = self.rooms[key] = (f"room-{self.run_id}-{key}", set())
+            self.indices.open(room, RoomLog)
+        here = [u for u in self.group.chat_grps.get(key, ())
+                if u in self.logged_name2sock or u in self.held]
+        for user in here:
+            if user not in told:
+                self.indices.update(user, "join_room", room)
+                told.add(user)
+        # those who dropped out keep seeing the room, as their mail does
+        away = [u for u, k in self.group.away.items() if k == key and u in told]
+        self.indices.update(room, "post", line, here + away)
+        self.room_posts[room] = self.room_posts.get(room, 0) + 1
+
+    def prune_rooms(self):
+        """
+        Let the logs of rooms that have emptied be saved and paged out,
+        and now and then delete those not written for ROOM_KEEP.
+        """
+        for key in [k for k in self.rooms if k not in self.group.chat_grps]:
+            room, _ = self.rooms.pop(key)
+            self.room_posts.pop(room, None)
+            self.indices.close(room)
+        now = time.monotonic()
+        if now - self.room_sweep > ROOM_SWEEP:
+            self.room_sweep = now
+            self.indices.expire("room-", ROOM_KEEP)
+
+    def room_generation(self, room):
+        """
+        What a cached search of room must match: the count of lines
+        posted to a room kept here, or "done" for a room that can no
+        longer change -- one of this process's that has emptied, or in a
+        single server one of an earlier run.  A sibling worker's room
+        may still be written to, so in cluster mode that is None, and a
+        search that includes one is not cached.
+        """
+        if room in self.room_posts:
+            return self.room_posts[room]
+        if self.router is None or room.startswith(f"room-{self.run_id}-"):
+            return "done"
+        return None
 
+    def keep_mail(self, name, frames):
+        """Messages held for a session that was never resumed go to mail."""
+        for ctime, frame in frames:
+            msg = json.loads(frame)
+            if msg.get("action") == "exchange":
+                self.mail.post(name, {"ts": ctime, "from": msg.get("from"),
+                                      "message": msg.get("message")})
+
+    def close_socket(self, sock):
+        """Forget a connection; the user behind it is dealt with elsewhere."""
+        name = self.logged_sock2name.pop(sock, None)
+        if name is not None and self.logged_name2sock.get(name) is sock:
+            del self.logged_name2sock[name]
         if sock in self.new_clients:
             self.new_clients.remove(sock)
         if sock in self.all_sockets:
             self.all_sockets.remove(sock)
+        ob = self.outboxes.pop(sock, None)
+        if ob:
+            ob.close()
+        self.sending.discard(sock)
+        self.closing.discard(sock)
+        self.throttled.pop(sock, None)
+        self.paused.pop(sock, None)
+        self.streams.pop(sock, None)
         try:
             sock.close()
         except:
             pass
 
+    def deliver_local(self, names, frame):
+        """Send a serialized frame to those of `names` attached here."""
+        sent = 0
+        for name in names:
+            sock = self.logged_name2sock.get(name)
+            if sock:
+                self.send(sock, frame)
+                sent += 1
+            elif name in self.held:
+                frames = self.held[name][1]
+                if len(frames) < RESUME_FRAMES:
+                    ctime = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())
+                    frames.append((ctime, frame))
+        return sent
+
+    def deliver(self, names, frame, room=None):
+        """
+        Send a serialized frame to logged-in users, wherever they are.
+        room: (group key, line) for the other workers' room logs
+        """
+        self.m_fanout.observe(len(names))
+        sent = self.deliver_local(names, frame)
+        if self.router:
+            sent += self.router.forward(names, frame, room)
+        return sent
+
+    def query(self, sock, name, action, key, fn, *args):
+        """
+        Answer from the result cache, or run a slow query on the pool and
+        reply on completion (caching the frame under key, if given).
+        """
+        if key is not None:
+            frame = self.results.get(key)
+            if frame is not None:
+                self.send(sock, frame)
+                return
+        if self.queries.submit(name, sock, action, key, fn, *args,
+                               since=self.request_start):
+            self.deferred = True
+        else:
+            self.send(sock, json.dumps({"action":action, "status":"busy",
+                                     "results":EMPTY_RESULTS[action]}))
+
+    def finish_queries(self):
+        """Send the results of finished and timed-out queries."""
+        for name, sock, action, key, res, err, took in self.queries.completed():
+            if err:
+                log.error("Query error (%s): %s", action, err)
+                res = EMPTY_RESULTS[action]
+            if not (isinstance(res, Stream) and res.pulling):
+                self.query_done(action, name, took)      # not a later chunk
+            if isinstance(res, Stream):
+                # first chunks of a long reply, or the next one of it
+                res.pulling = False
+                res.action = action
+                if self.logged_sock2name.get(sock) == name:
+                    queue = self.streams.setdefault(sock, [])
+                    if res not in queue:
+                        queue.append(res)
+                        self.m_streams.inc()
+                continue
+            if isinstance(res, dict):        # a reply with more than results
+                frame = json.dumps(dict(res, action=action))
+            else:
+                frame = json.dumps({"action":action, "results":res})
+            if key is not None and not err:
+                self.results.put(key, frame)
+            if self.logged_sock2name.get(sock) == name:
+                self.send(sock, frame)
+
+        for name, sock, action, took in self.queries.expired():
+            queue = self.streams.get(sock)
+            if queue and queue[0].pulling and queue[0].action == action:
+                queue.pop(0)             # a chunk overran: end that reply
+            else:
+                self.query_done(action, name, took)
+            if self.logged_sock2name.get(sock) == name:
+                self.send(sock, json.dumps({"action":action, "status":"timeout",
+                                         "results":EMPTY_RESULTS[action]}))
+
+    def query_done(self, action, name, took):
+        """Time a request answered from the pool, from when it came in."""
+        if self.slowlog:
+            self.slowlog.record(action, name, None, query=took)
+        self.observe_action(action, took)
+
+    def observe_action(self, action, seconds):
+        hist = self.m_actions.get(action)
+        if hist is None:
+            if action not in ACTIONS:
+                action = "unknown"       # keep label cardinality bounded
+            hist = self.m_actions[action] = self.metrics.histogram(
+                "chat_action_seconds", "Time spent handling an action",
+                action=action)
+        hist.observe(seconds)
+
+    def pump_streams(self):
+        """Send more of each chunked reply whose client is keeping up."""
+        self.stream_retry = False
+        for sock, queue in list(self.streams.items()):
+            name = self.logged_sock2name.get(sock)
+            ob = self.outboxes.get(sock)
+            st = queue[0]
+            if name is None or ob is None:
+                del self.streams[sock]
+                continue
+            while st.ahead and ob.size < LOW_WATER:
+                self.send(sock, json.dumps({"action":st.action,
+                                            "chunk":st.ahead.pop(0)}))
+            if st.ahead or st.pulling:
+                continue
+            if st.done:
+                self.send(sock, json.dumps({"action":st.action, "done":True}))
+                queue.pop(0)
+                if not queue:
+                    del self.streams[sock]
+            elif self.queries.submit(name, sock, st.action, None, st.pull):
+                st.pulling = True
+            else:
+                self.stream_retry = True     # pool is busy: next round
+
+    def stream(self, chunks, empty):
+        """
+        Start a reply from a generator of chunks (on the query pool).  One
+        chunk is returned as is; longer replies become a Stream.
+        """
+        first = next(chunks, None)
+        if first is None:
+            return empty
+        second = next(chunks, None)
+        if second is None:
+            return first
+        return Stream(chunks, [first, second])
+
+    def wait_index(self, name, kind=None):
+        # on the query pool: let other queries compute while it loads
+        with self.queries.idle():
+            return self.indices.get(name, QUERY_TIMEOUT, kind)
+
+    def search(self, name, term, hits=False, fuzzy=False):
+        # runs on the query pool, so it may wait for the index to load
+        idx = self.wait_index(name)
+        if idx is not None and idx.rooms:
+            # the user's own lines and what they saw in rooms, by time; a
+            # room's lines are numbered within it, so they are tagged with it
+            sources, tags = [(idx, None)], [""]
+            for room in list(idx.rooms):
+                if not self.indices.exists(room):
+                    # expired: forget it rather than create it empty
+                    self.indices.update(name, "leave_room", room)
+                    continue
+                log_ = self.wait_index(room, RoomLog)
+                if log_ is None:
+                    continue
+                if name not in log_.ranges:
+                    self.indices.update(name, "leave_room", room)
+                    continue
+                ranges = log_.visible(name)
+                if ranges:
+                    sources.append((log_, ranges))
+                    tags.append(room)
+            found = room_index.search(sources, term, fuzzy, skip=f"{name}: ")
+            if hits:
+                return self.stream(chunk_list(([n, line, sp, tags[k]] if k else [n, line, sp]
+                                               for k, n, line, sp in found),
+                                              measure=hit_chars, clip=clip_hit), [])
+            return self.stream(chunk_text(f"{tags[k]}:{n}: {line}\n" if k else f"{n}: {line}\n"
+                                          for k, n, line, _ in found), "")
+        if hits:
+            # [line_number, line, [[start, end], ...]] for highlighting
+            if idx is None:
+                return []
+            found = ([n, line, sp] for n, line, sp in idx.search_hits(term, fuzzy))
+            return self.stream(chunk_list(found, measure=hit_chars, clip=clip_hit), [])
+        if idx is None:
+            return ""
+        return self.stream(chunk_text(idx.search_iter(term, fuzzy)), "")
+
+    def history(self, name, cursor, limit, since, until):
+        # runs on the query pool, like search
+        idx = self.wait_index(name)
+        if idx is None:
+            return {"results": [], "cursor": None, "more": False}
+        page, cursor = idx.history(cursor, limit, since, until)
+        return {"results": [[n, ts, line] for n, ts, line in page],
+                "cursor": cursor, "more": cursor is not None}
+
+    def suggest(self, name, query, limit):
+        # runs on the query pool: the word list may need (re)building
+        idx = self.wait_index(name)
+        if idx is None:
+            return []
+        return idx.term_dict().suggest(query, limit)
+
+    def get_poem(self, tgt):
+        try:
+            poem = self.sonnet.get_poem(int(tgt))
+        except:
+            return []
+        return self.stream(chunk_list(poem), [])
+
     def handle_msg(self, from_sock):
         """Process one JSON message from a logged‑in client."""
+        t0 = time.perf_counter()
         # 1) receive safely
         try:
-            raw = myrecv(from_sock)
+            raw = self.recv(from_sock)
         except (ConnectionResetError, OSError):
             self.logout(from_sock)
             return
@@ -116,61 +882,98 @@ class Server:
             return
 
         # 2) parse
+        t1 = time.perf_counter()
         try:
             msg = json.loads(raw)
         except:
             return
 
+        # 3) act, timing each action
         action = msg.get("action")
         name = self.logged_sock2name.get(from_sock)
+        self.throttle(from_sock, name, action)
+        t2 = time.perf_counter()
+        self.send_time = 0.0
+        self.request_start = t2
+        self.deferred = False
+        self.congested.clear()
+        self.dispatch(from_sock, action, msg)
+        t3 = time.perf_counter()
+
+        # 4) stop reading from a sender whose peers cannot keep up
+        self.congested.discard(from_sock)
+        if self.congested:
+            self.paused.setdefault(from_sock, set()).update(self.congested)
+            self.m_paused.inc()
+            self.congested = set()
+        if self.deferred:
+            return                       # timed by query_done() once answered
+        if self.slowlog:
+            self.slowlog.record(action, name, len(raw),
+                                recv=t1 - t0, parse=t2 - t1,
+                                handler=t3 - t2 - self.send_time,
+                                send=self.send_time)
+        self.observe_action(action, t3 - t2)
+
+    def dispatch(self, from_sock, action, msg):
+        """Carry out one parsed client request."""
+        name = self.logged_sock2name.get(from_sock)
 
         # === CONNECT ===
         if action == "connect":
             target = msg.get("target")
             if target == name:
-                mysend(from_sock, json.dumps({"action":"connect","status":"self","msg":"Cannot connect to yourself"}))
+                self.send(from_sock, json.dumps({"action":"connect","status":"self","msg":"Cannot connect to yourself"}))
                 return
 
             if not self.group.is_member(target):
-                mysend(from_sock, json.dumps({"action":"connect","status":"no-user","msg":f"{target} not online"}))
+                self.send(from_sock, json.dumps({"action":"connect","status":"no-user","msg":f"{target} not online"}))
                 return
 
             # perform group connect
             self.group.connect(name, target)
             # initiator gets success
-            mysend(from_sock, json.dumps({"action":"connect","status":"success","msg":f"Connected to {target}"}))
+            self.send(from_sock, json.dumps({"action":"connect","status":"success","msg":f"Connected to {target}"}))
 
             # inform all existing members (excluding initiator)
-            members = self.group.list_me(name)
-            for peer in members:
-                if peer != name:
-                    sock_peer = self.logged_name2sock[peer]
-                    mysend(sock_peer, json.dumps({
-                        "action":"connect",
-                        "status":"request",
-                        "from": name,
-                        "msg": f"{name} has joined the chat."
-                    }))
+            members = self.group.list_me(name)[1:]
+            self.deliver(members, json.dumps({
+                "action":"connect",
+                "status":"request",
+                "from": name,
+                "msg": f"{name} has joined the chat."
+            }))
             return
 
         # === EXCHANGE ===
         if action == "exchange":
             text = msg.get("message","")
-            # index message
-            idx = self.indices.get(name)
-            if idx:
-                idx.add_msg_and_index(f"{name}: {text}")
+            line = f"{name}: {text}"
+            # index message (buffered if the index is still loading)
+            self.indices.add_msg(name, line)
+
+            # and once in the room's log, for everyone in the room
+            found, key = self.group.find_group(name)
+            room = None
+            if found:
+                self.post_room(key, line)
+                room = (key, line)
 
             # broadcast to group members
             members = self.group.list_me(name)[1:]
-            for peer in members:
-                sock_peer = self.logged_name2sock.get(peer)
-                if sock_peer:
-                    mysend(sock_peer, json.dumps({
-                        "action":"exchange",
-                        "from": name,
-                        "message": text
-                    }))
+            self.deliver(members, json.dumps({
+                "action":"exchange",
+                "from": name,
+                "message": text
+            }), room)
+
+            # and keep it for those who dropped out
+            away = self.group.list_away(name)
+            if away:
+                ctime = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())
+                for peer in away:
+                    self.mail.post(peer, {"ts": ctime, "from": name,
+                                          "message": text})
             return
 
         # === DISCONNECT ===
@@ -179,77 +982,154 @@ class Server:
             members = self.group.list_me(name)
             # leave group
             self.group.disconnect(name)
+            self.prune_rooms()
 
             # broadcast leave to others
-            for peer in members:
-                if peer != name and peer in self.logged_name2sock:
-                    sock_peer = self.logged_name2sock[peer]
-                    mysend(sock_peer, json.dumps({
-                        "action":"disconnect",
-                        "from": name,
-                        "msg": f"{name} has left the chat."
-                    }))
+            self.deliver([p for p in members if p != name], json.dumps({
+                "action":"disconnect",
+                "from": name,
+                "msg": f"{name} has left the chat."
+            }))
 
             # if one left alone, notify
             if len(members) == 1:
-                lone = members[0]
-                sock_lone = self.logged_name2sock.get(lone)
-                if sock_lone:
-                    mysend(sock_lone, json.dumps({
-                        "action":"disconnect",
-                        "msg": "Everyone left, you are alone."
-                    }))
+                self.deliver(members, json.dumps({
+                    "action":"disconnect",
+                    "msg": "Everyone left, you are alone."
+                }))
             return
 
         # === LIST ===
         if action == "list":
             # compile "user: n_peers" list
             status = {}
-            for user, sock in self.logged_name2sock.items():
+            for user in self.group.members:
                 count = max(len(self.group.list_me(user)) - 1, 0)
                 status[user] = count
             results = ", ".join(f"{u}:{status[u]}" for u in status)
-            mysend(from_sock, json.dumps({"action":"list","results":results}))
+            self.send(from_sock, json.dumps({"action":"list","results":results}))
             return
 
         # === POEM ===
         if action == "poem":
             tgt = msg.get("target","")
             try:
-                num = int(tgt)
-                poem = self.sonnet.get_poem(num)
-            except:
-                poem = []
-            mysend(from_sock, json.dumps({"action":"poem","results":poem}))
+                key = poem_key(int(tgt))
+            except ValueError:
+                key = None
+            self.query(from_sock, name, "poem", key, self.get_poem, tgt)
             return
 
         # === TIME ===
         if action == "time":
             ctime = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())
-            mysend(from_sock, json.dumps({"action":"time","results":ctime}))
+            self.send(from_sock, json.dumps({"action":"time","results":ctime}))
             return
 
         # === SEARCH ===
         if action == "search":
             term = msg.get("target","")
-            idx = self.indices.get(name)
-            if idx:
-                res = idx.search(term)
+            hits = bool(msg.get("hits"))     # structured hits with offsets
+            fuzzy = msg.get("mode") == "fuzzy"   # tolerate typos in the words
+            idx = self.indices.peek(name)
+            rooms = [(r, self.room_generation(r)) for r in idx.rooms] if idx else []
+            key = search_key(name, idx, term, hits, fuzzy, rooms)
+            self.query(from_sock, name, "search", key, self.search, name, term,
+                       hits, fuzzy)
+            return
+
+        # === HISTORY ===
+        if action == "history":
+            # pages of stored lines, newest first; cursor continues a walk back
+            def number(key):
+                v = msg.get(key)
+                return v if isinstance(v, (int, float)) else None
+            cursor = msg.get("cursor")
+            if not isinstance(cursor, int):
+                cursor = None
+            limit = msg.get("limit")
+            if not isinstance(limit, int):
+                limit = indexer.HISTORY_PAGE
+            limit = min(max(limit, 1), HISTORY_MAX)
+            self.query(from_sock, name, "history", None, self.history, name,
+                       cursor, limit, number("since"), number("until"))
+            return
+
+        # === LOGOUT ===
+        if action == "logout":
+            # leaving on purpose: no session to resume, no place kept
+            self.logout(from_sock, explicit=True)
+            return
+
+        # === SYNC ===
+        if action == "sync":
+            # cursor acknowledges what the client has; next batch follows
+            cursor = msg.get("cursor")
+            if not isinstance(cursor, int):
+                cursor = None
+            self.query(from_sock, name, "sync", None, self.mail.read, name, cursor)
+            return
+
+        # === SUGGEST ===
+        if action == "suggest":
+            # completions of a prefix or wildcard, most frequent first, from
+            # the user's own messages or (scope "sonnets") the poems
+            query = msg.get("target")
+            if not isinstance(query, str) or not query.strip("*"):
+                self.send(from_sock, json.dumps({"action":"suggest","results":[]}))
+                return
+            limit = msg.get("limit")
+            if not isinstance(limit, int):
+                limit = SUGGEST_LIMIT
+            limit = min(max(limit, 1), SUGGEST_MAX)
+            if msg.get("scope") == "sonnets":
+                # built at startup, answered in microseconds
+                res = self.sonnet_terms.suggest(query, limit)
+                self.send(from_sock, json.dumps({"action":"suggest","results":res}))
             else:
-                res = ""
-            mysend(from_sock, json.dumps({"action":"search","results":res}))
+                self.query(from_sock, name, "suggest", None, self.suggest, name,
+                           query, limit)
             return
 
         # unknown action → ignore
         return
 
     def run(self):
-        print("Server running on", SERVER)
+        """Serve until interrupted, with the GIL switch interval cut."""
+        switch = sys.getswitchinterval()
+        sys.setswitchinterval(SWITCH_INTERVAL)   # see query_pool
+        try:
+            self.loop()
+        finally:
+            sys.setswitchinterval(switch)
+
+    def loop(self):
+        log.info("Server running on %s", SERVER)
         while True:
+            readers = self.all_sockets
+            if self.throttled or self.paused:
+                readers = [s for s in readers
+                           if s not in self.throttled and s not in self.paused]
             try:
-                read, _, _ = select.select(self.all_sockets, [], [])
+                read, write, _ = select.select(readers, list(self.sending), [],
+                                               self.next_timeout())
             except Exception:
                 continue
+            start = time.perf_counter()
+            read = set(read)
+
+            # drain client outboxes, then lift pauses that are over
+            for sock in write:
+                self.flush(sock)
+            self.release(time.monotonic())
+
+            # answer finished (or overdue) search/poem queries
+            if self.queries.wake_r in read or self.queries.pending:
+                self.finish_queries()
+
+            # keep chunked replies flowing
+            if self.streams:
+                self.pump_streams()
 
             # handle logged‑in clients
             for sock in list(self.logged_name2sock.values()):
@@ -257,7 +1137,7 @@ class Server:
                     try:
                         self.handle_msg(sock)
                     except Exception as e:
-                        print("Error:", e)
+                        log.exception("Error handling message: %s", e)
                         self.logout(sock)
 
             # handle new clients (awaiting login)
@@ -266,18 +1146,91 @@ class Server:
                     try:
                         self.login(sock)
                     except Exception as e:
-                        print("Login error:", e)
+                        log.exception("Login error: %s", e)
                         self.logout(sock)
 
+            # frames and group updates from sibling workers
+            if self.router and (self.router.sock in read or self.router.routed):
+                self.router.handle()
+
             # accept brand new connections
             if self.server in read:
                 sock_new, addr = self.server.accept()
                 self.new_client(sock_new)
 
+            # metrics scrape
+            if self.admin and self.admin in read:
+                self.serve_admin()
+
+            # clients that hung up or were cut off while we wrote to them
+            for sock in list(self.closing):
+                self.logout(sock)
+
+            self.m_loop.observe(time.perf_counter() - start)
+
 
 def main():
-    server = Server()
-    server.run()
+    import argparse
+    parser = argparse.ArgumentParser(description='chat server')
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help='worker processes sharing the port (SO_REUSEPORT)')
+    parser.add_argument('--index-dir', type=str, default='.',
+                        help='directory holding the <user>.idx files')
+    parser.add_argument('--index-budget', type=int,
+                        default=INDEX_BUDGET // (1024 * 1024),
+                        help='MB of user indices kept in memory')
+    parser.add_argument('--admin-port', type=int, default=ADMIN_PORT,
+                        help='local port serving metrics (0 = off); '
+                             'worker i uses admin-port + i')
+    parser.add_argument('--slow-ms', type=float, default=0,
+                        help='log requests slower than this (0 = off)')
+    parser.add_argument('--slow-log', type=str, default='slow.log',
+                        help='where the slow-request log goes')
+    parser.add_argument('--profile-dir', type=str, default='.',
+                        help='where SIGUSR1 / admin "profile" writes stacks')
+    parser.add_argument('--user-rate', type=float, default=USER_RATE,
+                        help='frames per second each user may send')
+    parser.add_argument('--room-rate', type=float, default=ROOM_RATE,
+                        help='messages per second each chat room may carry')
+    parser.add_argument('--user-burst', type=float, default=USER_BURST,
+                        help='frames a user may send at once before the rate applies')
+    parser.add_argument('--room-burst', type=float, default=ROOM_BURST,
+                        help='messages a room may carry at once before the rate applies')
+    parser.add_argument('--slow-consumer', choices=POLICIES, default='drop',
+                        help='what to do with a client that stops reading')
+    parser.add_argument('--resume-grace', type=float, default=RESUME_GRACE,
+                        help='seconds a dropped client may resume its session '
+                             '(0 = off; always off with --workers)')
+    parser.add_argument('--substring-index', action='store_true',
+                        help='answer one-word searches from suffix arrays '
+                             '(faster searches, ~9 bytes of memory per character)')
+    parser.add_argument('--log-level', type=str, default='INFO',
+                        help='DEBUG, INFO, WARNING or ERROR')
+    parser.add_argument('--log-json', action='store_true',
+                        help='one JSON object per log line')
+    args = parser.parse_args()
+    chat_log.setup(args.log_level, args.log_json)
+
+    opts = dict(index_dir=args.index_dir,
+                index_budget=args.index_budget * 1024 * 1024,
+                admin_port=args.admin_port,
+                slow_ms=args.slow_ms, slow_log=args.slow_log,
+                profile_dir=args.profile_dir,
+                user_rate=args.user_rate, room_rate=args.room_rate,
+                user_burst=args.user_burst, room_burst=args.room_burst,
+                slow_policy=args.slow_consumer,
+                resume_grace=args.resume_grace,
+                substring_index=args.substring_index)
+    try:
+        if args.workers > 1:
+            import chat_cluster
+            chat_cluster.serve(args.workers, log_level=args.log_level,
+                               log_json=args.log_json, **opts)
+        else:
+            server = Server(**opts)
+            server.run()
+    finally:
+        chat_log.shutdown()
 
 
 if __name__ == "__main__":
@@ -1,5 +1,9 @@
 import socket
 import time
+import json
+import logging
+
+log = logging.getLogger("chat.net")
 
 # use local loop back address by default
 CHAT_IP = '127.0.0.1'
@@ -18,6 +22,12 @@ S_CHATTING  = 3
 
 SIZE_SPEC = 5
 
+# Replies too big for one frame are sent as a run of frames, each
+# {"action": ..., "chunk": part}, then {"action": ..., "done": true}.
+# A chunk holds at most CHUNK_CHARS of text, so even if json escapes
+# every character as \uXXXX it stays under the 10**SIZE_SPEC frame cap.
+CHUNK_CHARS = 12 * 1024
+
 CHAT_WAIT = 0.2
 
 def print_state(state):
@@ -41,7 +51,7 @@ def mysend(s, msg):
     while total_sent < len(msg) :
         sent = s.send(msg[total_sent:])
         if sent==0:
-            print('server disconnected')
+            log.debug('server disconnected')
             break
         total_sent += sent
 
@@ -51,7 +61,7 @@ def myrecv(s):
     while len(size) < SIZE_SPEC:
         text = s.recv(SIZE_SPEC - len(size)).decode()
         if not text:
-            print('disconnected')
+            log.debug('disconnected')
             return('')
         size += text
     size = int(size)
@@ -60,7 +70,7 @@ def myrecv(s):
     while len(msg) < size:
         text = s.recv(size-len(msg)).decode()
         if text == b'':
-            print('disconnected')
+            log.debug('disconnected')
             break
         msg += text
     #print ('received '+message)
@@ -69,3 +79,75 @@ def myrecv(s):
 def text_proc(text, user):
     ctime = time.strftime('%d.%m.%y,%H:%M', time.localtime())
     return('(' + ctime + ') ' + user + ' : ' + text) # message goes directly to screen
+
+def chunk_text(pieces, size=CHUNK_CHARS):
+    # join strings into chunks of exactly `size` characters (the last
+    # one shorter); a long piece is split, the receiver concatenates
+    buf = []
+    n = 0
+    for piece in pieces:
+        buf.append(piece)
+        n += len(piece)
+        if n >= size:
+            text = "".join(buf)
+            while len(text) >= size:
+                yield text[:size]
+                text = text[size:]
+            buf = [text]
+            n = len(text)
+    if n:
+        yield "".join(buf)
+
+def clip_text(item, size):
+    return item[:size]
+
+def chunk_list(items, size=CHUNK_CHARS, measure=len, clip=clip_text):
+    # group items into lists of about `size` characters in total, as
+    # measure(item) counts them (strings by default); an item longer than
+    # `size` on its own is cut down to fit by clip(item, size) first
+    part = []
+    n = 0
+    for item in items:
+        k = measure(item)
+        if k > size:
+            item = clip(item, size)
+            k = measure(item)
+        if part and n + k > size:
+            yield part
+            part = []
+            n = 0
+        part.append(item)
+        n += k
+    if part:
+        yield part
+
+def recv_results(s, action, stray):
+    # read the reply to `action`; if it comes in chunks, read them all and
+    # put the reassembled value under "results" like a single-frame reply.
+    # Other frames that arrive meanwhile (a peer's message, say) are
+    # appended to stray as received, for the caller to handle after.
+    def next_frame():
+        while True:
+            raw = myrecv(s)
+            msg = json.loads(raw)
+            if msg.get("action") == action:
+                return msg
+            stray.append(raw)
+
+    msg = next_frame()
+    if "chunk" not in msg:
+        return msg
+    parts = [msg["chunk"]]
+    while True:
+        msg = next_frame()
+        if "chunk" in msg:
+            parts.append(msg["chunk"])
+        elif msg.get("done") or "status" in msg:
+            break
+    if isinstance(parts[0], list):
+        results = [item for part in parts for item in part]
+    else:
+        results = "".join(parts)
+    msg.pop("done", None)
+    msg["results"] = results
+    return msg
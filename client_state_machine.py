@@ -5,6 +5,7 @@ Created on Sun Apr  5 00:00:32 2015
 """
 from chat_utils import *
 import json
+import time
 
 class ClientSM:
     def __init__(self, s):
@@ -13,6 +14,8 @@ class ClientSM:
         self.me = ''
         self.out_msg = ''
         self.s = s
+        self.history_cursor = None
+        self.backlog = []       # frames that came in while waiting for a reply
 
     def set_state(self, state):
         self.state = state
@@ -48,6 +51,13 @@ class ClientSM:
         self.out_msg += 'You are disconnected from ' + self.peer + '\n'
         self.peer = ''
 
+    def sync(self, batch):
+        # messages kept while we were away; ask for more until none are left
+        for m in batch.get("results", []):
+            self.out_msg += '(' + m["ts"] + ') ' + m["from"] + ': ' + m["message"] + '\n'
+        if batch.get("results"):
+            mysend(self.s, json.dumps({"action":"sync", "cursor":batch["cursor"]}))
+
     def proc(self, my_msg, peer_msg):
         self.out_msg = ''
 #==============================================================================
@@ -60,6 +70,7 @@ class ClientSM:
             if len(my_msg) > 0:
 
                 if my_msg == 'q':
+                    mysend(self.s, json.dumps({"action":"logout"}))
                     self.out_msg += 'See you next time!\n'
                     self.state = S_OFFLINE
 
@@ -74,6 +85,17 @@ class ClientSM:
                     self.out_msg += 'Here are all the users in the system:\n'
                     self.out_msg += logged_in
 
+                elif my_msg == 'history':
+                    # one page per command, walking back from the newest
+                    mysend(self.s, json.dumps({"action":"history", "cursor":self.history_cursor}))
+                    page = json.loads(myrecv(self.s))
+                    self.out_msg += "".join(
+                        time.strftime('(%d.%m.%y,%H:%M) ', time.localtime(ts)) + line + '\n'
+                        for n, ts, line in page["results"])
+                    self.history_cursor = page.get("cursor")
+                    if self.history_cursor is None:
+                        self.out_msg += '(start of history)\n'
+
                 elif my_msg[0] == 'c':
                     peer = my_msg[1:]
                     peer = peer.strip()
@@ -87,7 +109,7 @@ class ClientSM:
                 elif my_msg[0] == '?':
                     term = my_msg[1:].strip()
                     mysend(self.s, json.dumps({"action":"search", "target":term}))
-                    tmp = json.loads(myrecv(self.s))["results"]
+                    tmp = recv_results(self.s, "search", self.backlog)["results"]
                     search_rslt = tmp.strip()
                     if (len(search_rslt)) > 0:
                         self.out_msg += search_rslt + '\n\n'
@@ -97,7 +119,7 @@ class ClientSM:
                 elif my_msg[0] == 'p' and my_msg[1:].isdigit():
                     poem_idx = my_msg[1:].strip()
                     mysend(self.s, json.dumps({"action":"poem", "target":poem_idx}))
-                    poem = json.loads(myrecv(self.s))["results"]
+                    poem = recv_results(self.s, "poem", self.backlog)["results"]
                     poem = "\n".join(poem)
                     if (len(poem) > 0):
                         self.out_msg += poem + '\n\n'
@@ -114,7 +136,10 @@ class ClientSM:
                     self.out_msg += " json.loads failed " + str(err)
                     return self.out_msg
             
-                if peer_msg["action"] == "connect":
+                if peer_msg["action"] == "sync":
+                    self.sync(peer_msg)
+
+                elif peer_msg["action"] == "connect":
 
                     # ----------your code here------#
                     if peer_msg["status"] == "request":
@@ -141,7 +166,9 @@ class ClientSM:
                 
                 peer_msg = json.loads(peer_msg)
                 
-                if peer_msg["action"] == "connect":
+                if peer_msg["action"] == "sync":
+                    self.sync(peer_msg)
+                elif peer_msg["action"] == "connect":
                     self.out_msg += peer_msg["from"] + " joins"
                 elif peer_msg["action"] == "disconnect":
                     self.state = S_LOGGEDIN
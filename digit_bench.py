@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Keras vs digit_engine.DigitNet on the handwritten-digit model.
+
+Measures, for each backend:
+
+    load          import + model load, in a fresh process
+    single        latency of one 28x28 image (what the CNN button does)
+    batch_<n>     images per second in batches of n
+
+and checks that both pick the same class for every input.  Inputs are
+random strokes on a blank 28x28 canvas, so most pixels are 0 as in real
+drawings.  Keras is skipped if TensorFlow is not installed.
+
+    python digit_engine.py mnist.h5 mnist.npz     # once
+    python digit_bench.py
+    python digit_bench.py --batches 1,16,64 --json digits.json
+"""
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+import numpy as np
+
+import digit_engine
+
+LOAD_KERAS = ("import time; t = time.perf_counter(); import tensorflow as tf; "
+              "tf.keras.models.load_model({!r}, compile=False); "
+              "print(time.perf_counter() - t)")
+LOAD_NUMPY = ("import time; t = time.perf_counter(); import digit_engine; "
+              "digit_engine.DigitNet.load({!r}); print(time.perf_counter() - t)")
+
+
+def drawings(n, seed):
+    """n images of a few random thick strokes, float32 in [0, 1]."""
+    rng = np.random.default_rng(seed)
+    imgs = np.zeros((n, 28, 28), np.float32)
+    for img in imgs:
+        for _ in range(rng.integers(1, 4)):
+            (y0, x0), (y1, x1) = rng.integers(4, 24, (2, 2))
+            for t in np.linspace(0, 1, 20):
+                y, x = int(y0 + (y1 - y0) * t), int(x0 + (x1 - x0) * t)
+                img[y - 1:y + 2, x - 1:x + 2] = 1.0
+    return imgs[..., None]
+
+
+def timed(fn, repeat):
+    """Run fn repeat times; return the sorted durations in seconds."""
+    runs = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn()
+        runs.append(time.perf_counter() - t)
+    return sorted(runs)
+
+
+def cold_load(code):
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True,
+                         text=True, check=True).stdout
+    return float(out.split()[-1])
+
+
+def bench(predict, imgs, opts):
+    res = {"single_ms": round(timed(lambda: predict(imgs[:1]), opts.repeat)
+                              [opts.repeat // 2] * 1e3, 3)}
+    for b in opts.batches:
+        batch = imgs[:b]
+        took = timed(lambda: predict(batch), opts.repeat)[opts.repeat // 2]
+        res[f"batch_{b}_per_s"] = round(b / took)
+    return res
+
+
+def run(opts):
+    imgs = drawings(max(opts.batches + [opts.check]), opts.seed)
+    net = digit_engine.DigitNet.load(opts.npz)
+    results = {"config": {"npz": opts.npz, "h5": opts.h5, "batches": opts.batches,
+                          "repeat": opts.repeat, "numpy": np.__version__}}
+
+    res = results["numpy"] = bench(net.predict, imgs, opts)
+    res["load_s"] = round(cold_load(LOAD_NUMPY.format(opts.npz)), 3)
+
+    try:
+        import tensorflow as tf
+    except ImportError:
+        print("tensorflow not installed; numpy only", file=sys.stderr)
+        return results
+    model = tf.keras.models.load_model(opts.h5, compile=False)
+    # predict() is what the GUI called; model() skips its batching machinery
+    res = results["keras_predict"] = bench(lambda x: model.predict(x, verbose=0), imgs, opts)
+    res["load_s"] = round(cold_load(LOAD_KERAS.format(opts.h5)), 3)
+    results["keras_call"] = bench(lambda x: model(x, training=False).numpy(), imgs, opts)
+
+    x = imgs[:opts.check]
+    ref, got = model.predict(x, verbose=0), net.predict(x)
+    results["agreement"] = {
+        "images": opts.check,
+        "same_class": float((ref.argmax(-1) == got.argmax(-1)).mean()),
+        "max_abs_diff": float(np.abs(ref - got).max()),
+    }
+    return results
+
+
+def print_table(res):
+    backends = [b for b in ("numpy", "keras_predict", "keras_call") if b in res]
+    labels = sorted({k for b in backends for k in res[b]},
+                    key=lambda k: (k != "load_s", k != "single_ms", len(k), k))
+    print(f"{'benchmark':<20}" + "".join(f"{b:>16}" for b in backends))
+    for label in labels:
+        print(f"{label:<20}" + "".join(f"{res[b].get(label, '-'):>16}" for b in backends))
+    if "agreement" in res:
+        a = res["agreement"]
+        print(f"\n{a['images']} images: {a['same_class']:.1%} same class, "
+              f"max |diff| {a['max_abs_diff']:.2e}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='digit model benchmarks')
+    parser.add_argument('--npz', default='mnist.npz')
+    parser.add_argument('--h5', default='mnist.h5')
+    parser.add_argument('--batches', type=lambda s: [int(x) for x in s.split(',')],
+                        default=[1, 8, 64, 256], help='comma-separated batch sizes')
+    parser.add_argument('--check', type=int, default=512,
+                        help='images compared between the backends')
+    parser.add_argument('--repeat', type=int, default=15)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', type=str, default=None,
+                        help='write results here')
+    opts = parser.parse_args()
+
+    res = run(opts)
+    print_table(res)
+    if opts.json:
+        with open(opts.json, "w") as f:
+            json.dump(res, f, indent=2)
+    if res.get("agreement", {}).get("same_class", 1.0) < 1.0:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
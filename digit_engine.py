@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+A pure-NumPy forward pass for the handwritten-digit CNN.
+
+The GUI's "CNN" button used to run mnist.h5 through Keras, which means
+importing all of TensorFlow and paying its dispatch overhead for one
+28x28 image.  The network is small enough to evaluate directly: export
+the weights once (this step does need TensorFlow),
+
+    python digit_engine.py mnist.h5 mnist.npz
+
+and load the .npz anywhere NumPy is installed:
+
+    net = digit_engine.DigitNet.load("mnist.npz")
+    probs = net.predict(batch)          # (n, 28, 28[, 1]) floats in [0, 1]
+
+Supported layers are the ones a Sequential MNIST model is built from:
+Conv2D, MaxPooling2D, AveragePooling2D, Dense, Flatten, Reshape,
+BatchNormalization (folded into a scale and shift at export), Activation,
+ReLU and Softmax; Dropout and InputLayer are skipped.  Data stays in
+Keras' channels-last layout so Flatten, and therefore the Dense weights,
+line up.  Anything else makes export() fail rather than quietly produce
+a different network.
+"""
+import json
+import argparse
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+FORMAT = 1
+
+
+def _relu(x):
+    return np.maximum(x, 0, out=x)
+
+
+def _softmax(x):
+    e = np.exp(x - x.max(axis=-1, keepdims=True))
+    return e / e.sum(axis=-1, keepdims=True)
+
+
+ACTIVATIONS = {
+    "linear": lambda x: x,
+    "relu": _relu,
+    "softmax": _softmax,
+    "sigmoid": lambda x: 1.0 / (1.0 + np.exp(-x)),
+    "tanh": np.tanh,
+}
+
+
+def _pad_same(x, size, strides, value=0.0):
+    """Pad NHWC x the way TensorFlow's "same" padding does."""
+    pads = [(0, 0)]
+    for n, k, s in zip(x.shape[1:3], size, strides):
+        total = max((-(-n // s) - 1) * s + k - n, 0)
+        pads.append((total // 2, total - total // 2))
+    pads.append((0, 0))
+    return np.pad(x, pads, constant_values=value)
+
+
+def _windows(x, size, strides):
+    """(n, h', w', c, kh, kw) view of every window, no copy."""
+    w = sliding_window_view(x, size, axis=(1, 2))
+    return w[:, ::strides[0], ::strides[1]]
+
+
+def conv2d(x, kernel, bias, strides=(1, 1), padding="valid"):
+    """x (n, h, w, cin), kernel (kh, kw, cin, cout) as Keras stores it."""
+    size = kernel.shape[:2]
+    if padding == "same":
+        x = _pad_same(x, size, strides)
+    win = _windows(x, size, strides)
+    # contract (cin, kh, kw) against the kernel in one BLAS call
+    out = np.tensordot(win, kernel.transpose(2, 0, 1, 3), axes=3)
+    if bias is not None:
+        out += bias
+    return out
+
+
+def pool2d(x, size, strides, padding="valid", op=np.max):
+    if padding == "same":
+        if op is np.max:
+            x = _pad_same(x, size, strides, -np.inf)
+        else:
+            # Keras averages over the real cells only
+            ones = _pad_same(np.ones_like(x[:1, ..., :1]), size, strides)
+            x = _pad_same(x, size, strides)
+            counts = _windows(ones, size, strides).sum(axis=(-2, -1))
+            return _windows(x, size, strides).sum(axis=(-2, -1)) / counts
+    return op(_windows(x, size, strides), axis=(-2, -1))
+
+
+class DigitNet:
+    """The exported layers, run in order on float32 NHWC batches."""
+
+    def __init__(self, layers, params):
+        self.layers = layers            # list of dicts from the .npz
+        self.params = params            # "<i>.<name>" → array
+        self.input_shape = tuple(layers[0].get("input_shape") or (28, 28, 1))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as f:
+            meta = json.loads(str(f["__layers__"]))
+            params = {k: f[k].astype(np.float32) for k in f.files if k != "__layers__"}
+        if meta.get("format") != FORMAT:
+            raise ValueError(f"{path}: unsupported format {meta.get('format')}")
+        return cls(meta["layers"], params)
+
+    def predict(self, x):
+        """Class probabilities, (n, classes), for a batch or a single image."""
+        x = np.asarray(x, np.float32)
+        if x.shape in (self.input_shape, self.input_shape[:-1]):
+            x = x[None]                 # one image, with or without channels
+        x = x.reshape((x.shape[0],) + self.input_shape)
+        for i, layer in enumerate(self.layers):
+            x = self._apply(i, layer, x)
+        return x
+
+    def classify(self, x):
+        """Most likely class per image."""
+        return self.predict(x).argmax(axis=-1)
+
+    def _apply(self, i, layer, x):
+        kind = layer["kind"]
+        p = self.params
+        if kind == "conv2d":
+            x = conv2d(x, p[f"{i}.kernel"], p.get(f"{i}.bias"),
+                       tuple(layer["strides"]), layer["padding"])
+        elif kind == "dense":
+            x = x @ p[f"{i}.kernel"]
+            if f"{i}.bias" in p:
+                x += p[f"{i}.bias"]
+        elif kind in ("maxpool", "avgpool"):
+            x = pool2d(x, tuple(layer["size"]), tuple(layer["strides"]),
+                       layer["padding"], np.max if kind == "maxpool" else np.mean)
+        elif kind == "flatten":
+            x = x.reshape(x.shape[0], -1)
+        elif kind == "reshape":
+            x = x.reshape((x.shape[0],) + tuple(layer["shape"]))
+        elif kind == "scale":
+            x = x * p[f"{i}.scale"] + p[f"{i}.shift"]
+        return ACTIVATIONS[layer.get("activation", "linear")](x)
+
+
+# --- export (needs TensorFlow) ---
+
+def _layer_spec(layer):
+    """(spec, params) for one Keras layer, or None to skip it."""
+    name = type(layer).__name__
+    cfg = layer.get_config()
+    w = layer.get_weights()
+    act = cfg.get("activation", "linear")
+    if isinstance(act, dict):        # serialized activation object
+        act = act.get("config", {}).get("name", act.get("class_name", ""))
+    if name in ("InputLayer", "Dropout", "SpatialDropout2D", "GaussianNoise"):
+        return None
+    if name == "Conv2D":
+        if cfg.get("dilation_rate", (1, 1)) not in ((1, 1), [1, 1]) or cfg.get("groups", 1) != 1:
+            raise ValueError(f"{layer.name}: dilated or grouped convolutions are not supported")
+        if cfg.get("data_format", "channels_last") != "channels_last":
+            raise ValueError(f"{layer.name}: only channels_last is supported")
+        spec = {"kind": "conv2d", "strides": list(cfg["strides"]),
+                "padding": cfg["padding"], "activation": act}
+        params = {"kernel": w[0]}
+        if cfg.get("use_bias", True):
+            params["bias"] = w[1]
+    elif name == "Dense":
+        spec = {"kind": "dense", "activation": act}
+        params = {"kernel": w[0]}
+        if cfg.get("use_bias", True):
+            params["bias"] = w[1]
+    elif name in ("MaxPooling2D", "AveragePooling2D"):
+        size = list(cfg["pool_size"])
+        spec = {"kind": "maxpool" if name == "MaxPooling2D" else "avgpool",
+                "size": size, "strides": list(cfg.get("strides") or size),
+                "padding": cfg["padding"]}
+        params = {}
+    elif name == "Flatten":
+        spec, params = {"kind": "flatten"}, {}
+    elif name == "Reshape":
+        spec, params = {"kind": "reshape", "shape": list(cfg["target_shape"])}, {}
+    elif name == "BatchNormalization":
+        it = iter(w)
+        gamma = next(it) if cfg.get("scale", True) else 1.0
+        beta = next(it) if cfg.get("center", True) else 0.0
+        mean, var = next(it), next(it)
+        scale = gamma / np.sqrt(var + cfg["epsilon"])
+        spec = {"kind": "scale"}
+        params = {"scale": np.asarray(scale), "shift": np.asarray(beta - mean * scale)}
+    elif name in ("Activation", "ReLU", "Softmax"):
+        if name == "ReLU" and (cfg.get("max_value") is not None
+                               or cfg.get("negative_slope", 0) or cfg.get("threshold", 0)):
+            raise ValueError(f"{layer.name}: only a plain ReLU is supported")
+        act = {"ReLU": "relu", "Softmax": "softmax"}.get(name, act)
+        spec, params = {"kind": "activation"}, {}
+    else:
+        raise ValueError(f"{layer.name}: {name} layers are not supported")
+    if act not in ACTIVATIONS:
+        raise ValueError(f"{layer.name}: activation {act!r} is not supported")
+    if act != "linear":
+        spec["activation"] = act
+    else:
+        spec.pop("activation", None)
+    return spec, params
+
+
+def export(h5_path, npz_path):
+    """Write a Keras model's layers and weights as a DigitNet .npz."""
+    import tensorflow as tf
+    model = tf.keras.models.load_model(h5_path, compile=False)
+    layers, arrays = [], {}
+    for layer in model.layers:
+        got = _layer_spec(layer)
+        if got is None:
+            continue
+        spec, params = got
+        i = len(layers)
+        layers.append(spec)
+        for k, v in params.items():
+            arrays[f"{i}.{k}"] = np.asarray(v, np.float32)
+    if not layers:
+        raise ValueError(f"{h5_path}: no layers to export")
+    layers[0]["input_shape"] = [int(d) for d in model.input_shape[1:]]
+    meta = {"format": FORMAT, "source": h5_path, "layers": layers}
+    np.savez_compressed(npz_path, __layers__=np.array(json.dumps(meta)), **arrays)
+    return model
+
+
+def main():
+    parser = argparse.ArgumentParser(description='export a Keras digit model for DigitNet')
+    parser.add_argument('h5', nargs='?', default='mnist.h5')
+    parser.add_argument('npz', nargs='?', default='mnist.npz')
+    args = parser.parse_args()
+    export(args.h5, args.npz)
+    net = DigitNet.load(args.npz)
+    print(f"{args.npz}: {len(net.layers)} layers, "
+          f"{sum(a.size for a in net.params.values())} parameters")
+
+
+if __name__ == "__main__":
+    main()
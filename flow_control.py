@@ -0,0 +1,163 @@
+"""
+Flow control for the chat server: token buckets and per-socket outboxes.
+
+Inbound, every user and every chat room has a token bucket.  Each frame a
+user sends costs one token from their own bucket, and an exchange also
+costs one from their room's bucket.  Buckets may go into debt: the frame
+that empties one is still handled, but the server then stops reading
+from that socket until the debt is paid back.  Nothing is dropped; a
+flooding client simply fills its own TCP window and blocks, while
+everyone else's frames keep flowing.
+
+Outbound, the server never blocks on a client.  Frames go into the
+recipient's Outbox, which writes what the kernel will take and keeps the
+rest until select() says the socket is writable again.  When an outbox
+passes HIGH_WATER the senders feeding it are paused (read-side
+backpressure).  If it stays that way for STALL_TIMEOUT seconds, or grows
+past OUTBOX_LIMIT (in memory), the recipient is a slow consumer and the server's
+policy applies:
+
+    drop        discard what is queued for it (new frames keep coming)
+    disconnect  log it out
+    disk        keep its backlog in a temporary file instead of memory
+"""
+import os
+import time
+import tempfile
+from collections import deque
+
+from chat_utils import SIZE_SPEC
+
+USER_RATE = 20.0             # frames per second, per user ...
+USER_BURST = 40              # ... with this much slack
+ROOM_RATE = 100.0            # exchanges per second, per room
+ROOM_BURST = 200
+
+HIGH_WATER = 64 * 1024       # queued bytes that pause the senders
+LOW_WATER = 16 * 1024        # ... and that resume them
+OUTBOX_LIMIT = 1024 * 1024   # queued bytes before the policy applies
+STALL_TIMEOUT = 2.0          # seconds a consumer may keep senders paused
+
+POLICIES = ("drop", "disconnect", "disk")
+
+SEND_CHUNK = 64 * 1024       # most bytes handed to one send() call
+
+
+def encode(frame):
+    """The wire form of a frame, as chat_utils.mysend writes it."""
+    return (('0' * SIZE_SPEC + str(len(frame)))[-SIZE_SPEC:] + frame).encode()
+
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "stamp")
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.stamp = time.monotonic()
+
+    def take(self, n=1, now=None):
+        """Spend n tokens; return how long to wait before the next frame."""
+        now = time.monotonic() if now is None else now
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        self.tokens -= n
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+class Outbox:
+    """Bytes waiting to go out on one socket, in memory or spilled to disk."""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.chunks = deque()        # encoded bytes, oldest first
+        self.offset = 0              # already sent from chunks[0]
+        self.size = 0                # unsent bytes in memory
+        self.spill = None            # temp file once on disk
+        self.spilled = 0             # unsent bytes in the file
+        self.read_pos = 0            # next unsent byte in the file
+        self.stalled = None          # when it went over HIGH_WATER
+
+    def __len__(self):
+        return self.size + self.spilled
+
+    def push(self, data):
+        if self.spill is not None:
+            self._write_disk(data)
+        else:
+            self.chunks.append(data)
+            self.size += len(data)
+
+    def flush(self):
+        """Write as much as the socket takes; False if it has gone away."""
+        while True:
+            if not self.chunks and self.spilled:
+                self._refill()
+            if not self.chunks:
+                return True
+            head = self.chunks[0]
+            try:
+                sent = self.sock.send(memoryview(head)[self.offset:
+                                                       self.offset + SEND_CHUNK])
+            except (BlockingIOError, InterruptedError):
+                return True
+            except OSError:
+                return False
+            if sent == 0:
+                return False
+            self.offset += sent
+            self.size -= sent
+            if self.offset == len(head):
+                self.chunks.popleft()
+                self.offset = 0
+
+    def drop(self):
+        """Forget everything queued except the frame half on the wire."""
+        keep = self.chunks[0] if self.offset else None
+        dropped = len(self.chunks) - (keep is not None)
+        self.chunks.clear()
+        self.size = 0
+        if keep is not None:
+            self.chunks.append(keep)
+            self.size = len(keep) - self.offset
+        self.stalled = None
+        return dropped
+
+    def to_disk(self, tmp_dir=None):
+        """Move the queued frames into a temp file; later ones follow."""
+        self.stalled = None
+        if self.spill is not None:
+            return                   # memory only holds the file's head
+        self.spill = tempfile.TemporaryFile(dir=tmp_dir)
+        self.read_pos = 0
+        keep = self.chunks.popleft() if self.offset else None
+        for data in self.chunks:
+            self._write_disk(data)
+        self.chunks.clear()
+        self.size = 0
+        if keep is not None:
+            self.chunks.append(keep)
+            self.size = len(keep) - self.offset
+
+    def _write_disk(self, data):
+        self.spill.seek(0, os.SEEK_END)
+        self.spill.write(data)
+        self.spilled += len(data)
+
+    def _refill(self):
+        self.spill.seek(self.read_pos)
+        data = self.spill.read(SEND_CHUNK)
+        self.read_pos += len(data)
+        self.spilled -= len(data)
+        if data:
+            self.chunks.append(data)
+            self.size += len(data)
+        if not self.spilled:
+            self.close()             # caught up: back to memory
+
+    def close(self):
+        if self.spill is not None:
+            self.spill.close()
+            self.spill = None
+            self.spilled = 0
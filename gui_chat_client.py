@@ -1,26 +1,172 @@
 #!/usr/bin/env python3
-import os, json, socket, threading, re, tkinter as tk
+import time
+_T0 = time.perf_counter()   # for --measure-startup
+import os, sys, json, queue, socket, threading, argparse, tkinter as tk
 from tkinter import (
     simpledialog, messagebox,
     scrolledtext, Toplevel, Frame, Label,
     Entry, Button, Checkbutton, IntVar
 )
-import cv2, numpy as np, tensorflow as tf
-from PIL import Image, ImageDraw
 
 from chat_utils import SERVER, mysend, myrecv, S_LOGGEDIN, S_CHATTING
 import client_state_machine as csm
-
-ANSI_ESCAPE = re.compile(r'\x1B\[[0-9;]*[mK]')
+from collections import deque
 
 MODEL_PATH = 'mnist.h5'
-if not os.path.exists(MODEL_PATH):
-    raise RuntimeError("Missing handwriting_model.h5")
-digit_model = tf.keras.models.load_model(MODEL_PATH, compile=False)
+NPZ_PATH = 'mnist.npz'  # digit_engine export of MODEL_PATH; needs no TensorFlow
 DIGITS = '0123456789'
+WARM_DELAY_MS = 500     # let the login window paint before warming the model
+STROKE = 15             # pen width on the drawing canvas
+DIGIT_GAP = 4           # px of clear space that separates two digits
+RECOGNIZE_QUEUE = 2     # drawings waiting for the worker before "busy"
+FLUSH_MS = 50           # transcript redraw tick
+SCROLLBACK = 2000       # transcript lines kept while following the end ...
+SCROLLBACK_MAX = 4000   # ... and while reading back, history included
+SUGGEST_DELAY_MS = 150  # typing pause before asking for completions
+
+
+class DigitModel:
+    """
+    numpy, Pillow and the CNN behind the "CNN" button.  Nothing is
+    imported until warm() is called; the load then runs on a daemon
+    thread so no window ever waits for it.  The NumPy engine is used when
+    NPZ_PATH exists, Keras otherwise.  Through Keras the load takes some
+    3 s and 545 MB, nearly all of it importing TensorFlow (75 ms and
+    18 MB through the NumPy engine), while the client gets to its first
+    window in about 20 ms and 19 MB.  state is "idle", "loading",
+    "ready" or "failed" (with the reason in error).
+
+    Recognition runs on a worker thread of its own: recognize() queues
+    the crops and returns at once, the worker preprocesses them and
+    classifies them all in one batch.
+    """
+    def __init__(self, path=MODEL_PATH, npz=NPZ_PATH):
+        self.path = path
+        self.npz = npz
+        self.state = "idle"
+        self.error = None
+        self.np = self.Image = self.predict = None
+        self.loaded_at = None   # perf_counter() when the load finished
+        self.loaded = threading.Event()
+        self.lock = threading.Lock()
+        self.jobs = queue.Queue(RECOGNIZE_QUEUE)
+        self.worker = None
+
+    def warm(self, wait=False):
+        with self.lock:
+            start = self.state == "idle"
+            if start:
+                self.state = "loading"
+        if start:
+            t = threading.Thread(target=self._load, name="digit-model", daemon=True)
+            t.start()
+            if wait:
+                t.join()
+
+    def _load(self):
+        try:
+            if os.path.exists(self.npz):
+                import digit_engine
+                self.predict = digit_engine.DigitNet.load(self.npz).predict
+            elif os.path.exists(self.path):
+                import tensorflow as tf
+                model = tf.keras.models.load_model(self.path, compile=False)
+                self.predict = lambda x: model.predict(x, verbose=0)
+            else:
+                raise RuntimeError(f"Missing {self.npz} and {self.path}")
+            import numpy as np
+            from PIL import Image
+            self.np, self.Image = np, Image
+            self.state = "ready"
+        except Exception as e:
+            self.error = str(e) or type(e).__name__
+            self.state = "failed"
+        self.loaded_at = time.perf_counter()
+        self.loaded.set()
+
+    def recognize(self, crops, done):
+        """
+        Queue crops (PIL "L" images, black ink on white, left to right)
+        for recognition; False if the worker is already busy.  done(text,
+        error) is called from the worker thread once the model has loaded
+        and classified them.
+        """
+        self.warm()
+        with self.lock:
+            if self.worker is None:
+                self.worker = threading.Thread(target=self._work, name="digit-worker",
+                                               daemon=True)
+                self.worker.start()
+        try:
+            self.jobs.put_nowait((crops, done))
+        except queue.Full:
+            return False
+        return True
+
+    def _work(self):
+        while True:
+            crops, done = self.jobs.get()
+            self.loaded.wait()
+            if self.state != "ready":
+                done(None, self.error)
+                continue
+            try:
+                batch = self.np.stack([self._prepare(c) for c in crops])
+                p = self.predict(batch[..., None])
+                done("".join(DIGITS[i] for i in self.np.argmax(p, axis=1)), None)
+            except Exception as e:
+                done(None, str(e) or type(e).__name__)
+
+    def _prepare(self, crop):
+        # trim to the ink, centre it in a square, area-resize to 28x28
+        np = self.np
+        ink = np.asarray(crop) < 200
+        ys, xs = np.flatnonzero(ink.any(axis=1)), np.flatnonzero(ink.any(axis=0))
+        ink = ink[ys[0]:ys[-1] + 1, xs[0]:xs[-1] + 1]
+        h, w = ink.shape
+        sz = max(h, w)
+        sq = np.zeros((sz, sz), np.uint8)
+        dy, dx = (sz - h) // 2, (sz - w) // 2
+        sq[dy:dy + h, dx:dx + w] = ink * np.uint8(255)
+        img = self.Image.fromarray(sq).resize((28, 28), self.Image.BOX)
+        return np.asarray(img, np.float32) / 255.0
+
+
+def segment(strokes, gap=DIGIT_GAP):
+    """
+    Group stroke bounding boxes (x0, y0, x1, y1, ink included) into
+    digits: strokes with less than gap clear columns between them belong
+    together.  Returns one
+    merged box per digit, left to right.
+    """
+    boxes = []
+    for x0, y0, x1, y1 in sorted(strokes):
+        if boxes and x0 <= boxes[-1][2] + gap:
+            b = boxes[-1]
+            boxes[-1] = (b[0], min(b[1], y0), max(b[2], x1), max(b[3], y1))
+        else:
+            boxes.append((x0, y0, x1, y1))
+    return boxes
+
+digits = DigitModel()
+
+
+def rss_mb():
+    """Resident set size of this process, in MB."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss   # peak, not current
+    return kb / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
 
 class ChatGUIClient(tk.Toplevel):
-    def __init__(self, parent, user, sock):
+    def __init__(self, parent, user, sock, session=None):
         super().__init__(parent)
         
         # ─── NEVER ALLOW WINDOW SMALLER THAN 1/4 SCREEN ───
@@ -34,6 +180,7 @@ class ChatGUIClient(tk.Toplevel):
         
         self.parent = parent
         self.sock = sock
+        self.session = session  # lets _reader_loop resume after a drop
         self.user = user
         self.running = True
         self.dark_mode = False
@@ -45,6 +192,19 @@ class ChatGUIClient(tk.Toplevel):
         self.awaiting_connect = False
         self.selected_peer = None
         self.last_search_term = None
+        self.history_cursor = None
+        self.history_asked = None     # the cursor the page on its way was asked with
+        self.history_waiting = False  # a page is on its way
+        self.history_done = False     # reached the first stored line
+        # lines for the transcript, queued by any thread and drawn by
+        # _flush on the Tk thread: (text, tag) pairs, and whole history
+        # pages that go on top
+        self.pending = deque()
+        self.older = deque()
+        # stored line number of each fetched line at the top of the
+        # transcript (None for the start marker), so trimming knows where
+        # to fetch from again
+        self.fetched = deque()
 
         self.title(f"Chat – {user}")
         self.protocol("WM_DELETE_WINDOW", self.on_quit)
@@ -52,13 +212,18 @@ class ChatGUIClient(tk.Toplevel):
         self._apply_light_mode()
 
         self._append(f"Welcome, {user}!")
+        self._watch_digits()
+        self._flush()
 
         threading.Thread(target=self._reader_loop, daemon=True).start()
+        # fetch whatever was said while we were away
+        mysend(self.sock, json.dumps({"action":"sync"}))
 
     def _build_ui(self):
         # display
         self.txt = scrolledtext.ScrolledText(self, state='disabled', wrap='word')
         self.txt.tag_configure("highlight", background="#FFFF00")
+        self.txt.configure(yscrollcommand=self._on_scroll)
         self.txt.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
 
         # buttons
@@ -66,13 +231,16 @@ class ChatGUIClient(tk.Toplevel):
             ("Time", self._time), ("Who", self._who),
             ("Connect", self._connect), ("Disconnect", self._disconnect),
             ("Search", self._search), ("Get Poem", self._poem),
+            ("History", self._history),
             ("Mode", self._btn_mode_toggle),
             ("CNN", self._digit), ("Quit", self.on_quit)
         ]
         frame = Frame(self)
         frame.pack(fill=tk.X, padx=5, pady=5)
         for txt, cmd in btns:
-            Button(frame, text=txt, width=6, command=cmd).pack(side=tk.LEFT, padx=2)
+            b = Button(frame, text=txt, width=6, command=cmd)
+            b.pack(side=tk.LEFT, padx=2)
+            if txt == "CNN": self.btn_cnn = b
 
         # entry/send
         bottom = Frame(self)
@@ -112,20 +280,116 @@ class ChatGUIClient(tk.Toplevel):
         else:
             self._apply_dark_mode()
 
-    def _append(self, msg):
-        self.txt.configure(state='normal')
-        self.txt.insert(tk.END, msg + "\n")
-        self.txt.configure(state='disabled')
-        self.txt.see(tk.END)
+    def _append(self, msg, parts=None):
+        # safe from any thread; parts is [(text, tag or ""), ...] for msg
+        if parts is None: self.pending.append((msg+"\n",""))
+        else: self.pending.extend(parts); self.pending.append(("\n",""))
+
+    def _flush(self):
+        # one insert for everything queued since the last tick
+        if not self.running: return
+        if self.pending or self.older:
+            t=self.txt; follow=t.yview()[1]>=0.999
+            args=[]; plain=[]
+            for _ in range(len(self.pending)):   # not what arrives meanwhile
+                text,tag=self.pending.popleft()
+                if not tag: plain.append(text); continue
+                if plain: args+=["".join(plain),()]; plain=[]
+                args+=[text,tag]
+            if plain: args+=["".join(plain),()]
+            t.configure(state='normal')
+            if args: t.insert(tk.END,*args)
+            while self.older:
+                block,nums,cursor=self.older.popleft(); self.history_waiting=False
+                # asked before a trim moved the cursor: it would leave a gap
+                if self.history_asked!=self.history_cursor: continue
+                self.history_cursor=cursor; self.history_done=cursor is None
+                self.fetched.extendleft(reversed(nums))
+                # keep the lines that were in view where they were
+                block+="\n"; top=t.index("@0,0")
+                t.insert("1.0",block)
+                t.yview(f"{top}+{block.count(chr(10))}l")
+            # bounded scrollback: drop the oldest lines
+            lines=int(t.index("end-1c").split(".")[0])
+            keep=SCROLLBACK if follow else SCROLLBACK_MAX
+            if lines>keep:
+                t.delete("1.0",f"{lines-keep+1}.0")
+                self._trimmed(lines-keep)
+            t.configure(state='disabled')
+            if follow: t.see(tk.END)
+        self.after(FLUSH_MS,self._flush)
+
+    def _trimmed(self, cut):
+        # fetched history went off the top: fetch it again from the
+        # oldest line still shown, or from just after the last one dropped
+        if not self.fetched: return
+        gone=[self.fetched.popleft() for _ in range(min(cut,len(self.fetched)))]
+        gone=[n for n in gone if n is not None]
+        if self.fetched: self.history_cursor=self.fetched[0]
+        elif gone: self.history_cursor=gone[-1]+1
+        else: return
+        self.history_done=False
+
+    def _on_scroll(self, first, last):
+        self.txt.vbar.set(first,last)
+        # scrolled to the top: fetch the next older page of history
+        if float(first)==0.0 and float(last)<1.0: self._history()
 
     # button actions
     def _time(self):      mysend(self.sock, json.dumps({"action":"time"}))
     def _who(self):       mysend(self.sock, json.dumps({"action":"list"}))
     def _search(self):
-        t = simpledialog.askstring("Search","Term:",parent=self)
-        if t:
-            self.last_search_term = t
-            mysend(self.sock, json.dumps({"action":"search","target":t}))
+        # search-as-you-type: the last word typed is completed from the
+        # words in your own history (the server's "suggest")
+        dlg=Toplevel(self); dlg.title("Search")
+        Label(dlg,text="Term:").pack(padx=10,pady=(10,0),anchor='w')
+        ent=Entry(dlg,width=30); ent.pack(padx=10,fill=tk.X); ent.focus_set()
+        box=tk.Listbox(dlg,height=8); box.pack(padx=10,pady=5,fill=tk.BOTH,expand=True)
+        fuzzy=tk.BooleanVar(dlg,value=False)
+        tk.Checkbutton(dlg,text="Allow typos",variable=fuzzy).pack(padx=10,anchor='w')
+        self.suggest_box=box; pending=[None]
+        def ask():
+            pending[0]=None
+            words=ent.get().split()
+            if words and not ent.get().endswith(" "):
+                mysend(self.sock,json.dumps({"action":"suggest","target":words[-1],"limit":8}))
+            else: box.delete(0,tk.END)
+        def typed(e):
+            if e.keysym in ("Return","Down","Up"): return
+            if pending[0]: dlg.after_cancel(pending[0])
+            pending[0]=dlg.after(SUGGEST_DELAY_MS,ask)
+        def pick(e=None):
+            sel=box.curselection()
+            if not sel: return
+            words=ent.get().split(); words[-1:]=[box.get(sel[0]).split("  ")[0]]
+            ent.delete(0,tk.END); ent.insert(0," ".join(words)+" "); ent.focus_set()
+            box.delete(0,tk.END)
+        def go(e=None):
+            t=ent.get().strip()
+            if pending[0]: dlg.after_cancel(pending[0])
+            dlg.destroy()
+            if t:
+                self.last_search_term = t
+                req={"action":"search","target":t,"hits":True}
+                if fuzzy.get(): req["mode"]="fuzzy"
+                mysend(self.sock, json.dumps(req))
+        ent.bind("<KeyRelease>",typed); ent.bind("<Return>",go)
+        ent.bind("<Down>",lambda e:(box.focus_set(),box.selection_set(0)))
+        box.bind("<Double-Button-1>",pick); box.bind("<Return>",pick)
+        Button(dlg,text="Search",command=go).pack(pady=(0,10))
+        dlg.transient(self)
+
+    def _show_suggestions(self, words):
+        box=getattr(self,"suggest_box",None)
+        if not box or not box.winfo_exists(): return
+        box.delete(0,tk.END)
+        for w,n in words: box.insert(tk.END,f"{w}  ({n})")
+    def _history(self):
+        # each call fetches the next older page, shown above the rest
+        if self.history_waiting or self.history_done: return
+        if int(self.txt.index("end-1c").split(".")[0])>=SCROLLBACK_MAX: return
+        self.history_waiting=True; self.history_asked=self.history_cursor
+        mysend(self.sock, json.dumps({"action":"history","cursor":self.history_cursor}))
     def _poem(self):
         n = simpledialog.askinteger("Poem","#:",parent=self,minvalue=1)
         if n: mysend(self.sock, json.dumps({"action":"poem","target":str(n)}))
@@ -158,48 +422,98 @@ class ChatGUIClient(tk.Toplevel):
         self._append(f"(you) {txt}")
         self.ent.delete(0,tk.END)
 
+    def _watch_digits(self):
+        # "CNN…" while the model loads in the background
+        loading=digits.state=="loading"
+        self.btn_cnn.config(text="CNN…" if loading else "CNN")
+        if loading or digits.state=="idle": self.after(250,self._watch_digits)
+
     def _digit(self):
-        # canvas
-        w,h=200,200
-        dlg=Toplevel(self); dlg.title("Draw Digit")
+        digits.warm()   # no-op unless started with --no-warm
+        if digits.state=="failed":
+            messagebox.showwarning("CNN unavailable",f"Digit recognition is unavailable:\n{digits.error}")
+            return
+        try: from PIL import Image, ImageDraw
+        except ImportError:
+            messagebox.showwarning("CNN unavailable","Drawing needs Pillow (pip install pillow).")
+            return
+        # canvas; drawing works while the model is still loading.  Each
+        # motion event is rasterized as it comes and widens its stroke's
+        # box, so nothing is left to scan when the pen lifts.
+        w,h=360,200
+        dlg=Toplevel(self); dlg.title("Draw Digits")
         c=tk.Canvas(dlg,width=w,height=h,bg='white')
         c.pack()
         im=Image.new('L',(w,h),255); draw=ImageDraw.Draw(im)
-        last=None
+        strokes=[]; last=None; r=STROKE//2+1
         def paint(e):
             nonlocal last
+            x,y=min(max(e.x,0),w-1),min(max(e.y,0),h-1)
             if last:
-                c.create_line(last[0],last[1],e.x,e.y,fill='black',width=15,capstyle=tk.ROUND)
-                draw.line([last,(e.x,e.y)],fill=0,width=15)
-            last=(e.x,e.y)
-        def reset(e): nonlocal last; last=None
+                c.create_line(last[0],last[1],x,y,fill='black',width=STROKE,capstyle=tk.ROUND)
+                draw.line([last,(x,y)],fill=0,width=STROKE)
+                if not strokes or strokes[-1] is None: strokes[-1:]=[[x,y,x,y]]
+                b=strokes[-1]
+                b[0]=min(b[0],last[0],x); b[1]=min(b[1],last[1],y)
+                b[2]=max(b[2],last[0],x); b[3]=max(b[3],last[1],y)
+            last=(x,y)
+        def reset(e):
+            nonlocal last; last=None
+            if strokes and strokes[-1] is not None: strokes.append(None)
+        def clear():
+            nonlocal im,draw
+            c.delete("all"); strokes.clear()
+            im=Image.new('L',(w,h),255); draw=ImageDraw.Draw(im)
         c.bind("<B1-Motion>",paint); c.bind("<ButtonRelease-1>",reset)
+        status=Label(dlg,text=""); status.pack()
+        def done(text,err):
+            # worker thread: hand the answer to the UI thread
+            self.after(0,show,text,err)
+        def show(text,err):
+            if not dlg.winfo_exists(): return
+            if err:
+                status.config(text=""); messagebox.showwarning("CNN",err,parent=dlg); return
+            dlg.destroy(); self.ent.delete(0,tk.END); self.ent.insert(0,text); self._send()
         def go():
-            arr=np.array(im)
-            _,thr=cv2.threshold(arr,200,255,cv2.THRESH_BINARY_INV)
-            pts=cv2.findNonZero(thr)
-            if pts is None:
-                messagebox.showinfo("None","No strokes")
+            boxes=segment([(max(x0-r,0),max(y0-r,0),min(x1+r+1,w),min(y1+r+1,h))
+                           for x0,y0,x1,y1 in filter(None,strokes)])
+            if not boxes:
+                messagebox.showinfo("None","No strokes",parent=dlg)
                 return
-            x,y,w0,h0=cv2.boundingRect(pts)
-            roi=thr[y:y+h0,x:x+w0]
-            sz=max(w0,h0); sq=np.zeros((sz,sz),np.uint8)
-            dx,dy=(sz-w0)//2,(sz-h0)//2
-            sq[dy:dy+h0,dx:dx+w0]=roi
-            img28=cv2.resize(sq,(28,28),interpolation=cv2.INTER_AREA)
-            norm=img28.astype(np.float32)/255.0; inp=norm.reshape(1,28,28,1)
-            p=digit_model.predict(inp)
-            idx=int(np.argmax(p,axis=1)[0]); d=DIGITS[idx]
-            dlg.destroy(); self.ent.delete(0,tk.END); self.ent.insert(0,d); self._send()
+            if not digits.recognize([im.crop(b) for b in boxes],done):
+                messagebox.showinfo("CNN","Still busy with the last drawing.",parent=dlg)
+                return
+            status.config(text="Recognizing…" if digits.state=="ready"
+                          else "Recognizing once the model has loaded…")
         Button(dlg,text="Recognize & Send",command=go).pack(pady=5)
+        Button(dlg,text="Clear",command=clear).pack()
         Button(dlg,text="Cancel",command=dlg.destroy).pack()
 
+    def _resume(self):
+        # the connection dropped: try to pick the session up again
+        if not (self.running and self.session): return False
+        try:
+            s=socket.create_connection(SERVER,timeout=5)
+            mysend(s,json.dumps({"action":"resume","session":self.session}))
+            resp=json.loads(myrecv(s))
+        except (OSError,ValueError):
+            return False
+        if resp.get("status")!="ok":
+            s.close(); return False
+        s.settimeout(None)
+        self.sock=s; self.sm.s=s
+        self._append("(reconnected)")
+        return True
+
     # reader loop
     def _reader_loop(self):
         while self.running:
             try: raw=myrecv(self.sock)
-            except OSError: break
-            if not raw: break
+            except OSError: raw=''
+            if not raw:
+                if self._resume(): continue
+                if self.running: self._append("Connection lost.")
+                break
             try: resp=json.loads(raw)
             except: continue
             act=resp.get("action")
@@ -209,53 +523,77 @@ class ChatGUIClient(tk.Toplevel):
                     self.after(0,self._show_connect,entries)
                     self.awaiting_connect=False
                 else:
-                    self.after(0,self._append,"Users:\n"+resp.get("results",""))
+                    self._append("Users:\n"+resp.get("results",""))
             elif act=="connect":
                 st=resp.get("status"); frm=resp.get("from","")
                 if st=="success":
                     self.sm.set_state(S_CHATTING); self.sm.peer=self.selected_peer
-                    self.after(0,self._append,f"You are now connected with {self.selected_peer}.")
+                    self._append(f"You are now connected with {self.selected_peer}.")
                     self.after(0,self.btn_send.config,{'state':tk.NORMAL})
                 elif st=="request":
                     self.sm.set_state(S_CHATTING); self.sm.peer=frm
-                    self.after(0,self._append,f"{frm} has joined the chat.")
+                    self._append(f"{frm} has joined the chat.")
                     self.after(0,self.btn_send.config,{'state':tk.NORMAL})
                 else:
-                    self.after(0,self._append,f"Connect failed: {resp.get('msg','')}")
+                    self._append(f"Connect failed: {resp.get('msg','')}")
             elif act == "disconnect":
                 # peer-left notification?
                 if resp.get("from") and self.sm.get_state() == S_CHATTING:
                     leaver = resp["from"]
-                    self.after(0, self._append, f"{leaver} has left the chat.")
+                    self._append(f"{leaver} has left the chat.")
                 else:
                     # local or “alone” case
                     self.sm.set_state(S_LOGGEDIN)
                     self.sm.peer = ''
-                    self.after(0, self._append, resp.get("msg", "Disconnected."))
+                    self._append(resp.get("msg", "Disconnected."))
                     self.after(0, self.btn_send.config, {'state': tk.DISABLED})
 
             elif act=="time":
-                self.after(0,self._append,f"Time: {resp.get('results')}")
+                self._append(f"Time: {resp.get('results')}")
             elif act=="search":
-                clean=ANSI_ESCAPE.sub("",resp.get("results",""))
-                for line in clean.splitlines():
-                    start=self.txt.index(tk.END)
-                    self._append(line)
-                    t=self.last_search_term
-                    if t:
-                        idx=self.txt.search(t,start,tk.END,nocase=True)
-                        while idx:
-                            end=f"{idx}+{len(t)}c"
-                            self.txt.tag_add("highlight",idx,end)
-                            idx=self.txt.search(t,end,tk.END,nocase=True)
+                # [line_number, line, spans(, room)] hits, long results in chunks
+                if resp.get("done"): continue
+                self._show_search(resp.get("chunk",resp.get("results")) or [])
             elif act=="poem":
-                p=resp.get("results",[]); txt="\n".join(p) if isinstance(p,list) else p
-                self.after(0,self._append,txt)
+                if resp.get("done"): continue
+                p=resp.get("chunk",resp.get("results",[])); txt="\n".join(p) if isinstance(p,list) else p
+                self._append(txt)
             elif act=="exchange":
                 frm=resp.get("from",""); m=resp.get("message","")
-                self.after(0,self._append,f"{frm} {m}")
+                self._append(f"{frm} {m}")
+            elif act=="history":
+                # one insert per page, built with join, on top of the transcript
+                page=resp.get("results",[])
+                block="\n".join(time.strftime('(%d.%m.%y,%H:%M) ',time.localtime(ts))+line
+                               for n,ts,line in page)
+                nums=[n for n,ts,line in page for _ in range(line.count("\n")+1)]
+                cursor=resp.get("cursor")
+                if cursor is None:
+                    block="(start of history)"+("\n" if block else "")+block
+                    nums.insert(0,None)
+                # _flush takes the cursor with the page, on the Tk thread
+                self.older.append((block,nums,cursor))
+            elif act=="suggest":
+                self.after(0,self._show_suggestions,resp.get("results",[]))
+            elif act=="sync":
+                msgs=resp.get("results",[])
+                for m in msgs:
+                    self._append(f"({m['ts']}) {m['from']}: {m['message']}")
+                if msgs:
+                    mysend(self.sock,json.dumps({"action":"sync","cursor":resp.get("cursor")}))
         self.running=False
 
+    def _show_search(self, hits):
+        # the server sends where the term matched; cut each line there so
+        # it is queued with its highlight tags and drawn in the next flush
+        for n,line,spans,*room in hits:
+            # a room's lines are numbered within that room
+            parts=[(f"{room[0]}:{n}: " if room else f"{n}: ","")]; pos=0
+            for start,end in spans:
+                parts+=[(line[pos:start],""),(line[start:end],"highlight")]; pos=end
+            parts.append((line[pos:],""))
+            self._append(line,parts)
+
     def _show_connect(self, entries):
         users=[u.split(':')[0].strip() for u in entries.split(',') if ':' in u]
         users=[u for u in users if u!=self.user]
@@ -277,6 +615,8 @@ class ChatGUIClient(tk.Toplevel):
             try: mysend(self.sock,json.dumps({"action":"disconnect"}))
             except: pass
         self.running=False
+        try: mysend(self.sock,json.dumps({"action":"logout"}))
+        except: pass
         try: self.sock.close()
         except: pass
         self.master.quit()
@@ -290,6 +630,7 @@ class AccessControlSystem:
         self.accounts=self.load_accounts()
         self.current_user=self.load_current_user()
         self.sock=None
+        self.session=None   # token from the server's login reply
         parent.title("Login"); parent.geometry("400x300"); self.center_window(parent)
         if self.current_user: self.auto_login()
         else: self.create_login_page()
@@ -371,18 +712,40 @@ class AccessControlSystem:
         self.save_current_user()
         self.open_welcome_page()
 
-    def auto_login(self):
+    def ensure_connection(self):
+        """
+        One authenticated socket serves the welcome page and the chat
+        window.  Open it if needed: resume the session we had, if the
+        server still holds it, else log in.
+        """
+        if self.sock:
+            return True
         try:
             self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.sock.connect(SERVER)
         except Exception as e:
+            self.sock = None
             messagebox.showerror("Connection Failed", f"Cannot connect to server:\n{e}")
-            self.create_login_page()
-            return
+            return False
+
+        if self.session:
+            mysend(self.sock, json.dumps({"action": "resume", "session": self.session}))
+            resp = json.loads(myrecv(self.sock))
+            if resp.get("status") == "ok" and resp.get("name") == self.current_user:
+                return True
+            self.session = None
 
         mysend(self.sock, json.dumps({"action": "login", "name": self.current_user}))
         resp = json.loads(myrecv(self.sock))
         if resp.get("status") == "ok":
+            self.session = resp.get("session")
+            return True
+        self.sock.close()
+        self.sock = None
+        return False
+
+    def auto_login(self):
+        if self.ensure_connection():
             self.open_welcome_page()
         else:
             self.create_login_page()
@@ -400,19 +763,14 @@ class AccessControlSystem:
         Button(self.new_window, text="Logout", width=20, command=self.logout).pack(pady=10)
 
     def start_chat(self):
-        try:
-            self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.sock.connect(SERVER)
-        except Exception as e:
-            messagebox.showerror("Connection Failed", f"Cannot connect to server:\n{e}")
-            return
-
-        mysend(self.sock, json.dumps({"action": "login", "name": self.current_user}))
-        resp = json.loads(myrecv(self.sock))
-        if resp.get("status") == "ok":
+        if self.ensure_connection():
             self.new_window.withdraw()
-            chat_window = ChatGUIClient(self.new_window, self.current_user, self.sock)
+            chat_window = ChatGUIClient(self.new_window, self.current_user, self.sock,
+                                        self.session)
             chat_window.mainloop()
+            # the chat window logged out and closed the socket on quit
+            self.sock = None
+            self.session = None
         else:
             messagebox.showerror("Login Failed", "Authentication failed.")
 
@@ -423,6 +781,7 @@ class AccessControlSystem:
             finally:
                 self.sock.close()
                 self.sock = None
+        self.session = None
         self.new_window.destroy()
         self.current_user = ""
         self.save_current_user()
@@ -511,7 +870,40 @@ class AccessControlSystem:
             json.dump({"current_user": self.current_user}, f)
 
 
-if __name__ == "__main__":
+def main():
+    parser = argparse.ArgumentParser(description='chat client GUI')
+    parser.add_argument('--eager', action='store_true',
+                        help='load the digit model before any window shows (the old behaviour)')
+    parser.add_argument('--no-warm', action='store_true',
+                        help='load the digit model only when CNN is first pressed')
+    parser.add_argument('--measure-startup', action='store_true',
+                        help='print time to first window and RSS, then exit')
+    args = parser.parse_args()
+
+    if args.eager:
+        digits.warm(wait=True)
     root = tk.Tk()
     app = AccessControlSystem(root)
+    if not args.no_warm:
+        root.after(WARM_DELAY_MS, digits.warm)
+
+    if args.measure_startup:
+        def shown():
+            root.update_idletasks()
+            print(f"window: {(time.perf_counter() - _T0) * 1000:.0f} ms, "
+                  f"RSS {rss_mb():.1f} MB")
+            root.after(WARM_DELAY_MS + 50, loaded)
+        def loaded():
+            if digits.state == "loading":
+                root.after(50, loaded)
+                return
+            if digits.loaded_at is not None:
+                print(f"model {digits.state}: {(digits.loaded_at - _T0) * 1000:.0f} ms, "
+                      f"RSS {rss_mb():.1f} MB" + (f" ({digits.error})" if digits.error else ""))
+            root.quit()
+        root.after(0, shown)
     root.mainloop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+Microbenchmarks for indexer.Index and indexer.PIndex.
+
+Measures, for synthetic chat histories of each --sizes line count:
+
+    add            Index.add_msg_and_index throughput (lines/s)
+    search_single  Index.search latency, one common term
+    search_multi   Index.search latency, two common terms
+    search_miss    Index.search latency, a term that never occurs
+    pickle_dump    pickling the index to disk
+    pickle_load    unpickling it again
+
+and, once per run:
+
+    pindex_build   PIndex("AllSonnets.txt") construction
+    get_poem       PIndex.get_poem latency over every sonnet in the file
+
+Synthetic lines are drawn from the AllSonnets.txt vocabulary with the
+words' own frequencies, so postings lists have a realistic skew, and are
+formatted like the server's chat lines.
+
+    python index_bench.py                         # 1k, 10k, 100k lines
+    python index_bench.py --sizes 1000,1000000 --json new.json
+    python index_bench.py --compare old.json new.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import pickle
+import argparse
+import tempfile
+
+import indexer
+
+SONNETS = "AllSonnets.txt"
+MISS_TERM = "xyzzyquux"
+
+
+def vocabulary():
+    words = []
+    with open(SONNETS) as f:
+        for line in f:
+            words.extend(w.strip(".,;:!?'()").lower() for w in line.split())
+    return [w for w in words if w.isalpha()]
+
+
+def corpus(n, words, seed):
+    """n chat lines built from the sonnet vocabulary."""
+    rng = random.Random(seed)
+    users = [f"user{i}" for i in range(20)]
+    lines = []
+    for i in range(n):
+        text = " ".join(rng.choices(words, k=rng.randint(3, 12)))
+        lines.append(f"{rng.choice(users)}: {text}")
+    return lines
+
+
+def timed(fn, repeat):
+    """Run fn repeat times; return the sorted durations in seconds."""
+    runs = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn()
+        runs.append(time.perf_counter() - t)
+    return sorted(runs)
+
+
+def stats(runs):
+    return {
+        "median_ms": round(runs[len(runs) // 2] * 1e3, 4),
+        "min_ms": round(runs[0] * 1e3, 4),
+        "max_ms": round(runs[-1] * 1e3, 4),
+    }
+
+
+def bench_size(n, words, opts):
+    lines = corpus(n, words, opts.seed)
+    res = {}
+
+    idx = indexer.Index("bench")
+    t = time.perf_counter()
+    for line in lines:
+        idx.add_msg_and_index(line)
+    took = time.perf_counter() - t
+    res["add"] = {"lines_per_s": round(n / took), "total_s": round(took, 4)}
+
+    # the most frequent words make the heaviest queries
+    common = sorted(idx.index, key=lambda w: len(idx.index[w]), reverse=True)
+    common = [w for w in common if w.isalpha()]
+    queries = {
+        "search_single": common[0],
+        "search_multi": f"{common[0]} {common[1]}",
+        "search_miss": MISS_TERM,
+    }
+    for label, term in queries.items():
+        res[label] = stats(timed(lambda: idx.search(term), opts.repeat))
+        res[label]["term"] = term
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.idx")
+
+        def dump():
+            with open(path, "wb") as f:
+                pickle.dump(idx, f)
+
+        def load():
+            with open(path, "rb") as f:
+                pickle.load(f)
+
+        res["pickle_dump"] = stats(timed(dump, opts.repeat))
+        res["pickle_load"] = stats(timed(load, opts.repeat))
+        res["pickle_bytes"] = os.path.getsize(path)
+    res["nbytes"] = idx.nbytes
+    return res
+
+
+def bench_sonnets(opts):
+    res = {}
+    holder = []
+    res["pindex_build"] = stats(timed(
+        lambda: holder.append(indexer.PIndex(SONNETS)), max(opts.repeat // 2, 1)))
+    sonnets = holder[-1]
+    present = []
+    for p in range(1, 155):
+        try:
+            sonnets.get_poem(p)
+            present.append(p)
+        except Exception:
+            pass                 # not every sonnet is in the file
+    res["get_poem"] = stats(timed(
+        lambda: [sonnets.get_poem(p) for p in present], opts.repeat))
+    res["get_poem"]["per_call_ms"] = round(
+        res["get_poem"]["median_ms"] / len(present), 4)
+    res["get_poem"]["poems"] = len(present)
+    return res
+
+
+def run(opts):
+    words = vocabulary()
+    results = {
+        "config": {"sizes": opts.sizes, "repeat": opts.repeat,
+                   "seed": opts.seed, "python": sys.version.split()[0]},
+        "sonnets": bench_sonnets(opts),
+        "sizes": {},
+    }
+    for n in opts.sizes:
+        print(f"... {n} lines", file=sys.stderr)
+        results["sizes"][str(n)] = bench_size(n, words, opts)
+    return results
+
+
+# ----------------------------------------------------------------------
+# tables
+
+def rows(res):
+    """Flatten results into (label, value, unit, higher_is_better)."""
+    out = []
+    s = res["sonnets"]
+    out.append(("pindex_build", s["pindex_build"]["median_ms"], "ms", False))
+    out.append(("get_poem", s["get_poem"]["per_call_ms"], "ms", False))
+    for n, r in res["sizes"].items():
+        out.append((f"{n}: add", r["add"]["lines_per_s"], "lines/s", True))
+        for label in ("search_single", "search_multi", "search_miss",
+                      "pickle_dump", "pickle_load"):
+            out.append((f"{n}: {label}", r[label]["median_ms"], "ms", False))
+        out.append((f"{n}: nbytes", r["nbytes"], "B", False))
+    return out
+
+
+def print_table(res):
+    print(f"{'benchmark':<28} {'value':>14} unit")
+    for label, value, unit, _ in rows(res):
+        print(f"{label:<28} {value:>14} {unit}")
+
+
+def print_compare(old, new):
+    before = {label: value for label, value, _, _ in rows(old)}
+    print(f"{'benchmark':<28} {'old':>12} {'new':>12} {'speedup':>9}")
+    for label, value, unit, higher in rows(new):
+        was = before.get(label)
+        if was is None:
+            print(f"{label:<28} {'-':>12} {value:>12}")
+            continue
+        if not was or not value:
+            ratio = "-"
+        else:
+            ratio = f"{(value / was if higher else was / value):.2f}x"
+        print(f"{label:<28} {was:>12} {value:>12} {ratio:>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='indexer microbenchmarks')
+    parser.add_argument('--sizes', type=lambda s: [int(x) for x in s.split(',')],
+                        default=[1000, 10000, 100000],
+                        help='comma-separated history lengths (lines)')
+    parser.add_argument('--repeat', type=int, default=7)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', type=str, default=None,
+                        help='write results here')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'),
+                        help='compare two --json result files and exit')
+    opts = parser.parse_args()
+
+    if opts.compare:
+        with open(opts.compare[0]) as f:
+            old = json.load(f)
+        with open(opts.compare[1]) as f:
+            new = json.load(f)
+        print_compare(old, new)
+        return
+
+    res = run(opts)
+    print_table(res)
+    if opts.json:
+        with open(opts.json, "w") as f:
+            json.dump(res, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
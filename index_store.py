@@ -0,0 +1,397 @@
+"""
+Per-user chat indices: an LRU cache with a byte budget, loaded and saved
+off the event loop.
+
+Login only registers the user and queues the unpickling of <name>.idx on
+a small I/O pool.  Messages that arrive before the index is ready are
+buffered and applied as soon as it lands; searches (which already run on
+the query pool) simply wait for it.
+
+Every index reports its own approximate size (Index.nbytes, maintained
+as messages are added).  When the resident total goes over the budget,
+the least recently used indices are evicted: clean ones are simply
+dropped, dirty ones are spilled to disk first.  That applies to online
+users too -- their index is paged back in the next time they send a
+message or search.  Logged-out users stay cached until evicted, so a
+quick reconnect costs nothing.  Cluster workers share the index files,
+though, and a user may log in on another worker meanwhile: open() only
+reuses a logged-out index if its file is still the one it was loaded
+from or saved to, and otherwise reads the newer file.
+
+Room logs (room_index.RoomLog) live here too, under their room names,
+and are paged the same way; IndexStore.update() calls any method of an
+index, now or, if it is paged out, in order once it is back.  Their files
+are not tied to a user who logs in again, so expire() deletes those not
+written for a while.
+
+With substring=True, each index gets a suffix_index.SuffixIndex too.
+That is built on a builder thread of its own after the index is ready,
+and swapped in once done; until then searches scan.  Building can take
+seconds for a big index, and loads and saves should not queue behind it.
+
+Saves are coalesced: however many times a user logs out before the
+writer gets to them, the index is written once, and only if it changed.
+The entry lock is not held while an index is pickled and written:
+changes that come in meanwhile wait in the entry's pending list, as for
+an index being paged in, and are applied when the write is done, so the
+event loop never waits on the disk.
+"""
+import os
+import time
+import logging
+import pickle as pkl
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import indexer
+
+log = logging.getLogger("chat.index")
+
+IO_WORKERS = 2
+BUILD_WORKERS = 1                    # threads building suffix indices
+INDEX_BUDGET = 64 * 1024 * 1024      # bytes of resident indices
+
+
+class _Entry:
+    def __init__(self, kind=indexer.Index):
+        self.kind = kind                 # what to create if there is no file
+        self.index = None                # indexer.Index while resident
+        self.pending = []                # (method, args) received while paged out or saving
+        self.ready = threading.Event()   # set while index is resident
+        self.lock = threading.Lock()     # guards the fields above
+        self.loading = False
+        self.dirty = False               # changed since last written
+        self.saving = False              # being written; changes go to pending
+        self.evicting = 0                # spill queued: bytes counted as evicting
+        self.size = 0                    # index.nbytes as last accounted
+        self.online = True
+        self.stamp = None                # _stamp() of the file as last read or written
+
+
+class IndexStore:
+    def __init__(self, root=".", budget=INDEX_BUDGET, substring=False):
+        self.root = root
+        self.budget = budget
+        self.substring = substring       # build suffix_index for each index
+        self.entries = OrderedDict()     # username → _Entry, LRU first
+        self.saves = set()               # names with a save queued
+        self.lock = threading.Lock()     # guards entries, saves, counters
+        self.io = ThreadPoolExecutor(max_workers=IO_WORKERS,
+                                     thread_name_prefix="index-io")
+        self.builds = ThreadPoolExecutor(max_workers=BUILD_WORKERS,
+                                         thread_name_prefix="index-build")
+
+        self.resident = 0                # bytes of indices in memory
+        self.evicting_bytes = 0          # ... of which already being spilled
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.spills = 0
+
+    def path(self, name):
+        return os.path.join(self.root, f"{name}.idx")
+
+    @staticmethod
+    def _stamp(st):
+        # a save replaces the file, so a new inode tells as well as mtime
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "resident_bytes": self.resident,
+                "budget_bytes": self.budget,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "spills": self.spills,
+            }
+
+    # --- called from the event loop ---
+
+    def open(self, name, kind=indexer.Index):
+        """User logged in: make sure their index is (being) loaded."""
+        with self.lock:
+            entry = self.entries.get(name)
+            if entry is not None and not entry.online and self._replaced(name, entry):
+                # saved elsewhere (another worker) since: load that instead
+                del self.entries[name]
+                self.resident -= entry.size
+                entry = None
+            if entry is None:
+                entry = self.entries[name] = _Entry(kind)
+            else:
+                self.entries.move_to_end(name)
+            entry.online = True
+        self._touch(entry, name)
+
+    def close(self, name):
+        """User logged out: queue a save if needed; repeats coalesce."""
+        with self.lock:
+            entry = self.entries.get(name)
+            if entry is None:
+                return
+            entry.online = False
+            if entry.index is None:
+                if not entry.loading:
+                    del self.entries[name]
+                return                   # _load queues the save if needed
+            if entry.dirty:
+                self._queue_save(name)
+
+    def add_msg(self, name, text):
+        """Index a message now, or buffer it until the index is paged in."""
+        self.update(name, "add_msg_and_index", text)
+
+    def update(self, name, method, *args):
+        """
+        Call idx.<method>(*args) now, or once the index is paged in.
+        Everything it touches is locked, so the query pool may call it too.
+        """
+        with self.lock:
+            entry = self.entries.get(name)
+            if entry is None:
+                return
+            self.entries.move_to_end(name)
+
+        with entry.lock:
+            idx = entry.index
+            queued = idx is None or entry.saving
+            if queued:
+                entry.pending.append((method, args))
+            else:
+                getattr(idx, method)(*args)
+                entry.dirty = True
+                delta = idx.nbytes - entry.size
+                entry.size = idx.nbytes
+                if idx.substring is not None and idx.substring.due(idx.msgs):
+                    self.builds.submit(idx.substring.catch_up, idx.msgs)
+        if idx is None:
+            self._touch(entry, name)
+        elif not queued:
+            with self.lock:
+                self.hits += 1
+                self.resident += delta
+            self._shrink()
+
+    def peek(self, name):
+        """The index if it is already in memory, else None; never blocks."""
+        entry = self.entries.get(name)
+        return entry.index if entry else None
+
+    def expire(self, prefix, age):
+        """Delete, in the background, <prefix>*.idx files older than age seconds."""
+        self.io.submit(self._expire, prefix, age)
+
+    # --- safe from any thread ---
+
+    def exists(self, name):
+        """Whether there is an index called name, in memory or on disk."""
+        return name in self.entries or os.path.exists(self.path(name))
+
+    def get(self, name, timeout=None, kind=None):
+        """
+        Wait for a user's index to be resident and return it.  Only open
+        indices are found, unless kind is given: then one that is not
+        open is loaded (or created) as that kind, to be evicted in time.
+        """
+        with self.lock:
+            entry = self.entries.get(name)
+            if entry is None:
+                if kind is None:
+                    return None
+                entry = self.entries[name] = _Entry(kind)
+                entry.online = False
+            self.entries.move_to_end(name)
+        while True:
+            self._touch(entry, name)
+            if not entry.ready.wait(timeout):
+                return None
+            with entry.lock:
+                if entry.index is not None:
+                    return entry.index
+            # evicted between the wait and now; page it in again
+
+    def _touch(self, entry, name):
+        """Count a hit, or start paging the index in."""
+        with entry.lock:
+            resident = entry.index is not None
+            start = not resident and not entry.loading
+            if start:
+                entry.loading = True
+        with self.lock:
+            if resident:
+                self.hits += 1
+            elif start:
+                self.misses += 1
+        if start:
+            self.io.submit(self._load, name, entry)
+
+    def _replaced(self, name, entry):
+        """
+        Whether a cached, idle, clean index's file has been written by
+        someone else.  Caller holds self.lock.
+        """
+        if not entry.lock.acquire(blocking=False):
+            return False
+        try:
+            if (entry.index is None or entry.loading or entry.dirty
+                    or entry.saving or entry.evicting or entry.pending):
+                return False
+            try:
+                stamp = self._stamp(os.stat(self.path(name)))
+            except OSError:
+                stamp = None
+            if stamp == entry.stamp:
+                return False
+            entry.index = None
+            entry.ready.clear()
+            return True
+        finally:
+            entry.lock.release()
+
+    def _queue_save(self, name):
+        # caller holds self.lock
+        if name not in self.saves:
+            self.saves.add(name)
+            self.io.submit(self._save, name)
+
+    def _shrink(self):
+        """Evict least recently used indices until under budget."""
+        with self.lock:
+            for name, entry in list(self.entries.items()):
+                if self.resident - self.evicting_bytes <= self.budget:
+                    return
+                if not entry.lock.acquire(blocking=False):
+                    continue             # being loaded or updated right now
+                try:
+                    if entry.index is None or entry.evicting or entry.saving:
+                        continue
+                    if entry.dirty:
+                        # write it out first; _save drops it afterwards
+                        entry.evicting = entry.size
+                        self.evicting_bytes += entry.size
+                        self._queue_save(name)
+                        continue
+                    entry.index = None
+                    entry.ready.clear()
+                    self.resident -= entry.size
+                    entry.size = 0
+                    self.evictions += 1
+                    if not entry.online:
+                        del self.entries[name]
+                finally:
+                    entry.lock.release()
+
+    # --- I/O pool ---
+
+    def _expire(self, prefix, age):
+        cutoff = time.time() - age
+        try:
+            files = [e for e in os.scandir(self.root)
+                     if e.name.startswith(prefix) and e.name.endswith(".idx")]
+        except OSError as e:
+            log.error("Expiring %s indices failed: %s", prefix, e)
+            return
+        for e in files:
+            name = e.name[:-len(".idx")]
+            try:
+                if name not in self.entries and e.stat().st_mtime < cutoff:
+                    os.remove(e.path)
+                    log.info("Expired index %s", name)
+            except OSError:
+                pass                     # gone already, or just written
+
+    def _load(self, name, entry):
+        stamp = None
+        try:
+            with open(self.path(name), "rb") as f:
+                stamp = self._stamp(os.fstat(f.fileno()))
+                idx = pkl.load(f)
+        except Exception:
+            idx = entry.kind(name)
+        with entry.lock:
+            entry.stamp = stamp
+            for method, args in entry.pending:
+                getattr(idx, method)(*args)
+                entry.dirty = True
+            entry.pending = []
+            entry.index = idx
+            entry.size = idx.nbytes
+            entry.loading = False
+            entry.ready.set()
+        if self.substring:
+            self.builds.submit(idx.use_substring_index)
+        with self.lock:
+            self.resident += entry.size
+            if not entry.online and entry.dirty:
+                self._queue_save(name)
+        self._shrink()
+
+    def _save(self, name):
+        with self.lock:
+            self.saves.discard(name)     # later changes queue a fresh save
+            entry = self.entries.get(name)
+        if entry is None:
+            return
+
+        with entry.lock:
+            idx = entry.index
+            if idx is None:
+                return
+            # from here until it is written, changes wait in pending
+            entry.saving = entry.dirty
+            entry.dirty = False
+        failed = False
+        if entry.saving:
+            path = self.path(name)
+            tmp = f"{path}.{os.getpid()}.tmp"    # cluster workers share the root
+            try:
+                with open(tmp, "wb") as f:
+                    pkl.dump(idx, f)
+                    f.flush()
+                    stamp = self._stamp(os.fstat(f.fileno()))
+                os.replace(tmp, path)
+            except Exception as e:
+                log.error("Saving index for %s failed: %s", name, e)
+                failed = True
+
+        delta = dropped = freed = 0
+        changed = False
+        with entry.lock:
+            if entry.saving:
+                entry.saving = False
+                entry.dirty = failed
+                if not failed:
+                    entry.stamp = stamp
+                changed = bool(entry.pending)
+                for method, args in entry.pending:
+                    getattr(idx, method)(*args)
+                    entry.dirty = True
+                entry.pending = []
+                delta = idx.nbytes - entry.size
+                entry.size = idx.nbytes
+            if entry.evicting:
+                dropped = entry.evicting
+                entry.evicting = 0
+                if not entry.dirty:
+                    entry.index = None
+                    entry.ready.clear()
+                    freed = entry.size
+                    entry.size = 0
+
+        with self.lock:
+            self.resident += delta - freed
+            if dropped:
+                self.evicting_bytes -= dropped
+                if entry.index is None:
+                    self.evictions += 1
+                    self.spills += 1
+            if entry.index is None and not entry.online:
+                self.entries.pop(name, None)
+            elif changed and not entry.online:
+                # a failed save alone is not retried here: it would spin on a
+                # full or missing disk; the next change or eviction retries it
+                self._queue_save(name)   # changed while it was written
@@ -1,15 +1,36 @@
+import sys
+import json
+import time
+import bisect
 import pickle
+from array import array
+
+from suffix_index import SuffixIndex
+from term_dict import TermDict
+from line_store import LineStore
+
+# rough per-object costs used by the size estimate (CPython, 64-bit)
+SLOT_BYTES = 8           # one pointer in a list or dict slot
+INT_BYTES = 28           # a line number stored in the postings
+TERM_BYTES = 120         # dict entry + empty postings list for a new word
+STAMP_BYTES = 8          # one entry of the times array
+
+HISTORY_PAGE = 50        # lines per history page by default
+HISTORY_BYTES = 32 * 1024    # ... and at most this much JSON per page
+HISTORY_ROW = 32         # JSON around each line: [number, time, ...],
+FUZZY_TERMS = 20         # spellings a fuzzy search tries per query word
 
 
 class Index:
     def __init__(self, name):
         self.name = name
-        self.msgs = []
+        self.msgs = LineStore()
         """
         ["1st_line", "2nd_line", "3rd_line", ...]
         Example:
         "How are you?\nI am fine.\n" will be stored as
         ["How are you?", "I am fine." ]
+        (a line_store.LineStore, which reads like that list)
         """
 
         self.index = {}
@@ -24,9 +45,96 @@ class Index:
         }
         """
 
+        self.times = array("d")
+        """
+        when each line of msgs was added (seconds since the epoch), so
+        history can be paged by time with a bisect
+        """
+
         self.total_msgs = 0
         self.total_words = 0
 
+        # approximate memory held by msgs + index, kept up to date
+        # by add_msg/indexing so caches never need to walk the index
+        self.nbytes = 0
+
+        # bumped on every add_msg_and_index; lets result caches tell
+        # whether an answer computed earlier is still current
+        self.generation = 0
+
+        # suffix_index.SuffixIndex answering single-word searches, once
+        # use_substring_index() is called; never pickled
+        self.substring = None
+
+        # term_dict.TermDict of the words in index, for completions;
+        # rebuilt by term_dict() when generation moves on, never pickled
+        self.terms = None
+
+        # names of the room_index.RoomLog shards holding chats this user
+        # was in; searched along with msgs
+        self.rooms = []
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["substring"] = None
+        state["terms"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if isinstance(self.msgs, list):
+            # pickled before lines were kept in a LineStore
+            self.msgs = LineStore(self.msgs)
+            state.pop("nbytes", None)    # so it is estimated afresh below
+        self.__dict__.setdefault("generation", 0)
+        self.__dict__.setdefault("substring", None)
+        self.__dict__.setdefault("terms", None)
+        self.__dict__.setdefault("rooms", [])
+        if "times" not in state:
+            # pickled before lines were timestamped
+            self.times = array("d", bytes(STAMP_BYTES * len(self.msgs)))
+            self.nbytes = self.__dict__.get("nbytes", 0) + STAMP_BYTES * len(self.msgs)
+        if "nbytes" not in state:
+            # pickled before the estimate existed
+            self.nbytes = self.estimate_size()
+
+    def estimate_size(self):
+        """Recompute nbytes from scratch."""
+        size = self.msgs.nbytes + (INT_BYTES + STAMP_BYTES) * len(self.msgs)
+        for word, lines in self.index.items():
+            size += sys.getsizeof(word) + TERM_BYTES + SLOT_BYTES * len(lines)
+        return size
+
+    def use_substring_index(self):
+        """
+        Answer single-word searches from suffix arrays instead of a scan.
+        The first call builds them before putting them to use, so searches
+        made meanwhile (on other threads) scan as before.
+        """
+        if self.substring is None:
+            substring = SuffixIndex()
+            substring.catch_up(self.msgs)
+            self.substring = substring
+        else:
+            self.substring.catch_up(self.msgs)
+
+    def term_dict(self):
+        """The index's words as a TermDict, rebuilt if it has changed."""
+        terms = self.terms
+        if terms is None or terms.generation != self.generation:
+            terms = self.terms = TermDict.from_index(self)
+        return terms
+
+    def join_room(self, room):
+        """Remember that this user can see (part of) a room's log."""
+        if room not in self.rooms:
+            self.rooms.append(room)
+
+    def leave_room(self, room):
+        """Forget a room that is gone or holds nothing for this user."""
+        # a new list, so searches walking the old one are not disturbed
+        self.rooms = [r for r in self.rooms if r != room]
+
     def get_total_words(self):
         return self.total_words
 
@@ -36,21 +144,27 @@ class Index:
     def get_msg(self, n):
         return self.msgs[n]
 
-    def add_msg(self, m: str):
+    def add_msg(self, m: str, ts=None):
         """
         m: the message to add
+        ts: when it was said (default: now)
 
-        updates self.msgs and self.total_msgs
+        updates self.msgs, self.times and self.total_msgs
         """
         # IMPLEMENTATION
         # ---- start your code ---- #
-        self.msgs.extend(m.splitlines())
-        self.total_msgs += len(m.splitlines())
+        lines = m.splitlines()
+        before = self.msgs.nbytes
+        self.msgs.extend(lines)
+        self.times.extend([time.time() if ts is None else ts] * len(lines))
+        self.total_msgs += len(lines)
+        self.nbytes += self.msgs.nbytes - before + (INT_BYTES + STAMP_BYTES) * len(lines)
         # ---- end of your code --- #
         return
 
-    def add_msg_and_index(self, m):
-        self.add_msg(m)
+    def add_msg_and_index(self, m, ts=None):
+        self.generation += 1
+        self.add_msg(m, ts)
         line_at = self.total_msgs - 1
         self.indexing(m, line_at)
 
@@ -68,10 +182,13 @@ class Index:
             if not word[-1].isalpha():
                 word = word[:-1]
             if word in self.index:
-                if l not in self.index[word]:
+                # lines arrive in order, so a repeat can only be the last
+                if self.index[word][-1] != l:
                     self.index[word].append(l)
+                    self.nbytes += SLOT_BYTES
             else:
                 self.index[word] = [l]
+                self.nbytes += sys.getsizeof(word) + TERM_BYTES + SLOT_BYTES
 
         # ---- end of your code --- #
         return
@@ -89,37 +206,164 @@ class Index:
          (9, ' Thy self thy foe, to thy sweet self too cruel:'),
          (12, ' Within thine own bud buriest thy content,')]
         """
-        msgs = []
+        return "".join(self.search_iter(term))
+
+    def search_iter(self, term, fuzzy=False, ranges=None):
+        """
+        The lines of search(term), "line_number: line\n", one at a time,
+        so a long result can be sent while it is still being found.
+        fuzzy, ranges: see lookup().
+        """
+        for lnum, line in self.lookup(term.split(), fuzzy, ranges)[0]:
+            yield f"{lnum}: {line}\n"
+
+    def search_hits(self, term, fuzzy=False, ranges=None):
+        """
+        The matches of search(term) as (line_number, line, spans), where
+        spans are the [start, end) offsets in line of every occurrence of
+        the term's words (or, if fuzzy, of the spellings that matched
+        them), sorted and merged, for highlighting.
+        """
+        found, words = self.lookup(term.split(), fuzzy, ranges)
+        for lnum, line in found:
+            yield lnum, line, spans(line, words)
+
+    def lookup(self, words, fuzzy=False, ranges=None):
+        """
+        (iterator of (line_number, line), the words to highlight)
+
+        fuzzy: match close spellings too, see fuzzy_matches()
+        ranges: only look at these lines, sorted disjoint [lo, hi) pairs
+        """
+        if fuzzy:
+            return self.fuzzy_matches(words, ranges)
+        if ranges is None:
+            return self.matches(words), words
+        return self.matches_in(words, ranges), words
+
+    def matches_in(self, words, ranges):
+        """matches(words), looking only at the lines in ranges."""
+        if len(words) == 1:
+            if self.substring is None:
+                found = self.msgs.find(words[0])
+            else:
+                found = self.substring.find(self.msgs, words[0])
+            found = list(clip(found, ranges))
+            yield from zip(found, self.msgs.take(found))
+        else:
+            found = set()
+            for word in words:
+                if word in self.index:
+                    found.update(clip(self.index[word], ranges))
+            found = sorted(found)
+            for lnum, line in zip(found, self.msgs.take(found)):
+                if all(w in line for w in words):
+                    yield lnum, line
+
+    def fuzzy_matches(self, words, ranges=None):
+        """
+        Typo-tolerant matches: lines holding, for every query word, some
+        indexed word within a few edits of it (term_dict().fuzzy()).
+
+        returns (iterator of (line_number, line), the indexed words used)
+        """
+        terms = self.term_dict()
+        spellings = [[w for w, _, _ in terms.fuzzy(word, FUZZY_TERMS)] for word in words]
+        if not spellings or not all(spellings):
+            return iter(()), []
+        lines = None
+        for alts in sorted(spellings, key=lambda alts: sum(len(self.index[w]) for w in alts)):
+            found = set()
+            for w in alts:
+                found.update(self.index[w])
+            lines = found if lines is None else lines & found
+            if not lines:
+                break
+        used = [w for alts in spellings for w in alts]
+        found = sorted(lines)
+        if ranges is not None:
+            found = clip(found, ranges)
+        return ((n, self.msgs[n]) for n in found), used
+
+    def matches(self, words):
+        """(line_number, line) for each line that contains all the words."""
         # IMPLEMENTATION
         # ---- start your code ---- #
-        words = term.split()
-        if len(words)<=1:
-            for i in range(len(self.msgs)):
-                for word in words:
-                    if not msgs and word in self.msgs[i]:
-                        msgs.append((i, self.msgs[i]))
-                    elif word in self.msgs[i] and msgs[-1] != word:
-                        msgs.append((i, self.msgs[i]))
+        if len(words)==1 and self.substring is not None:
+            for i in self.substring.find(self.msgs, words[0]):
+                yield i, self.msgs[i]
+        elif len(words)<=1:
+            for word in words:
+                # searched in the LineStore's buffer, not line by line
+                yield from self.msgs.grep(word)
         else:
+            seen = set()
+            order = []
             for word in words:
                 if word in self.index.keys():
                     for lnum in self.index[word]:
-                        msgs.append((lnum, self.msgs[lnum]))
+                        if lnum not in seen:
+                            seen.add(lnum)
+                            order.append(lnum)
+            for lnum, line in zip(order, self.msgs.take(order)):
+                if all(w in line for w in words):
+                    yield lnum, line
             # ---- end of your code --- #
-            temp = []
-            for lum, line in msgs:
-                TF = 1
-                for word in words:
-                    if word not in line:
-                        TF = 0
-                        continue
-                if TF == 1 and (lum, line) not in temp:
-                    temp.append((lum, line))
-            msgs = temp
-        result = ""
-        for item in msgs:
-            result += str(item[0]) + ": " + str(item[1]) + "\n" 
-        return result
+
+    def history(self, cursor=None, limit=HISTORY_PAGE, since=None, until=None):
+        """
+        One page of stored lines, newest page first, oldest line first
+        within the page.
+
+        cursor: only lines before this line number (from the previous page)
+        since, until: only lines added in [since, until], epoch seconds
+
+        returns ([(line_number, time, line), ...], cursor of the next,
+        older page or None when there is nothing older)
+        """
+        n = len(self.times)              # msgs is extended first
+        lo = bisect.bisect_left(self.times, since, 0, n) if since is not None else 0
+        hi = bisect.bisect_right(self.times, until, 0, n) if until is not None else n
+        if cursor is not None:
+            hi = min(hi, max(cursor, 0))
+
+        page = []
+        size = 0
+        i = hi
+        while i > lo and len(page) < limit:
+            line = self.msgs[i - 1]
+            # as sent: JSON escapes non-ASCII characters, up to 6 each
+            size += len(json.dumps(line)) + HISTORY_ROW
+            if page and size > HISTORY_BYTES:
+                break
+            i -= 1
+            page.append((i, self.times[i], line))
+        page.reverse()
+        return page, (i if i > lo else None)
+
+
+def clip(nums, ranges):
+    """The numbers in sorted nums that fall in ranges, in order."""
+    for lo, hi in ranges:
+        yield from nums[bisect.bisect_left(nums, lo):bisect.bisect_left(nums, hi)]
+
+
+def spans(line, words):
+    """Merged [start, end) offsets of every occurrence of words in line."""
+    found = []
+    for w in words:
+        i = line.find(w)
+        while i >= 0:
+            found.append([i, i + len(w)])
+            i = line.find(w, i + len(w))
+    found.sort()
+    merged = []
+    for start, end in found:
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
 
 
 class PIndex(Index):
@@ -0,0 +1,152 @@
+"""
+Index.msgs as one UTF-8 buffer plus an offsets array.
+
+A list of str costs some 60 bytes of object overhead and pointer per
+line.  LineStore keeps the lines encoded and ended by "\n", back to back
+in a bytearray with an offsets array, so a line costs its UTF-8 bytes
+and four more.  Lines are kept whole, headers included: the time of
+each line is already a column of Index (times), and the "name: " the
+server puts in front is about as long as an int column of sender ids
+would be.  Splitting off the "(stamp) name : " header of text_proc lines
+in older .idx files saved some 16 bytes a line, but putting it back
+made reading them several times slower, for lines the server no longer
+writes.
+
+It behaves like the list it replaces for what Index, PIndex and
+SuffixIndex do with msgs: len, indexing and slicing, iteration, index(),
+append and extend.  Lines are decoded on access, one at a time, which
+would make scanning them all slow, so find(word) searches the buffer
+itself, counting newlines to tell which line a hit is in, and grep(word)
+gives the lines too.  Once a word turns out to be in more than one line
+in DENSE, the rest of the buffer is decoded and split in one go instead,
+which costs less than a step per line; so does take() of more than one
+line in BULK.  That is done BLOCK lines at a time, as a single call
+would keep the GIL from the server's other threads until it was done.
+Pickling writes the buffer and the offsets as two bytes objects, so
+loading and saving an index copies them in bulk.
+"""
+import bisect
+from array import array
+
+DENSE = 8                        # decode it all when 1/DENSE of the lines are wanted
+SAMPLE = 32                      # ... judged once this many have been found
+BULK = 3                         # take() decodes it all for 1/BULK of the lines
+BLOCK = 4096                     # lines decoded per call, so others get the GIL
+
+
+class LineStore:
+    def __init__(self, lines=()):
+        self.blob = bytearray()          # the lines, UTF-8, each ended by \n
+        self.offsets = array("I", [0])   # where each line starts, then the end
+        self.extend(lines)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if type(i) is not int or i < 0:
+            if isinstance(i, slice):
+                start, stop, step = i.indices(len(self))
+                if step == 1:
+                    return self.lines(start, stop)
+                return [self[j] for j in range(start, stop, step)]
+            i = range(len(self))[i]      # negative, or IndexError
+        o = self.offsets
+        return self.blob[o[i]:o[i + 1] - 1].decode()
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def index(self, line, start=0):
+        if start < len(self):
+            pat = line.encode()
+            o = self.offsets
+            i = self.blob.find(pat, o[start])
+            while i >= 0:
+                # only a match starting a line can be the whole of it
+                n = bisect.bisect_left(o, i, start)
+                if n < len(self) and o[n] == i and o[n + 1] == i + len(pat) + 1:
+                    return n
+                i = self.blob.find(pat, i + 1)
+        raise ValueError(f"{line!r} is not in the store")
+
+    def find(self, word):
+        """Sorted numbers of the lines containing word (which has no spaces)."""
+        found, lines, first = self._find(word)
+        if lines is not None:
+            found += [n for n, line in enumerate(lines, first) if word in line]
+        return found
+
+    def grep(self, word):
+        """(line_number, line) for each line containing word, in order."""
+        found, lines, first = self._find(word)
+        found = list(zip(found, self.take(found)))
+        if lines is not None:
+            found += [(n, line) for n, line in enumerate(lines, first) if word in line]
+        return found
+
+    def _find(self, word):
+        """
+        (sorted numbers of the lines before first containing word, and
+        every line from first on, decoded, if they are to be tested one by
+        one instead -- else None, first)
+        """
+        pat = word.encode()
+        blob = self.blob
+        found = []
+        n = end = 0
+        i = blob.find(pat)
+        while i >= 0:
+            n += blob.count(b"\n", end, i)      # lines passed since the last hit
+            found.append(n)
+            end = blob.find(b"\n", i)           # on to the next line
+            if len(found) >= SAMPLE and len(found) * DENSE > n:
+                # a common word: decode the rest in one go
+                return found, self.lines(n + 1), n + 1
+            i = blob.find(pat, end)
+        return found, None, len(self)
+
+    def take(self, nums):
+        """The lines numbered nums, in that order, one at a time."""
+        if len(nums) * BULK <= len(self):
+            for n in nums:
+                yield self[n]
+            return
+        first = min(nums)
+        lines = self.lines(first)
+        for n in nums:
+            yield lines[n - first]
+
+    def lines(self, start=0, stop=None):
+        """The lines from start on (up to stop), decoded in one go."""
+        stop = len(self) if stop is None else stop
+        if start >= stop:
+            return []
+        o = self.offsets
+        lines = []
+        for lo in range(start, stop, BLOCK):
+            hi = min(lo + BLOCK, stop)
+            lines += self.blob[o[lo]:o[hi] - 1].decode().split("\n")
+        return lines
+
+    @property
+    def nbytes(self):
+        return len(self.blob) + self.offsets.itemsize * len(self.offsets)
+
+    def append(self, line):
+        self.blob += line.encode()
+        self.blob += b"\n"
+        self.offsets.append(len(self.blob))    # last: it makes the line visible
+
+    def extend(self, lines):
+        for line in lines:
+            self.append(line)
+
+    def __getstate__(self):
+        return {"blob": bytes(self.blob), "offsets": self.offsets.tobytes()}
+
+    def __setstate__(self, state):
+        self.blob = bytearray(state["blob"])
+        self.offsets = array("I")
+        self.offsets.frombytes(state["offsets"])
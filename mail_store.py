@@ -0,0 +1,204 @@
+"""
+Durable per-recipient message queues for users who dropped out of a chat.
+
+When a user's connection goes away mid-conversation they stay "away" from
+their room (see chat_group.Group.detach), and whatever the room says in
+the meantime is appended to <name>.mbox, one JSON object per line:
+
+    {"seq": 12, "ts": "2025-05-05 15:33:02", "from": "bob", "message": "hi"}
+
+Sequence numbers are per recipient and never go backwards.  Appends are
+queued on a writer thread and batched; the file is flock()ed while
+written, so cluster workers can post to the same mailbox.
+
+On login the client asks for its mail with `sync` and gets it back a
+batch at a time, each batch carrying a cursor.  A batch is cut short at
+SYNC_CHARS of JSON (records are stored as the JSON they are sent as), so
+a reply stays well under the 10**SIZE_SPEC frame limit whatever the
+messages hold.  Sending the cursor back acknowledges everything up to it
+and fetches the next batch; an empty batch means the mailbox is drained
+and it is truncated.  The last cursor acknowledged is kept in <name>.ack
+(with its byte offset, so each batch is a seek rather than a scan),
+which makes an interrupted sync resume where it stopped instead of
+starting over.
+
+Reads run on the server's query pool.  A read first waits for the
+user's queued posts to be written; that wait happens inside idle (the
+pool's QueryPool.idle), so other queries compute meanwhile.
+"""
+import os
+import json
+import logging
+import threading
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
+try:
+    import fcntl
+except ImportError:      # Windows: a single process, so file_lock is enough
+    fcntl = None
+
+log = logging.getLogger("chat.mail")
+
+SYNC_BATCH = 100                     # messages per sync reply
+SYNC_CHARS = 64 * 1024               # ... and at most this much JSON of them
+MAIL_MAX_BYTES = 16 * 1024 * 1024    # mailbox size at which posts are refused
+
+
+def _flock(f):
+    # shut out other cluster workers until f is closed
+    if fcntl is not None:
+        fcntl.flock(f, fcntl.LOCK_EX)
+
+
+class MailStore:
+    def __init__(self, root=".", batch=SYNC_BATCH, max_bytes=MAIL_MAX_BYTES,
+                 batch_chars=SYNC_CHARS, idle=nullcontext):
+        self.root = root
+        self.idle = idle                 # wraps waits for the writer
+        self.batch = batch
+        self.batch_chars = batch_chars
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()     # guards queued, writing
+        self.file_lock = threading.Lock()    # mailbox files, within this process
+        self.queued = {}                 # name → records not yet written
+        self.writing = {}                # name → future of the queued write
+        self.writer = ThreadPoolExecutor(max_workers=1,
+                                         thread_name_prefix="mail-io")
+        self.posted = 0
+        self.refused = 0
+
+    def path(self, name):
+        return os.path.join(self.root, f"{name}.mbox")
+
+    def ack_path(self, name):
+        return os.path.join(self.root, f"{name}.ack")
+
+    def stats(self):
+        with self.lock:
+            return {"posted": self.posted, "refused": self.refused,
+                    "queued": sum(len(q) for q in self.queued.values())}
+
+    # --- called from the event loop ---
+
+    def post(self, name, record):
+        """Queue a message for an away user; written in the background."""
+        with self.lock:
+            pending = self.queued.get(name)
+            if pending is not None:
+                pending.append(record)
+                return
+            self.queued[name] = [record]
+            self.writing[name] = self.writer.submit(self._write, name)
+
+    # --- query pool ---
+
+    def read(self, name, cursor=None):
+        """
+        Acknowledge everything up to cursor (None: what was acknowledged
+        last time) and return the next batch after it.
+        """
+        with self.lock:
+            pending = self.writing.get(name)
+        if pending is not None:
+            with self.idle():
+                pending.result()         # our own posts land first
+
+        try:
+            f = open(self.path(name), "r+b")
+        except FileNotFoundError:
+            return {"results": [], "cursor": cursor or 0, "more": False}
+        with f, self.file_lock:
+            _flock(f)
+            acked, offset = self._load_ack(name)
+            if cursor is not None and cursor > acked:
+                offset = self._skip(f, offset, cursor)
+                acked = cursor
+                self._save_ack(name, acked, offset)
+
+            f.seek(offset)
+            results = []
+            size = 0
+            more = False
+            for line in f:
+                # the first record goes out however long it is
+                if len(results) == self.batch or (
+                        results and size + len(line) > self.batch_chars):
+                    more = True
+                    break
+                results.append(json.loads(line))
+                size += len(line)
+
+            if not results and offset:
+                # all delivered: start the file over, keep the numbering
+                f.truncate(0)
+                self._save_ack(name, acked, 0)
+        last = results[-1]["seq"] if results else acked
+        return {"results": results, "cursor": last, "more": more}
+
+    # --- writer thread ---
+
+    def _write(self, name):
+        with self.lock:
+            records = self.queued.pop(name, [])
+        full = False
+        with open(self.path(name), "ab") as f, self.file_lock:
+            _flock(f)
+            if f.seek(0, os.SEEK_END) > self.max_bytes:
+                full = True
+                log.warning("Mailbox of %s is full; %d messages refused",
+                            name, len(records))
+            else:
+                seq = max(self._last_seq(name), self._load_ack(name)[0])
+                out = []
+                for record in records:
+                    seq += 1
+                    out.append(json.dumps(dict(record, seq=seq)) + "\n")
+                f.write("".join(out).encode())
+        with self.lock:
+            if full:
+                self.refused += len(records)
+            else:
+                self.posted += len(records)
+            if name not in self.queued:
+                self.writing.pop(name, None)
+
+    def _last_seq(self, name):
+        """Sequence number of the last record in the mailbox, or 0."""
+        with open(self.path(name), "rb") as f:
+            end = f.seek(0, os.SEEK_END)
+            step = 4096
+            while end:
+                start = max(end - step, 0)
+                f.seek(start)
+                tail = f.read(end - start).rstrip(b"\n")
+                cut = tail.rfind(b"\n")
+                if cut >= 0 or start == 0:
+                    return json.loads(tail[cut + 1:])["seq"] if tail else 0
+                step *= 2
+        return 0
+
+    def _skip(self, f, offset, cursor):
+        """Byte offset just past the record with seq == cursor."""
+        f.seek(offset)
+        for line in iter(f.readline, b""):
+            if json.loads(line)["seq"] > cursor:
+                break
+            offset += len(line)
+        return offset
+
+    def _load_ack(self, name):
+        try:
+            with open(self.ack_path(name)) as f:
+                ack = json.load(f)
+            return ack["seq"], ack["offset"]
+        except (OSError, ValueError, KeyError):
+            return 0, 0
+
+    def _save_ack(self, name, seq, offset):
+        tmp = self.ack_path(name) + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"seq": seq, "offset": offset}, f)
+        os.replace(tmp, self.ack_path(name))
+
+    def shutdown(self):
+        self.writer.shutdown(wait=True)
@@ -0,0 +1,163 @@
+"""
+Worker pool for the server's slow query actions (search, poem).
+
+Queries run on a thread pool so the select loop does not wait for a
+long scan to finish.  Finished queries are posted to a completion
+queue, and one byte is written to a socketpair that sits in the
+server's select() set, so the loop wakes up and sends the results from
+its own thread.
+
+The pool threads still share the GIL with the loop, which has to win it
+back from them each time it wakes.  The interpreter only makes a running
+thread hand the GIL over after the switch interval (5 ms by default),
+and with several scans waiting it may go to one of them instead.  With
+four threads searching, that put 20 ms on a select wakeup at the median
+and over 70 ms at p95, which is milliseconds of latency on every message.
+So only QUERY_CPU queries compute at a time, and the others queue for a
+turn.  The server cuts the switch interval to SWITCH_INTERVAL while it
+runs (Server.run), and the scans decode in blocks (line_store.BLOCK), so
+no single C call holds the GIL for long.  A query waiting for an index
+to load gives up its turn (idle()).  Threads only let the loop in
+sooner; they do not add CPU.  A process pool would, but the indices live
+in this process.
+
+Each user may only have a few queries in flight; anything over the cap
+is refused straight away.  A query that overruns its deadline is
+answered with a timeout, and its late result is dropped.
+"""
+import time
+import queue
+import socket
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+QUERY_WORKERS = 4        # pool threads
+QUERY_CPU = 1            # ... of which compute at once; the rest wait for a turn
+SWITCH_INTERVAL = 0.001  # seconds a thread may keep the GIL when another wants it
+QUERY_PER_USER = 2       # in-flight queries allowed per user
+QUERY_TIMEOUT = 5.0      # seconds before the client gets a timeout
+
+
+class QueryPool:
+    def __init__(self, workers=QUERY_WORKERS, per_user=QUERY_PER_USER,
+                 timeout=QUERY_TIMEOUT, cpu=QUERY_CPU):
+        self.executor = ThreadPoolExecutor(max_workers=workers,
+                                           thread_name_prefix="query")
+        self.turns = threading.Semaphore(cpu)    # a query computes while holding one
+        self.local = threading.local()           # .turn: this thread holds one
+        self.per_user = per_user
+        self.timeout = timeout
+
+        self.done = queue.SimpleQueue()      # (ticket, name, future)
+        self.inflight = {}                   # username → running queries
+        self.pending = {}                    # ticket → (name, sock, action, key, deadline, since)
+        self.ticket = 0
+
+        # self-pipe: pool threads poke it, the select loop reads it
+        self.wake_r, self.wake_w = socket.socketpair()
+        self.wake_r.setblocking(0)
+        self.wake_w.setblocking(0)
+
+    def submit(self, name, sock, action, key, fn, *args, since=None):
+        """
+        Queue fn(*args) for `name`; False if the user is over the cap.
+        key is handed back untouched with the result (e.g. a cache key).
+        since: when the request came in (perf_counter), default now; the
+        result is handed back with the seconds since then.
+        """
+        if self.inflight.get(name, 0) >= self.per_user:
+            return False
+        self.ticket += 1
+        ticket = self.ticket
+        self.inflight[name] = self.inflight.get(name, 0) + 1
+        self.pending[ticket] = (name, sock, action, key,
+                                time.monotonic() + self.timeout,
+                                time.perf_counter() if since is None else since)
+        fut = self.executor.submit(self._run, fn, args)
+        fut.add_done_callback(lambda f: self._finished(ticket, name, f))
+        return True
+
+    def _run(self, fn, args):
+        # runs on a pool thread
+        with self.turns:
+            self.local.turn = True
+            try:
+                return fn(*args)
+            finally:
+                self.local.turn = False
+
+    @contextmanager
+    def idle(self):
+        """
+        Give up the calling query's turn for the block, as while it waits
+        for an index to load, and queue for one again after it.
+        """
+        if not getattr(self.local, "turn", False):
+            yield
+            return
+        self.turns.release()
+        self.local.turn = False
+        try:
+            yield
+        finally:
+            self.turns.acquire()
+            self.local.turn = True
+
+    def _finished(self, ticket, name, fut):
+        # runs on a pool thread
+        self.done.put((ticket, name, fut))
+        try:
+            self.wake_w.send(b"x")
+        except (BlockingIOError, OSError):
+            pass                             # loop is already awake
+
+    def completed(self):
+        """
+        Yield (name, sock, action, key, result, error, seconds) for
+        finished queries.
+        Called from the select loop when wake_r is readable.
+        """
+        try:
+            while self.wake_r.recv(4096):
+                pass
+        except (BlockingIOError, OSError):
+            pass
+
+        while True:
+            try:
+                ticket, name, fut = self.done.get_nowait()
+            except queue.Empty:
+                return
+            # the worker is free again, whether or not anyone still waits
+            left = self.inflight.get(name, 1) - 1
+            if left > 0:
+                self.inflight[name] = left
+            else:
+                self.inflight.pop(name, None)
+
+            job = self.pending.pop(ticket, None)
+            if job is None:
+                continue                     # already timed out
+            name, sock, action, key, _, since = job
+            err = fut.exception()
+            yield (name, sock, action, key, (None if err else fut.result()), err,
+                   time.perf_counter() - since)
+
+    def expired(self):
+        """Yield (name, sock, action, seconds) for queries past their deadline."""
+        now = time.monotonic()
+        for ticket, (name, sock, action, _, deadline, since) in list(self.pending.items()):
+            if deadline <= now:
+                del self.pending[ticket]
+                yield name, sock, action, time.perf_counter() - since
+
+    def next_timeout(self):
+        """Seconds until the earliest deadline, or None when idle."""
+        if not self.pending:
+            return None
+        first = min(job[4] for job in self.pending.values())
+        return max(first - time.monotonic(), 0)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,69 @@
+"""
+Cache of serialized query responses (search, poem).
+
+Entries are the exact JSON frames sent to the client, so a hit costs one
+dict lookup and one send.  Entries expire after a TTL and the least
+recently used ones are dropped once the cache is full.
+
+Keys for per-user searches carry the index's generation counter, which
+Index.add_msg_and_index bumps; a new message therefore makes every older
+entry for that user unreachable, and they age out through the LRU.
+The room logs a search also covers are keyed by the server's count of
+lines posted to each, which does not need the log to be paged in.
+Only the event loop touches the cache, so there is no locking.
+"""
+import time
+from collections import OrderedDict
+
+RESULT_CACHE_SIZE = 1024     # frames kept
+RESULT_TTL = 300.0           # seconds
+
+
+class ResultCache:
+    def __init__(self, size=RESULT_CACHE_SIZE, ttl=RESULT_TTL):
+        self.size = size
+        self.ttl = ttl
+        self.entries = OrderedDict()     # key → (expires, frame)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """The cached frame for key, or None."""
+        entry = self.entries.get(key)
+        if entry is not None:
+            if entry[0] > time.monotonic():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            del self.entries[key]
+        self.misses += 1
+        return None
+
+    def put(self, key, frame):
+        self.entries[key] = (time.monotonic() + self.ttl, frame)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def stats(self):
+        return {"entries": len(self.entries), "hits": self.hits,
+                "misses": self.misses}
+
+
+def search_key(name, idx, term, hits=False, fuzzy=False, rooms=()):
+    """
+    Cache key for a search, or None if the index is not resident or one
+    of the room logs it also searches cannot be told apart.
+
+    rooms: [(room name, generation), ...], where the generation is the
+    server's count of what changed the room, kept whether the log is
+    resident or not, or None if it is unknown
+    """
+    if idx is None or any(gen is None for _, gen in rooms):
+        return None
+    return ("search", name, idx.generation, tuple(rooms),
+            " ".join(term.split()), hits, fuzzy)
+
+
+def poem_key(num):
+    return ("poem", num)
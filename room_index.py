@@ -0,0 +1,110 @@
+"""
+Chat-room logs shared by everyone in the room.
+
+Each user's Index only holds what that user sent, so nobody could search
+what they were sent; copying every message into each member's index
+would cost O(messages x members).  A RoomLog stores and indexes a room's
+messages once, and records for each member the ranges of lines they may
+see, as [first, end) line numbers:
+
+    ranges = {"alice": [[0, None]], "bob": [[3, 10], [14, None]]}
+
+(end None: still in the room).  Ranges are brought up to date with the
+room's membership as each message is added, so a member sees exactly
+what was said while they were in the room -- including while they were
+away, when the same messages go to their mail.  A search filters the log
+to the user's ranges by bisecting postings (Index.matches_in), so it
+looks at no line the user may not see.
+
+Line numbers count the lines of each log, so room hits are tagged with
+the room they are from.
+
+The sender's own copy still goes to their Index, which stays their
+personal log (the `history` action pages it), so room lines a user sent
+are left out of their searches; that is one extra copy per message, not
+one per member.
+
+Rooms are named "room-<run>-<key>" after the process that keeps them and
+the chat_group key, and are paged in and out by the IndexStore like
+user indices.  In cluster mode each worker keeps its own shard of a room
+with the messages its own users sent or received, so a message is stored
+at most once per worker, however many members it has.
+
+A user's list of rooms would otherwise only grow, and every search would
+page in every room they were ever in.  A room that is no longer kept
+(IndexStore.expire) or that has no line for the user is dropped from
+their list the first time a search finds so, and room files that have
+not been written for ROOM_KEEP seconds are deleted.
+"""
+import heapq
+
+import indexer
+
+ROOM_KEEP = 30 * 24 * 3600       # seconds a room's log outlives its last write
+
+
+class RoomLog(indexer.Index):
+    """A room's messages, indexed once, plus who may see which of them."""
+
+    def __init__(self, name):
+        super().__init__(name)
+        self.ranges = {}                 # username → [[first, end], ...]
+        self.present = set()             # users whose last range is open
+
+    def post(self, m, members):
+        """Add a line; members: who is in the room when it is said."""
+        self.sync(members)
+        self.add_msg_and_index(m)
+
+    def sync(self, members):
+        """Open ranges for members new to the room, close those who left."""
+        n = len(self.msgs)
+        members = set(members)
+        for name in self.present - members:
+            self.ranges[name][-1][1] = n
+        for name in members - self.present:
+            spans = self.ranges.setdefault(name, [])
+            if spans and spans[-1][1] == n:
+                spans[-1][1] = None      # back before anything was said
+            else:
+                spans.append([n, None])
+        self.present = members
+
+    def visible(self, name):
+        """The user's non-empty ranges as [lo, hi) pairs, for Index.matches_in."""
+        n = len(self.msgs)
+        return [(lo, n if hi is None else hi) for lo, hi in self.ranges.get(name, ())
+                if lo < (n if hi is None else hi)]
+
+
+def _stamp(idx, n):
+    # msgs is extended before times, so the newest line may have none yet
+    times = idx.times
+    return times[n] if n < len(times) else float("inf")
+
+
+def search(sources, term, fuzzy=False, skip=None):
+    """
+    Search several logs at once, oldest match first.
+
+    sources: [(index, ranges or None for all of it), ...]
+    skip: leave out lines starting with this (the user's own lines in a
+    room, which their own index already has)
+
+    yields (source, line_number, line, spans), where source is the
+    position in sources of the log the line is from: line numbers count
+    the lines of each log, so they repeat across sources
+    """
+    words = term.split()
+    streams = [_stream(k, idx, ranges, words, fuzzy, skip)
+               for k, (idx, ranges) in enumerate(sources)]
+    for _, k, n, line, hl in heapq.merge(*streams):
+        yield k, n, line, indexer.spans(line, hl)
+
+
+def _stream(k, idx, ranges, words, fuzzy, skip):
+    # heapq.merge needs each stream in order, and a search for several
+    # words finds lines in postings order, word by word
+    found, hl = idx.lookup(words, fuzzy, ranges)
+    yield from sorted((_stamp(idx, n), k, n, line, hl) for n, line in found
+                      if ranges is None or not skip or not line.startswith(skip))
@@ -0,0 +1,216 @@
+"""
+Substring search over an Index's lines with suffix arrays.
+
+A single-word search matches anywhere inside a line ("love" also finds
+"beloved"), which Index answers by scanning every line.  SuffixIndex
+answers it with a binary search instead: each Segment joins a range of
+lines with "\\n" and keeps the suffix array of that text (built by prefix
+doubling, to DEPTH characters) and its LCP array (Kasai).  The suffixes
+starting with the pattern are contiguous in the suffix array; the first
+is found by binary search, the rest by walking the LCP array while it
+stays >= the pattern length, and each hit's offset maps back to its line
+by bisecting the line starts.  A pattern that matches a good share of
+all lines ("e", "th") is cheaper to answer by scanning, so it is.
+
+Chat indices keep growing, so lines are indexed in segments, like an
+LSM tree: up to TAIL_LINES new lines are left unindexed and scanned; when
+the tail is full it becomes a segment of its own, and the newest segments
+are merged (rebuilt as one) whenever the older is not at least
+MERGE_RATIO times the size of the newer.  A search thus looks at a
+logarithmic number of segments and at most TAIL_LINES lines, and every
+line is rebuilt O(log n) times in total.
+
+Building costs a few microseconds per character in pure Python and the
+arrays take about 9 bytes per character, so this is opt-in (the server's
+--substring-index).  Nothing here is pickled; the segments are rebuilt
+when the index is loaded.
+"""
+import bisect
+import threading
+from array import array
+
+TAIL_LINES = 256         # unindexed lines before they are made a segment
+MERGE_RATIO = 2          # keep segments at least this much bigger than the next
+DEPTH = 64               # suffixes are only sorted by this many characters
+SCAN_SHARE = 4           # scan a segment instead if 1/SCAN_SHARE of its lines match
+
+
+def suffix_array(text, depth=DEPTH):
+    """
+    Start offsets of text's suffixes, sorted by their first depth
+    characters (prefix doubling: each round sorts by the ranks of the
+    first k and the next k characters).  Stopping at depth keeps long
+    repeats, which chat logs are full of, from costing a round each.
+    """
+    n = len(text)
+    if not n:
+        return array("i")
+    alphabet = {c: r for r, c in enumerate(sorted(set(text)), 1)}
+    rank = [alphabet[c] for c in text]
+    sa = list(range(n))
+    mult = n + 2
+    k = 1
+    while True:
+        key = [r * mult + (rank[i + k] if i + k < n else 0)
+               for i, r in enumerate(rank)]
+        sa.sort(key=key.__getitem__)
+        new = [0] * n
+        r = 1
+        prev = key[sa[0]]
+        for i in sa:
+            if key[i] != prev:
+                r += 1
+                prev = key[i]
+            new[i] = r
+        rank = new
+        if r == n or 2 * k >= depth:     # all told apart, or deep enough
+            return array("i", sa)
+        k *= 2
+
+
+def lcp_array(text, sa, depth=DEPTH):
+    """
+    lcp[r] = common prefix length, up to depth, of suffixes sa[r - 1]
+    and sa[r] (Kasai).
+    """
+    n = len(sa)
+    rank = [0] * n
+    for r, p in enumerate(sa):
+        rank[p] = r
+    lcp = array("i", bytes(4 * n))
+    h = 0
+    for i in range(n):
+        r = rank[i]
+        if r == 0:
+            h = 0
+            continue
+        j = sa[r - 1]
+        if h and text[i:i + h] != text[j:j + h]:
+            h = 0                    # ties past depth are in no set order
+        while h < depth and i + h < n and j + h < n and text[i + h] == text[j + h]:
+            h += 1
+        lcp[r] = h
+        if h:
+            h -= 1
+    return lcp
+
+
+class Segment:
+    """Suffix and LCP arrays over lines[lo:hi] of an index."""
+
+    def __init__(self, lines, lo):
+        self.lo = lo
+        self.hi = lo + len(lines)
+        self.text = "\n".join(lines) + "\n"
+        self.starts = array("i")         # offset of each line in text
+        pos = 0
+        for line in lines:
+            self.starts.append(pos)
+            pos += len(line) + 1
+        self.sa = suffix_array(self.text)
+        self.lcp = lcp_array(self.text, self.sa)
+
+    @property
+    def chars(self):
+        return len(self.text)
+
+    @property
+    def nbytes(self):
+        return (len(self.text) + self.sa.itemsize * (len(self.sa) + len(self.lcp))
+                + self.starts.itemsize * len(self.starts))
+
+    def find(self, pattern):
+        """
+        Line numbers (absolute, unsorted) of lines containing pattern, or
+        None when so many match that scanning the lines is cheaper.
+        """
+        text, sa = self.text, self.sa
+        key = pattern[:DEPTH]
+        m = len(key)
+        lo, hi = 0, len(sa)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if text[sa[mid]:sa[mid] + m] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == len(sa) or not text.startswith(key, sa[lo]):
+            return set()
+        # the rest of the matches follow while the LCP stays >= m
+        hits = [sa[lo]]
+        lcp = self.lcp
+        limit = len(self.starts) // SCAN_SHARE
+        r = lo + 1
+        while r < len(sa) and lcp[r] >= m:
+            hits.append(sa[r])
+            if len(hits) > limit:
+                return None
+            r += 1
+        if len(pattern) > m:
+            hits = [p for p in hits if text.startswith(pattern, p)]
+        starts = self.starts
+        return {self.lo + bisect.bisect_right(starts, p) - 1 for p in hits}
+
+
+class SuffixIndex:
+    """Segments over an append-only list of lines, plus a scanned tail."""
+
+    def __init__(self, tail_lines=TAIL_LINES):
+        self.tail_lines = tail_lines
+        # (segments, lines [0, covered) they hold), replaced as a whole so
+        # searches never wait for a build
+        self.view = ([], 0)
+        self.lock = threading.Lock()     # one builder at a time
+        self.queued = False              # a catch_up is scheduled
+
+    @property
+    def nbytes(self):
+        return sum(s.nbytes for s in self.view[0])
+
+    def due(self, lines):
+        """
+        True (once) when the tail has outgrown tail_lines, so the caller
+        can schedule catch_up() in the background.
+        """
+        if self.queued or len(lines) - self.view[1] < self.tail_lines:
+            return False
+        self.queued = True
+        return True
+
+    def catch_up(self, lines):
+        """Index the tail of lines if it has grown past tail_lines."""
+        self.queued = False
+        if len(lines) - self.view[1] < self.tail_lines:
+            return
+        with self.lock:
+            segments, covered = self.view
+            hi = len(lines)
+            if hi - covered < self.tail_lines:
+                return               # another thread got here first
+            segments = segments + [Segment(lines[covered:hi], covered)]
+            while (len(segments) > 1
+                   and segments[-2].chars < MERGE_RATIO * segments[-1].chars):
+                b = segments.pop()
+                a = segments.pop()
+                segments.append(Segment(lines[a.lo:b.hi], a.lo))
+            self.view = (segments, hi)
+
+    def find(self, lines, pattern):
+        """Sorted numbers of the lines that contain pattern."""
+        if not pattern:
+            return []
+        if not self.lock.locked():
+            self.catch_up(lines)         # else scan what is still building
+        segments, covered = self.view
+        found = set()
+        for seg in segments:
+            hits = seg.find(pattern)
+            if hits is None:
+                hits = self.scan(lines, pattern, seg.lo, seg.hi)
+            found |= hits
+        found |= self.scan(lines, pattern, covered, len(lines))
+        return sorted(found)
+
+    @staticmethod
+    def scan(lines, pattern, lo, hi):
+        return {i for i in range(lo, hi) if pattern in lines[i]}
@@ -0,0 +1,250 @@
+"""
+A sorted, compact term dictionary for completions and wildcard lookups.
+
+Index.index maps each word to its postings in a plain dict, which is fine
+for exact lookups but makes "every word starting with beaut" a scan of
+all the keys.  TermDict keeps the same words sorted, packed into one
+string with an offsets array, next to each word's frequency (the number
+of lines it occurs in):
+
+    prefix("beaut", 5)      the 5 most frequent words starting with "beaut"
+    wildcard("b*ty", 5)     ... matching a pattern; * is any run, ? one char
+
+A prefix is a bisect away from its range of words.  The most frequent
+words in a range come out of a sparse table of range maxima, one heap
+step each, so a completion costs O(log n + limit) however many words
+share the prefix.  A wildcard narrows the range by its literal prefix
+and runs one regular expression over that slice of the packed string.
+
+fuzzy("beautie") finds the words within a few edits of a misspelling.
+Candidates come from a trigram index over the lowercased words (built on
+first use): k edits can spoil at most 3k of a word's trigrams, so only
+words sharing enough of them with the query, and of a length within k,
+can qualify.  Both steps are bounded -- trigram postings are read
+shortest first up to GRAM_BUDGET entries, and at most FUZZY_VERIFY
+candidates, those sharing the most trigrams, get the exact (banded,
+early-exit) edit distance -- so a short or very common fragment costs no
+more than a rare one.  (A three-letter query whose one edit falls in
+the middle shares no trigram with its match -- "dya" for "day" -- and is
+not found; such short words are few and cheap to retype.)
+
+A TermDict is a snapshot; Index.term_dict() rebuilds it when the index
+has changed.
+"""
+import re
+import sys
+import heapq
+import bisect
+from array import array
+from collections import Counter
+
+SUGGEST_LIMIT = 10       # completions returned by default
+SUGGEST_MAX = 50         # ... and at most
+
+GRAM_BUDGET = 20000      # trigram postings read per fuzzy lookup, at most
+FUZZY_VERIFY = 200       # candidates whose edit distance is computed, at most
+
+
+def fuzzy_distance(n):
+    """Edits allowed for a query word of n characters."""
+    return 0 if n <= 2 else 1 if n <= 5 else 2
+
+
+def trigrams(word):
+    """The word's trigrams, padded so that its ends count too."""
+    w = f"${word}$"
+    return {w[i:i + 3] for i in range(len(w) - 2)}
+
+
+def edit_distance(a, b, k):
+    """
+    Edit distance of a and b (insertions, deletions, substitutions and
+    swaps of neighbours), or None if it is more than k.  Only the band
+    of cells within k of the diagonal is filled in, and it gives up as
+    soon as a whole row is over k.
+    """
+    if abs(len(a) - len(b)) > k:
+        return None
+    far = k + 1
+    n = len(b)
+    before = None
+    prev = [j if j <= k else far for j in range(n + 1)]
+    for i in range(1, len(a) + 1):
+        cur = [far] * (n + 1)
+        if i <= k:
+            cur[0] = i
+        lo, hi = max(1, i - k), min(n, i + k)
+        ca = a[i - 1]
+        for j in range(lo, hi + 1):
+            d = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (ca != b[j - 1]))
+            if (before is not None and j > 1 and ca == b[j - 2]
+                    and a[i - 2] == b[j - 1]):
+                d = min(d, before[j - 2] + 1)
+            cur[j] = min(d, far)
+        if min(cur[lo - 1:hi + 1]) > k:
+            return None
+        before, prev = prev, cur
+    return prev[n] if prev[n] <= k else None
+
+
+class _Words:
+    """The sorted words as a read-only sequence, sliced out of one string."""
+
+    def __init__(self, blob, offsets):
+        self.blob = blob                 # "word\nword\n..."
+        self.offsets = offsets           # start of each word, then len(blob)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.blob[self.offsets[i]:self.offsets[i + 1] - 1]
+
+
+class TermDict:
+    def __init__(self, counts, generation=0):
+        """counts: {word: frequency}"""
+        words = sorted(w for w in counts if w and "\n" not in w)
+        self.generation = generation     # of the index it was built from
+        self.freqs = array("i", (counts[w] for w in words))
+        offsets = array("i", [0])
+        pos = 0
+        for w in words:
+            pos += len(w) + 1
+            offsets.append(pos)
+        self.words = _Words("\n".join(words) + "\n" if words else "", offsets)
+        self.table = self._sparse_table()
+        self.grams = None                # trigram → positions, built by fuzzy()
+
+    @classmethod
+    def from_index(cls, idx):
+        generation = idx.generation
+        return cls({w: len(lines) for w, lines in list(idx.index.items())},
+                   generation)
+
+    def __len__(self):
+        return len(self.freqs)
+
+    @property
+    def nbytes(self):
+        return (sys.getsizeof(self.words.blob)
+                + self.freqs.itemsize * len(self.freqs)
+                + self.words.offsets.itemsize * len(self.words.offsets)
+                + sum(row.itemsize * len(row) for row in self.table))
+
+    # --- lookups ---
+
+    def suggest(self, query, limit=SUGGEST_LIMIT):
+        """Completions of query, a prefix or a wildcard pattern."""
+        head = query.rstrip("*")
+        if "*" in head or "?" in head:
+            return self.wildcard(query, limit)
+        return self.prefix(head, limit)
+
+    def prefix(self, prefix, limit=SUGGEST_LIMIT):
+        """[(word, frequency)] for the most frequent words with prefix."""
+        lo, hi = self.span(prefix)
+        return [(self.words[i], self.freqs[i]) for i in self.top(lo, hi, limit)]
+
+    def wildcard(self, pattern, limit=SUGGEST_LIMIT):
+        """[(word, frequency)] for the most frequent words matching pattern."""
+        literal = re.split(r"[*?]", pattern, maxsplit=1)[0]
+        lo, hi = self.span(literal)
+        if lo == hi:
+            return []
+        # a leading * needs no anchor: finding the rest in a line will do,
+        # and spares the engine from trying every start in it
+        anchor = "" if pattern.startswith("*") else "^"
+        regex = "".join("[^\n]*" if c == "*" else "[^\n]" if c == "?" else re.escape(c)
+                        for c in pattern.lstrip("*"))
+        offsets = self.words.offsets
+        found = []
+        for m in re.finditer(f"{anchor}{regex}$", self.words.blob[offsets[lo]:offsets[hi]],
+                             re.MULTILINE):
+            i = bisect.bisect_right(offsets, offsets[lo] + m.start()) - 1
+            found.append(i)
+        best = heapq.nsmallest(limit, found, key=lambda i: -self.freqs[i])
+        return [(self.words[i], self.freqs[i]) for i in best]
+
+    def fuzzy(self, word, limit=SUGGEST_LIMIT, max_dist=None):
+        """
+        [(word, frequency, distance)] for the dictionary words closest to
+        word, ignoring case: fewest edits first, then most frequent.
+        """
+        q = word.lower()
+        k = fuzzy_distance(len(q)) if max_dist is None else max_dist
+        grams = trigrams(q)
+        index = self._grams()
+        counts = Counter()
+        read = skipped = 0
+        for post in sorted((index.get(g, ()) for g in grams), key=len):
+            if read + len(post) > GRAM_BUDGET:
+                skipped += 1             # too common to be worth reading
+                continue
+            read += len(post)
+            counts.update(post)
+        need = max(len(grams) - 3 * k - skipped, 1)
+        offsets = self.words.offsets
+        cands = [i for i, c in counts.items()
+                 if c >= need and abs(offsets[i + 1] - offsets[i] - 1 - len(q)) <= k]
+        if len(cands) > FUZZY_VERIFY:
+            cands = heapq.nlargest(FUZZY_VERIFY, cands, key=counts.__getitem__)
+        found = []
+        for i in cands:
+            d = edit_distance(q, self.words[i].lower(), k)
+            if d is not None:
+                found.append((d, -self.freqs[i], i))
+        found.sort()
+        return [(self.words[i], -f, d) for d, f, i in found[:limit]]
+
+    def _grams(self):
+        if self.grams is None:
+            grams = {}
+            for i in range(len(self)):
+                for g in trigrams(self.words[i].lower()):
+                    grams.setdefault(g, []).append(i)
+            self.grams = {g: array("i", post) for g, post in grams.items()}
+        return self.grams
+
+    def span(self, prefix):
+        """[lo, hi) of the words starting with prefix."""
+        lo = bisect.bisect_left(self.words, prefix)
+        hi = bisect.bisect_left(self.words, prefix + "\U0010ffff", lo)
+        return lo, hi
+
+    def top(self, lo, hi, limit):
+        """Positions of the limit most frequent words in [lo, hi)."""
+        out = []
+        if lo >= hi:
+            return out
+        m = self._argmax(lo, hi)
+        heap = [(-self.freqs[m], m, lo, hi)]
+        while heap and len(out) < limit:
+            _, m, lo, hi = heapq.heappop(heap)
+            out.append(m)
+            # the best of what is left on either side of m
+            for a, b in ((lo, m), (m + 1, hi)):
+                if a < b:
+                    k = self._argmax(a, b)
+                    heapq.heappush(heap, (-self.freqs[k], k, a, b))
+        return out
+
+    # --- range maximum ---
+
+    def _sparse_table(self):
+        # table[k][i] = position of the most frequent word in [i, i + 2**k)
+        freqs = self.freqs
+        table = [array("i", range(len(freqs)))]
+        span = 1
+        while 2 * span <= len(freqs):
+            prev = table[-1]
+            table.append(array("i", (a if freqs[a] >= freqs[b] else b
+                                     for a, b in zip(prev, prev[span:]))))
+            span *= 2
+        return table
+
+    def _argmax(self, lo, hi):
+        k = (hi - lo).bit_length() - 1
+        row = self.table[k]
+        a, b = row[lo], row[hi - (1 << k)]
+        return a if self.freqs[a] >= self.freqs[b] else b
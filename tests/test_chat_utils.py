@@ -0,0 +1,75 @@
+import json
+import socket
+import threading
+import unittest
+
+from chat_utils import (SIZE_SPEC, CHUNK_CHARS, mysend, chunk_text, chunk_list,
+                        recv_results)
+from chat_server import hit_chars, clip_hit
+
+
+class ChunkTest(unittest.TestCase):
+    def setUp(self):
+        self.a, self.b = socket.socketpair()
+        self.addCleanup(self.a.close)
+        self.addCleanup(self.b.close)
+
+    def send_stream(self, action, chunks):
+        frames = [json.dumps({"action": action, "chunk": chunk}) for chunk in chunks]
+        for frame in frames:
+            self.assertLess(len(frame), 10 ** SIZE_SPEC)
+        frames.append(json.dumps({"action": action, "done": True}))
+        # more than a socket buffer holds: write while the test reads
+        sender = threading.Thread(target=lambda: [mysend(self.a, f) for f in frames])
+        sender.start()
+        self.addCleanup(sender.join)
+
+    def test_text_is_reassembled(self):
+        lines = [f"{n}: 漢字 line {n}\n" for n in range(5000)]
+        chunks = list(chunk_text(lines))
+        self.assertGreater(len(chunks), 1)
+        self.send_stream("search", chunks)
+        self.assertEqual(recv_results(self.b, "search", [])["results"], "".join(lines))
+
+    def test_lists_are_reassembled(self):
+        poem = [f"line {n} " + "x" * 300 for n in range(200)]
+        self.send_stream("poem", chunk_list(poem))
+        self.assertEqual(recv_results(self.b, "poem", [])["results"], poem)
+
+    def test_other_frames_are_kept_for_the_caller(self):
+        stray = []
+        mysend(self.a, json.dumps({"action": "connect", "status": "request",
+                                   "from": "bo"}))
+        mysend(self.a, json.dumps({"action": "search", "chunk": "0: one\n"}))
+        mysend(self.a, json.dumps({"action": "exchange", "from": "[bo]",
+                                   "message": "hi"}))
+        mysend(self.a, json.dumps({"action": "search", "chunk": "1: two\n"}))
+        mysend(self.a, json.dumps({"action": "search", "done": True}))
+        reply = recv_results(self.b, "search", stray)
+        self.assertEqual(reply["results"], "0: one\n1: two\n")
+        self.assertEqual([json.loads(raw)["action"] for raw in stray],
+                         ["connect", "exchange"])
+
+    def test_an_oversized_item_is_clipped(self):
+        items = ["short", "é" * (3 * CHUNK_CHARS), "after"]
+        parts = list(chunk_list(items))
+        self.assertEqual(parts, [["short"], ["é" * CHUNK_CHARS], ["after"]])
+        for part in parts:
+            self.assertLess(len(json.dumps({"action": "poem", "chunk": part})),
+                            10 ** SIZE_SPEC)
+
+    def test_an_oversized_hit_is_clipped(self):
+        line = "a" * 60000
+        hit = [7, line, [[i, i + 1] for i in range(len(line))], "room-1-1"]
+        parts = list(chunk_list([hit], measure=hit_chars, clip=clip_hit))
+        (clipped,), = parts
+        self.assertLessEqual(hit_chars(clipped), CHUNK_CHARS + 50)
+        self.assertEqual(clipped[0], 7)
+        self.assertEqual(clipped[3], "room-1-1")
+        self.assertTrue(line.startswith(clipped[1]))
+        frame = json.dumps({"action": "search", "chunk": parts[0]})
+        self.assertLess(len(frame), 10 ** SIZE_SPEC)
+
+
+if __name__ == "__main__":
+    unittest.main()
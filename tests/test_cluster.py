@@ -0,0 +1,85 @@
+import os
+import json
+import time
+import shutil
+import socket
+import tempfile
+import unittest
+
+import chat_cluster
+from chat_cluster import Registry, Router
+
+
+class Delivered:
+    """Stands in for the worker's chat_server.Server."""
+
+    def __init__(self):
+        self.frames = []
+
+    def deliver_local(self, names, frame):
+        self.frames.append((names, frame))
+
+
+@unittest.skipUnless(hasattr(socket, "AF_UNIX") and hasattr(os, "fork"),
+                     "cluster mode needs Unix sockets and fork()")
+class ClusterTest(unittest.TestCase):
+    def setUp(self):
+        self.rundir = tempfile.mkdtemp(prefix="icds-test-")
+        self.addCleanup(shutil.rmtree, self.rundir, ignore_errors=True)
+
+    def inbox(self, wid):
+        sock = chat_cluster._dgram_socket(chat_cluster._inbox(self.rundir, wid))
+        self.addCleanup(sock.close)
+        return sock
+
+    def test_users_of_an_exited_worker_are_detached(self):
+        registry = Registry(self.rundir, 2)
+        self.addCleanup(registry.sock.close)
+        inbox = self.inbox(0)
+        inbox.settimeout(1)
+        for name, wid in [("amy", 1), ("bo", 1), ("kim", 0)]:
+            self.assertEqual(registry.apply({"op": "join", "name": name,
+                                             "worker": wid}), "ok")
+        self.assertEqual(registry.apply({"op": "connect", "name": "amy",
+                                         "peer": "kim"}), "ok")
+
+        pid = os.fork()
+        if pid == 0:
+            os._exit(3)
+        registry.pids[pid] = 1
+        for _ in range(100):
+            registry.reap()
+            if not registry.pids:
+                break
+            time.sleep(0.01)
+
+        self.assertEqual(registry.dead, {1})
+        self.assertFalse(registry.group.is_member("amy"))
+        self.assertFalse(registry.group.is_member("bo"))
+        self.assertTrue(registry.group.is_member("kim"))
+        self.assertEqual(registry.group.list_away("kim"), ["amy"])
+        told = [json.loads(inbox.recv(4096)) for _ in range(2)]
+        self.assertEqual(sorted(ev["name"] for ev in told), ["amy", "bo"])
+        self.assertTrue(all(ev["op"] == "detach" and ev["status"] == "ok"
+                            for ev in told))
+
+    def test_frames_routed_during_a_call_wait_for_the_loop(self):
+        registry = chat_cluster._dgram_socket(os.path.join(self.rundir, "registry.sock"))
+        self.addCleanup(registry.close)
+        router = Router(0, self.rundir, self.inbox(0))
+        router.server = Delivered()
+        path = chat_cluster._inbox(self.rundir, 0)
+        # a sibling's frame lands before the registry's answer
+        registry.sendto(json.dumps({"to": ["amy"], "frame": "hi"}).encode(), path)
+        registry.sendto(json.dumps({"op": "join", "name": "amy", "worker": 0,
+                                    "id": 1, "status": "ok", "seq": 1}).encode(), path)
+
+        self.assertEqual(router.call("join", name="amy"), "ok")
+        self.assertTrue(router.group.is_member("amy"))
+        self.assertEqual(router.server.frames, [])
+        router.handle()
+        self.assertEqual(router.server.frames, [(["amy"], "hi")])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,104 @@
+import socket
+import unittest
+from types import SimpleNamespace
+
+import chat_server
+from flow_control import TokenBucket, Outbox, encode
+
+
+class Counter:
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, n=1):
+        self.value += n
+
+
+def read_all(sock, n):
+    data = b""
+    while len(data) < n:
+        data += sock.recv(n - len(data))
+    return data
+
+
+class TokenBucketTest(unittest.TestCase):
+    def test_burst_then_rate(self):
+        bucket = TokenBucket(rate=10, burst=3)
+        now = bucket.stamp
+        self.assertEqual([bucket.take(now=now) for _ in range(3)], [0, 0, 0])
+        self.assertAlmostEqual(bucket.take(now=now), 0.1)      # one in debt
+        self.assertAlmostEqual(bucket.take(now=now + 0.1), 0.1)
+        # idle time refills it, but only up to the burst
+        self.assertEqual(bucket.take(now=now + 10), 0)
+        self.assertEqual(bucket.tokens, 2)
+
+
+class OutboxTest(unittest.TestCase):
+    def setUp(self):
+        self.a, self.b = socket.socketpair()
+        self.a.setblocking(False)
+        self.addCleanup(self.a.close)
+        self.addCleanup(self.b.close)
+
+    def test_spilled_frames_come_out_in_order(self):
+        ob = Outbox(self.a)
+        frames = [encode(f"frame {i} " + "x" * 5000) for i in range(40)]
+        for data in frames[:20]:
+            ob.push(data)
+        ob.to_disk()
+        self.assertEqual(ob.size, 0)
+        for data in frames[20:]:
+            ob.push(data)                # later frames follow into the file
+        self.assertEqual(len(ob), sum(map(len, frames)))
+
+        got = b""
+        want = b"".join(frames)
+        while len(got) < len(want):
+            self.assertTrue(ob.flush())
+            got += read_all(self.b, min(65536, len(want) - len(got)))
+        self.assertEqual(got, want)
+        self.assertEqual(len(ob), 0)
+        self.assertIsNone(ob.spill)      # caught up: back in memory
+
+    def test_drop_keeps_the_frame_on_the_wire(self):
+        ob = Outbox(self.a)
+        big = encode("y" * 4 * 1024 * 1024)
+        ob.push(big)
+        ob.push(encode("next"))
+        ob.flush()                       # the socket takes part of it
+        sent = len(big) - (ob.size - len(encode("next")))
+        self.assertGreater(sent, 0)
+        self.assertEqual(ob.drop(), 1)
+        self.assertEqual(ob.size, len(big) - sent)
+
+
+class SlowConsumerTest(unittest.TestCase):
+    def server(self, policy):
+        return SimpleNamespace(slow_policy=policy, logged_sock2name={},
+                               closing=set(), m_slow=Counter(),
+                               m_dropped=Counter())
+
+    def test_policies(self):
+        a, b = socket.socketpair()
+        self.addCleanup(a.close)
+        self.addCleanup(b.close)
+        for policy in ("drop", "disconnect", "disk"):
+            server = self.server(policy)
+            ob = Outbox(a)
+            for _ in range(3):
+                ob.push(encode("hello"))
+            chat_server.Server.slow_consumer(server, a, ob)
+            self.assertEqual(server.m_slow.value, 1)
+            if policy == "drop":
+                self.assertEqual(server.m_dropped.value, 3)
+                self.assertEqual(len(ob), 0)
+            elif policy == "disconnect":
+                self.assertEqual(server.closing, {a})
+            else:
+                self.assertIsNotNone(ob.spill)
+                self.assertEqual(ob.spilled, 3 * len(encode("hello")))
+                ob.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,137 @@
+import os
+import time
+import pickle
+import tempfile
+import threading
+import unittest
+
+import indexer
+from index_store import IndexStore
+
+writing = threading.Event()
+building = threading.Event()
+
+
+class SlowIndex(indexer.Index):
+    """Takes a while to pickle, like a big index on a slow disk."""
+
+    def __getstate__(self):
+        writing.set()
+        time.sleep(0.5)
+        return super().__getstate__()
+
+
+class SlowBuild(indexer.Index):
+    """Takes a while to build its suffix index."""
+
+    def use_substring_index(self):
+        building.wait(5)
+        super().use_substring_index()
+
+
+def log_out(store, name):
+    """Close an index and wait for its save to be written."""
+    store.close(name)
+    for _ in range(50):
+        entry = store.entries[name]
+        if not store.saves and not entry.saving and not entry.dirty:
+            return
+        time.sleep(0.05)
+
+
+class IndexStoreTest(unittest.TestCase):
+    def test_updates_do_not_wait_for_a_save(self):
+        with tempfile.TemporaryDirectory() as root:
+            store = IndexStore(root)
+            store.open("amy", SlowIndex)
+            self.assertIsNotNone(store.get("amy", 5))
+            store.add_msg("amy", "amy: first")
+            writing.clear()
+            store.close("amy")           # dirty: a save is queued
+            self.assertTrue(writing.wait(5))
+            t = time.perf_counter()
+            store.add_msg("amy", "amy: while saving")
+            self.assertLess(time.perf_counter() - t, 0.2)
+            # the late line is applied once written, and saved again
+            lines = []
+            for _ in range(50):
+                time.sleep(0.1)
+                try:
+                    with open(os.path.join(root, "amy.idx"), "rb") as f:
+                        lines = list(pickle.load(f).msgs)
+                except FileNotFoundError:
+                    continue
+                if len(lines) == 2:
+                    break
+            self.assertEqual(lines, ["amy: first", "amy: while saving"])
+            store.io.shutdown(wait=True)
+
+    def test_ready_before_the_suffix_index_is_built(self):
+        with tempfile.TemporaryDirectory() as root:
+            store = IndexStore(root, substring=True)
+            store.open("amy", SlowBuild)
+            t = time.perf_counter()
+            idx = store.get("amy", 5)
+            self.assertLess(time.perf_counter() - t, 1)
+            store.add_msg("amy", "amy: beloved")
+            self.assertIsNone(idx.substring)
+            self.assertEqual(idx.search("love"), "0: amy: beloved\n")   # scanned
+            building.set()
+            store.builds.shutdown(wait=True)
+            self.assertIsNotNone(idx.substring)
+            self.assertEqual(idx.search("love"), "0: amy: beloved\n")
+
+    def test_a_file_saved_by_another_store_is_reloaded(self):
+        with tempfile.TemporaryDirectory() as root:
+            # two cluster workers sharing one index directory
+            a, b = IndexStore(root), IndexStore(root)
+            a.open("amy")
+            a.get("amy", 5)
+            a.add_msg("amy", "amy: on a")
+            log_out(a, "amy")            # still cached by a
+            b.open("amy")
+            self.assertEqual(list(b.get("amy", 5).msgs), ["amy: on a"])
+            b.add_msg("amy", "amy: on b")
+            b.close("amy")
+            b.io.shutdown(wait=True)
+
+            a.open("amy")                # back on a: b's save must win
+            self.assertEqual(list(a.get("amy", 5).msgs), ["amy: on a", "amy: on b"])
+            a.add_msg("amy", "amy: on a again")
+            a.close("amy")
+            a.io.shutdown(wait=True)
+            with open(os.path.join(root, "amy.idx"), "rb") as f:
+                self.assertEqual(len(pickle.load(f).msgs), 3)
+
+    def test_an_unchanged_file_keeps_the_cached_index(self):
+        with tempfile.TemporaryDirectory() as root:
+            store = IndexStore(root)
+            store.open("amy")
+            idx = store.get("amy", 5)
+            store.add_msg("amy", "amy: hello")
+            log_out(store, "amy")
+            store.open("amy")
+            self.assertIs(store.get("amy", 5), idx)
+            self.assertEqual(store.stats()["misses"], 1)
+            store.io.shutdown(wait=True)
+
+    def test_old_room_files_expire(self):
+        with tempfile.TemporaryDirectory() as root:
+            store = IndexStore(root)
+            for name in ["room-1-1", "room-1-2", "room-1-3", "amy"]:
+                with open(os.path.join(root, f"{name}.idx"), "wb") as f:
+                    pickle.dump(indexer.Index(name), f)
+            old = time.time() - 3600
+            for name in ["room-1-1", "room-1-2", "amy"]:
+                os.utime(os.path.join(root, f"{name}.idx"), (old, old))
+            store.open("room-1-2")       # in use: kept however old
+            store.expire("room-", 60)
+            store.io.shutdown(wait=True)
+            self.assertEqual(sorted(os.listdir(root)),
+                             ["amy.idx", "room-1-2.idx", "room-1-3.idx"])
+            self.assertFalse(store.exists("room-1-1"))
+            self.assertTrue(store.exists("room-1-3"))
+
+
+if __name__ == "__main__":
+    unittest.main()
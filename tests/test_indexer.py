@@ -0,0 +1,59 @@
+import json
+import unittest
+
+import indexer
+from chat_utils import SIZE_SPEC
+
+
+class HistoryTest(unittest.TestCase):
+    def test_pages_fit_in_a_frame(self):
+        idx = indexer.Index("t")
+        lines = [f"amy: {i} " + "漢字テキスト" * 150 for i in range(40)]
+        for i, line in enumerate(lines):
+            idx.add_msg_and_index(line, ts=1000 + i)
+        got, cursor = [], None
+        while True:
+            page, cursor = idx.history(cursor, limit=200)
+            frame = json.dumps({"action": "history", "cursor": cursor,
+                                "more": cursor is not None,
+                                "results": [[n, ts, line] for n, ts, line in page]})
+            self.assertLess(len(frame), indexer.HISTORY_BYTES + 1000)
+            self.assertLess(len(frame), 10 ** SIZE_SPEC)
+            got = [line for _, _, line in page] + got
+            if cursor is None:
+                break
+        self.assertEqual(got, lines)
+
+
+class SpansTest(unittest.TestCase):
+    def setUp(self):
+        self.idx = indexer.Index("t")
+        for line in ["amy: the cat sat", "bo: cat and catalogue",
+                     "amy: nothing here", "bo: the Cat cat"]:
+            self.idx.add_msg_and_index(line)
+
+    def test_every_occurrence_is_marked(self):
+        hits = list(self.idx.search_hits("cat"))
+        self.assertEqual([n for n, _, _ in hits], [0, 1, 3])
+        for _, line, spans in hits:
+            self.assertEqual([line[a:b] for a, b in spans],
+                             ["cat"] * line.count("cat"))
+
+    def test_spans_cover_each_word_of_the_term(self):
+        (n, line, spans), _ = self.idx.search_hits("the cat")
+        self.assertEqual(n, 0)
+        self.assertEqual([line[a:b] for a, b in spans], ["the", "cat"])
+
+    def test_overlapping_matches_are_merged(self):
+        self.assertEqual(indexer.spans("aaaa", ["aa", "aaa"]), [[0, 4]])
+        self.assertEqual(indexer.spans("ab ab", ["b", "a"]), [[0, 2], [3, 5]])
+
+    def test_fuzzy_spans_mark_the_spelling_found(self):
+        hits = {n: (line, spans) for n, line, spans
+                in self.idx.search_hits("catt", fuzzy=True)}
+        line, spans = hits[3]
+        self.assertEqual([line[a:b] for a, b in spans], ["Cat", "cat"])
+
+
+if __name__ == "__main__":
+    unittest.main()
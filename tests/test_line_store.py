@@ -0,0 +1,52 @@
+import pickle
+import unittest
+
+import indexer
+from line_store import LineStore
+
+ODD = ["(31.02.25,11:22) bob : x", "(05.05.25,11:22) jason : hi there", "jason: ",
+       "a:b", "x: y: z", " lead: x", "", "é: ü", "(05.05.25,11:22) jason :no",
+       "(99.99.99,99:99) q : r", "ÿ" * 100]
+
+
+def chat(n):
+    return [f"user{i % 3}: message number {i} about a cat" for i in range(n)]
+
+
+class LineStoreTest(unittest.TestCase):
+    def test_lines_read_back_unchanged(self):
+        st = LineStore(ODD)
+        self.assertEqual(list(st), ODD)
+        self.assertEqual(st[2:5], ODD[2:5])
+        self.assertEqual(st[-1], ODD[-1])
+        self.assertEqual(list(pickle.loads(pickle.dumps(st))), ODD)
+        self.assertEqual(st.index("x: y: z"), 4)
+
+    def test_a_line_costs_its_bytes_and_an_offset(self):
+        lines = chat(100) + ODD
+        st = LineStore(lines)
+        self.assertEqual(st.nbytes, sum(len(line.encode()) + 1 + 4 for line in lines) + 4)
+        self.assertEqual(pickle.loads(pickle.dumps(st)).nbytes, st.nbytes)
+
+    def test_grep_matches_a_scan(self):
+        # common words switch to decoding the rest of the store at once
+        for lines in (chat(40), chat(500), ODD + chat(200)):
+            st = LineStore(lines)
+            words = {w for line in lines for w in line.split()}
+            for word in sorted(words) + ["a", "e", ":", "er", "user1:", "(", "5,1", "zzz"]:
+                truth = [(n, line) for n, line in enumerate(lines) if word in line]
+                self.assertEqual(st.grep(word), truth, word)
+                self.assertEqual(st.find(word), [n for n, _ in truth], word)
+
+    def test_search_matches_a_scan(self):
+        idx = indexer.Index("t")
+        lines = chat(40)
+        for line in lines:
+            idx.add_msg_and_index(line)
+        for word in ("a", ":", "er", "cat", "39"):
+            truth = "".join(f"{n}: {line}\n" for n, line in enumerate(lines) if word in line)
+            self.assertEqual(idx.search(word), truth, word)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,73 @@
+import json
+import time
+import tempfile
+import threading
+import unittest
+
+from chat_utils import SIZE_SPEC
+from mail_store import MailStore
+from query_pool import QueryPool
+
+written = threading.Event()
+
+
+class SlowMail(MailStore):
+    """Its writer waits until told to go on, like a busy disk."""
+
+    def _write(self, name):
+        written.wait(5)
+        super()._write(name)
+
+
+class MailStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.mail = MailStore(self.tmp.name)
+
+    def tearDown(self):
+        self.mail.shutdown()
+        self.tmp.cleanup()
+
+    def sync_all(self, name):
+        got, cursor = [], None
+        while True:
+            res = self.mail.read(name, cursor)
+            frame = json.dumps(dict(res, action="sync"))
+            self.assertLess(len(frame), 10 ** SIZE_SPEC)
+            if not res["results"]:
+                return got
+            got += res["results"]
+            cursor = res["cursor"]
+
+    def test_large_messages_fit_in_a_frame(self):
+        sent = [f"{i} " + "é漢字" * 500 for i in range(100)] + ["a" * 1500] * 100
+        for text in sent:
+            self.mail.post("bob", {"ts": "now", "from": "amy", "message": text})
+        got = self.sync_all("bob")
+        self.assertEqual([r["message"] for r in got], sent)
+        self.assertEqual([r["seq"] for r in got], list(range(1, len(sent) + 1)))
+
+    def test_a_read_waiting_for_the_writer_gives_up_its_turn(self):
+        pool = QueryPool(workers=2, cpu=1)
+        self.addCleanup(pool.shutdown)
+        mail = SlowMail(self.tmp.name, idle=pool.idle)
+        self.addCleanup(mail.shutdown)
+        mail.post("amy", {"seq": 1, "from": "bo", "message": "hi"})
+
+        def disk_done():
+            written.set()
+            return "written"
+
+        pool.submit("amy", None, "sync", None, mail.read, "amy")
+        pool.submit("bo", None, "search", None, disk_done)
+        results = []
+        deadline = time.monotonic() + 3
+        while len(results) < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+            results += [r[4] for r in pool.completed()]
+        self.assertEqual(len(results), 2)
+        self.assertIn("written", results)
+
+
+if __name__ == "__main__":
+    unittest.main()
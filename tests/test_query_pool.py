@@ -0,0 +1,57 @@
+import time
+import threading
+import unittest
+
+from query_pool import QueryPool
+
+
+class QueryPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.pool = QueryPool(workers=4, per_user=4, cpu=1)
+        self.addCleanup(self.pool.shutdown)
+
+    def wait(self, count):
+        results = []
+        deadline = time.monotonic() + 5
+        while len(results) < count and time.monotonic() < deadline:
+            time.sleep(0.01)
+            results += [r[4] for r in self.pool.completed()]
+        return results
+
+    def test_one_query_computes_at_a_time(self):
+        running, most = [], []
+        lock = threading.Lock()
+
+        def scan(n):
+            with lock:
+                running.append(n)
+                most.append(len(running))
+            time.sleep(0.05)
+            with lock:
+                running.remove(n)
+            return n
+
+        for n in range(4):
+            self.assertTrue(self.pool.submit("amy", None, "search", None, scan, n))
+        self.assertEqual(sorted(self.wait(4)), [0, 1, 2, 3])
+        self.assertEqual(max(most), 1)
+
+    def test_waiting_query_gives_up_its_turn(self):
+        loaded = threading.Event()
+
+        def search():
+            with self.pool.idle():
+                # the index is being paged in
+                return "search" if loaded.wait(1) else "stuck"
+
+        def poem():
+            loaded.set()
+            return "poem"
+
+        self.pool.submit("amy", None, "search", None, search)
+        self.pool.submit("bo", None, "poem", None, poem)
+        self.assertEqual(sorted(self.wait(2)), ["poem", "search"])
+
+
+if __name__ == "__main__":
+    unittest.main()
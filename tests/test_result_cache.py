@@ -0,0 +1,68 @@
+import time
+import unittest
+from types import SimpleNamespace
+
+import indexer
+import chat_server
+from result_cache import ResultCache, search_key, poem_key
+
+
+class ResultCacheTest(unittest.TestCase):
+    def test_a_new_message_makes_older_searches_miss(self):
+        cache = ResultCache()
+        idx = indexer.Index("amy")
+        idx.add_msg_and_index("amy: hello")
+        key = search_key("amy", idx, "hello")
+        cache.put(key, "frame 1")
+        self.assertEqual(cache.get(search_key("amy", idx, "  hello ")), "frame 1")
+
+        idx.add_msg_and_index("amy: hello again")
+        self.assertIsNone(cache.get(search_key("amy", idx, "hello")))
+        self.assertEqual(cache.stats()["hits"], 1)
+        self.assertEqual(cache.stats()["misses"], 1)
+
+    def test_room_lines_make_older_searches_miss(self):
+        idx = indexer.Index("amy")
+        key = search_key("amy", idx, "hello", rooms=[("room-1-1", 4)])
+        self.assertEqual(search_key("amy", idx, "hello", rooms=[("room-1-1", 4)]), key)
+        self.assertNotEqual(search_key("amy", idx, "hello", rooms=[("room-1-1", 5)]), key)
+        self.assertNotEqual(search_key("amy", idx, "hello", rooms=[("room-1-2", 4)]), key)
+
+    def test_no_key_while_an_index_is_paged_out_or_a_room_unknown(self):
+        idx = indexer.Index("amy")
+        self.assertIsNone(search_key("amy", None, "hello"))
+        self.assertIsNone(search_key("amy", idx, "hello", rooms=[("room-1-1", None)]))
+
+    def test_rooms_are_keyed_without_their_logs(self):
+        server = SimpleNamespace(room_posts={"room-a-1": 3}, run_id="a", router=None)
+        gen = lambda room: chat_server.Server.room_generation(server, room)
+        self.assertEqual(gen("room-a-1"), 3)
+        self.assertEqual(gen("room-a-2"), "done")        # emptied: final
+        self.assertEqual(gen("room-b-1"), "done")        # an earlier run's
+        server.router = object()
+        self.assertIsNone(gen("room-b-1"))               # a sibling's: may change
+        self.assertEqual(gen("room-a-2"), "done")
+
+    def test_options_and_users_do_not_share_entries(self):
+        idx = indexer.Index("amy")
+        keys = {search_key("amy", idx, "hello"),
+                search_key("amy", idx, "hello", hits=True),
+                search_key("amy", idx, "hello", fuzzy=True),
+                search_key("bo", idx, "hello")}
+        self.assertEqual(len(keys), 4)
+
+    def test_entries_expire_and_least_recent_go_first(self):
+        cache = ResultCache(size=2, ttl=0.05)
+        cache.put(poem_key(1), "one")
+        cache.put(poem_key(2), "two")
+        cache.get(poem_key(1))
+        cache.put(poem_key(3), "three")          # drops 2, used least recently
+        self.assertIsNone(cache.get(poem_key(2)))
+        self.assertEqual(cache.get(poem_key(1)), "one")
+        time.sleep(0.06)
+        self.assertIsNone(cache.get(poem_key(3)))
+        self.assertEqual(cache.stats()["entries"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,137 @@
+import os
+import json
+import time
+import select
+import signal
+import socket
+import tempfile
+import unittest
+from unittest import mock
+
+import chat_server
+from chat_utils import mysend, myrecv
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class Client:
+    def __init__(self, addr):
+        self.s = socket.create_connection(addr)
+
+    def send(self, **msg):
+        mysend(self.s, json.dumps(msg))
+
+    def recv(self, timeout=3):
+        ready, _, _ = select.select([self.s], [], [], timeout)
+        if not ready:
+            return None
+        raw = myrecv(self.s)
+        return json.loads(raw) if raw else None
+
+    def recv_action(self, action):
+        while True:
+            msg = self.recv()
+            if msg is None or msg.get("action") == action:
+                return msg
+
+    def close(self):
+        self.s.close()
+
+
+def serve(index_dir, grace):
+    """Fork a chat server on a spare port; return its pid and address."""
+    r, w = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.close(r)
+            os.chdir(ROOT)               # the sonnets are read from here
+            with mock.patch.object(chat_server, "SERVER", ("127.0.0.1", 0)):
+                server = chat_server.Server(index_dir=index_dir, admin_port=0,
+                                            resume_grace=grace)
+            os.write(w, b"%d" % server.server.getsockname()[1])
+            os.close(w)
+            server.run()
+        finally:
+            os._exit(0)
+    os.close(w)
+    with os.fdopen(r, "rb") as f:
+        port = int(f.read() or 0)
+    return pid, ("127.0.0.1", port)
+
+
+@unittest.skipUnless(hasattr(os, "fork"), "the test server is forked")
+class ResumeTest(unittest.TestCase):
+    """A chat server on a spare port, with a short resume grace."""
+
+    GRACE = 0.5
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        pid, self.addr = serve(tmp.name, self.GRACE)
+        self.addCleanup(os.waitpid, pid, 0)
+        self.addCleanup(os.kill, pid, signal.SIGKILL)
+        self.assertTrue(self.addr[1], "the server did not start")
+
+    def login(self, name):
+        c = Client(self.addr)
+        self.addCleanup(c.close)
+        c.send(action="login", name=name)
+        reply = c.recv_action("login")
+        self.assertEqual(reply["status"], "ok")
+        return c, reply["session"]
+
+    def chat(self):
+        amy, token = self.login("amy")
+        bo, _ = self.login("bo")
+        amy.send(action="connect", target="bo")
+        self.assertEqual(amy.recv_action("connect")["status"], "success")
+        self.assertEqual(bo.recv_action("connect")["status"], "request")
+        return amy, token, bo
+
+    def test_a_dropped_client_resumes_with_what_it_missed(self):
+        amy, token, bo = self.chat()
+        amy.close()
+        time.sleep(0.1)
+        bo.send(action="exchange", message="while you were gone")
+
+        again = Client(self.addr)
+        self.addCleanup(again.close)
+        again.send(action="resume", session=token)
+        self.assertEqual(again.recv(), {"action": "resume", "status": "ok",
+                                        "name": "amy"})
+        missed = again.recv_action("exchange")
+        self.assertEqual(missed["message"], "while you were gone")
+        # still in the chat, without logging in again
+        again.send(action="exchange", message="back")
+        self.assertEqual(bo.recv_action("exchange")["message"], "back")
+
+    def test_an_unknown_session_may_log_in_instead(self):
+        c = Client(self.addr)
+        self.addCleanup(c.close)
+        c.send(action="resume", session="nonsense")
+        self.assertEqual(c.recv()["status"], "expired")
+        c.send(action="login", name="kim")
+        self.assertEqual(c.recv_action("login")["status"], "ok")
+
+    def test_after_the_grace_the_missed_lines_are_mail(self):
+        amy, token, bo = self.chat()
+        amy.close()
+        time.sleep(0.1)
+        bo.send(action="exchange", message="too late")
+        time.sleep(self.GRACE + 0.3)
+
+        again = Client(self.addr)
+        self.addCleanup(again.close)
+        again.send(action="resume", session=token)
+        self.assertEqual(again.recv()["status"], "expired")
+        again.send(action="login", name="amy")
+        self.assertEqual(again.recv_action("login")["status"], "ok")
+        again.send(action="sync")
+        mail = again.recv_action("sync")
+        self.assertEqual([m["message"] for m in mail["results"]], ["too late"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,95 @@
+import time
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+import indexer
+import room_index
+import chat_server
+from index_store import IndexStore
+from room_index import RoomLog
+
+
+class RoomSearchTest(unittest.TestCase):
+    def test_hits_point_at_one_line_each(self):
+        own = indexer.Index("amy")
+        room = RoomLog("room-1-1")
+        members = ["amy", "bo", "kim"]
+        for i in range(6):
+            for who in members:
+                line = f"{who}: hello {i}"
+                room.post(line, members)
+                if who == "amy":
+                    own.add_msg_and_index(line)
+        sources = [(own, None), (room, room.visible("amy"))]
+        found = list(room_index.search(sources, "hello", skip="amy: "))
+
+        self.assertEqual(len(found), 18)     # 6 of amy's own, 12 from the room
+        places = [(k, n) for k, n, _, _ in found]
+        self.assertEqual(len(set(places)), len(places))
+        for k, n, line, _ in found:
+            self.assertEqual(sources[k][0].msgs[n], line)
+        # plain line numbers alone would collide
+        self.assertLess(len({n for _, n in places}), len(places))
+
+    def test_several_words_from_several_logs_come_out_by_time(self):
+        now = time.time()
+        own = indexer.Index("amy")
+        # "catalogue" holds "cat" but is not the word: line 0 is found
+        # through the postings of "sat", after line 1
+        own.add_msg_and_index("amy: catalogue sat", ts=now - 100)
+        own.add_msg_and_index("amy: the cat sat", ts=now + 100)
+        rooms = [RoomLog("room-1-1"), RoomLog("room-1-2")]
+        for room, line in zip(rooms, ["bo: catalogue sat", "kim: the cat sat"]):
+            room.post(line, ["amy", "bo", "kim"])
+            room.post("bo: unrelated", ["amy", "bo", "kim"])
+        sources = [(own, None)] + [(room, room.visible("amy")) for room in rooms]
+        found = list(room_index.search(sources, "cat sat", skip="amy: "))
+
+        self.assertEqual([(k, n) for k, n, _, _ in found], [(0, 0), (1, 0), (2, 0), (0, 1)])
+        stamps = [sources[k][0].times[n] for k, n, _, _ in found]
+        self.assertEqual(stamps, sorted(stamps))
+
+    def test_empty_ranges_are_left_out(self):
+        room = RoomLog("room-1-1")
+        room.post("bo: hello", ["bo"])
+        room.post("bo: hello again", ["amy", "bo"])
+        room.post("amy: bye", ["bo"])
+        self.assertEqual(room.visible("amy"), [(1, 2)])
+        room.sync(["amy", "bo"])         # back, with nothing said since
+        self.assertEqual(room.ranges["amy"], [[1, 2], [3, None]])
+        self.assertEqual(room.visible("amy"), [(1, 2)])
+        self.assertEqual(room.visible("kim"), [])
+
+
+
+class RoomListTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.store = IndexStore(tmp.name)
+        self.addCleanup(self.store.io.shutdown, wait=True)
+        self.server = SimpleNamespace(
+            indices=self.store,
+            wait_index=lambda name, kind=None: self.store.get(name, 5, kind),
+            stream=lambda chunks, empty: "".join(chunks) or empty)
+
+    def search(self, name, term):
+        return chat_server.Server.search(self.server, name, term)
+
+    def test_rooms_that_are_gone_or_hold_nothing_are_forgotten(self):
+        self.store.open("amy")
+        for room in ["room-1-1", "room-1-2"]:
+            self.store.open(room, RoomLog)
+        for room in ["room-1-1", "room-1-2", "room-1-3"]:  # room-1-3 has expired
+            self.store.update("amy", "join_room", room)
+        self.store.update("room-1-1", "post", "bo: hello", ["amy", "bo"])
+        self.store.update("room-1-2", "post", "bo: hello", ["bo"])
+
+        self.assertEqual(self.search("amy", "hello"), "room-1-1:0: bo: hello\n")
+        self.assertEqual(self.store.get("amy", 5).rooms, ["room-1-1"])
+        self.assertFalse(self.store.exists("room-1-3"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,120 @@
+import random
+import unittest
+from unittest import mock
+
+import indexer
+import term_dict
+from term_dict import TermDict, edit_distance, fuzzy_distance
+
+COUNTS = {"beauty": 5, "beauteous": 2, "beautie": 1, "be": 9, "bounty": 3,
+          "beast": 4, "duty": 6}
+
+
+class CompletionTest(unittest.TestCase):
+    def setUp(self):
+        self.terms = TermDict(COUNTS)
+
+    def test_prefix_gives_the_most_frequent_first(self):
+        self.assertEqual(self.terms.prefix("beaut"),
+                         [("beauty", 5), ("beauteous", 2), ("beautie", 1)])
+        self.assertEqual(self.terms.prefix("beaut", 2),
+                         [("beauty", 5), ("beauteous", 2)])
+        self.assertEqual(self.terms.prefix("x"), [])
+        self.assertEqual(len(self.terms.prefix("")), len(COUNTS))
+
+    def test_prefix_agrees_with_a_scan(self):
+        rng = random.Random(7)
+        counts = {"".join(rng.choice("abc") for _ in range(rng.randint(1, 6))):
+                  rng.randint(1, 50) for _ in range(500)}
+        terms = TermDict(counts)
+        for prefix in ["", "a", "ab", "cab", "bbb", "cc"]:
+            got = terms.prefix(prefix, 7)
+            want = sorted((w for w in counts if w.startswith(prefix)),
+                          key=lambda w: -counts[w])[:7]
+            self.assertEqual([f for _, f in got], [counts[w] for w in want])
+            self.assertTrue(all(w.startswith(prefix) for w, _ in got))
+
+    def test_wildcards(self):
+        self.assertEqual(self.terms.wildcard("b*ty"), [("beauty", 5), ("bounty", 3)])
+        self.assertEqual(self.terms.wildcard("*ty"),
+                         [("duty", 6), ("beauty", 5), ("bounty", 3)])
+        self.assertEqual(self.terms.wildcard("b??st"), [("beast", 4)])
+        self.assertEqual(self.terms.wildcard("z*"), [])
+
+    def test_suggest_tells_prefixes_from_patterns(self):
+        self.assertEqual(self.terms.suggest("beaut*"), self.terms.prefix("beaut"))
+        self.assertEqual(self.terms.suggest("b*y"), [("beauty", 5), ("bounty", 3)])
+
+    def test_an_index_rebuilds_its_dictionary_when_it_changes(self):
+        idx = indexer.Index("t")
+        idx.add_msg_and_index("amy: hello there")
+        terms = idx.term_dict()
+        self.assertIs(idx.term_dict(), terms)
+        idx.add_msg_and_index("amy: hello hello again")
+        self.assertIsNot(idx.term_dict(), terms)
+        self.assertEqual(idx.term_dict().prefix("hel"), [("hello", 2)])
+
+
+def osa(a, b):
+    """Edit distance with swaps of neighbours, the full table."""
+    d = [[i + j if i * j == 0 else 0 for j in range(len(b) + 1)]
+         for i in range(len(a) + 1)]
+    for i in range(1, len(a) + 1):
+        for j in range(1, len(b) + 1):
+            d[i][j] = min(d[i - 1][j] + 1, d[i][j - 1] + 1,
+                          d[i - 1][j - 1] + (a[i - 1] != b[j - 1]))
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                d[i][j] = min(d[i][j], d[i - 2][j - 2] + 1)
+    return d[len(a)][len(b)]
+
+
+class FuzzyTest(unittest.TestCase):
+    def test_edit_distance_is_exact_up_to_the_bound(self):
+        rng = random.Random(3)
+        for _ in range(2000):
+            a = "".join(rng.choice("abc") for _ in range(rng.randint(0, 7)))
+            b = "".join(rng.choice("abc") for _ in range(rng.randint(0, 7)))
+            k = rng.randint(0, 3)
+            d = osa(a, b)
+            self.assertEqual(edit_distance(a, b, k), d if d <= k else None,
+                             (a, b, k))
+
+    def test_longer_words_allow_more_edits(self):
+        self.assertEqual([fuzzy_distance(n) for n in (1, 2, 3, 5, 6, 12)],
+                         [0, 0, 1, 1, 2, 2])
+
+    def test_matches_stay_within_the_distance(self):
+        terms = TermDict({"thou": 9, "thee": 8, "thine": 7, "beauty": 5,
+                          "beauteous": 2, "thy": 9})
+        self.assertEqual(terms.fuzzy("beautie")[0], ("beauty", 5, 2))
+        self.assertEqual(terms.fuzzy("Thuo"), [("thou", 9, 1)])
+        for word, _, d in terms.fuzzy("thien", max_dist=2):
+            self.assertEqual(d, osa("thien", word))
+            self.assertLessEqual(d, 2)
+        self.assertEqual(terms.fuzzy("zzzz"), [])
+
+    def test_verification_is_capped(self):
+        # a thousand words one edit from the query, but only so many checked
+        counts = {f"word{i:03d}": i + 1 for i in range(1000)}
+        terms = TermDict(counts)
+        with mock.patch.object(term_dict, "FUZZY_VERIFY", 5), \
+                mock.patch.object(term_dict, "edit_distance",
+                                  wraps=term_dict.edit_distance) as checked:
+            found = terms.fuzzy("word00x", limit=50)
+        self.assertLessEqual(checked.call_count, 5)
+        self.assertLessEqual(len(found), 5)
+
+    def test_common_trigrams_are_skipped_past_the_budget(self):
+        # "$xa" and "xab" are in every word: the rare trigrams decide
+        counts = {f"xab{i:04d}": 1 for i in range(3000)}
+        counts["xabqr"] = 1
+        terms = TermDict(counts)
+        with mock.patch.object(term_dict, "GRAM_BUDGET", 100), \
+                mock.patch.object(term_dict, "edit_distance",
+                                  wraps=term_dict.edit_distance) as checked:
+            self.assertEqual(terms.fuzzy("xabqs"), [("xabqr", 1, 1)])
+        self.assertEqual(checked.call_count, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()